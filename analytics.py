@@ -0,0 +1,353 @@
+import heapq
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+from locks import FileLock
+from storage import LOCK_DIR_NAME, cached_load, remember, save_json
+
+# -------------------------
+# Circulation rollups
+# -------------------------
+# Analytics read small rollup tables instead of the loan history:
+#   books   book id -> [issues, returns, loan days of returned loans, returned late]
+#   genres  genre   -> [issues, loans open right now]
+#   months  YYYY-MM -> [issues (by issue month), returns, returned late,
+#                       fines collected (by return month)]
+#   open    "<book id>:<user>" of every loan open as far as the rollups know
+# Issue and return append one event line each to a log; readers keep the
+# rollups in memory and fold in only the lines appended since they last
+# looked. Once the log outgrows COMPACT_BYTES it is folded into a new snapshot
+# generation and a fresh log is started. rebuild() recomputes everything from
+# the loan history in one vectorized NumPy pass, for the first run and after
+# writes that bypassed the app (imports, save_issued). Issue events also name
+# the borrower ("u", on both kinds) so other followers of the log (the
+# co-borrow counts) can pick up new loans from it via events_since().
+#
+# Events are appended after the loan is committed, outside any storage lock,
+# so a rebuild's history read and the log can overlap. apply() is idempotent
+# against that: an issue counts only if its loan is not already open in the
+# rollups, and a return only if it is.
+
+SNAPSHOT_NAME = "analytics.json"
+LOG_PREFIX = "analytics."
+COMPACT_BYTES = 1024 * 1024
+
+
+def issue_event(book_id: int, genres: List[str], issue_date: str, user_email: str) -> Dict[str, Any]:
+    return {"e": "issue", "b": book_id, "g": list(genres), "i": issue_date, "u": user_email}
+
+
+def return_event(loan: Dict[str, Any], genres: List[str], return_date: str, fine: int) -> Dict[str, Any]:
+    return {"e": "return", "b": loan['book_id'], "g": list(genres), "i": loan['issue_date'],
+            "d": loan['due_date'], "r": return_date, "f": fine, "u": loan['user_email'].lower()}
+
+
+def _open_key(book_id: int, user_email: str) -> str:
+    return f"{book_id}:{user_email.lower()}"
+
+
+def _days(a: str, b: str) -> int:
+    # whole days from ISO date a to ISO date b
+    return int((np.datetime64(b[:10], "D") - np.datetime64(a[:10], "D")).astype(np.int64))
+
+
+class Rollups:
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        data = data or {}
+        self.books: Dict[str, List[int]] = {k: list(v) for k, v in data.get('books', {}).items()}
+        self.genres: Dict[str, List[int]] = {k: list(v) for k, v in data.get('genres', {}).items()}
+        self.months: Dict[str, List[int]] = {k: list(v) for k, v in data.get('months', {}).items()}
+        self.open: set = set(data.get('open', ()))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"books": self.books, "genres": self.genres, "months": self.months, "open": sorted(self.open)}
+
+    def _row(self, table: Dict[str, List[int]], key, width: int) -> List[int]:
+        row = table.get(key)
+        if row is None:
+            row = table[key] = [0] * width
+        return row
+
+    def apply(self, ev: Dict[str, Any]):
+        loan = _open_key(ev['b'], ev['u'])
+        if (ev['e'] == "issue") == (loan in self.open):
+            # already counted (by a rebuild that read this loan), or a return
+            # of a loan the rollups never saw open
+            return
+        book = self._row(self.books, str(ev['b']), 4)
+        if ev['e'] == "issue":
+            self.open.add(loan)
+            book[0] += 1
+            for g in ev['g']:
+                genre = self._row(self.genres, g, 2)
+                genre[0] += 1
+                genre[1] += 1
+            self._row(self.months, ev['i'][:7], 4)[0] += 1
+        elif ev['e'] == "return":
+            self.open.discard(loan)
+            late = 1 if ev['r'][:10] > ev['d'][:10] else 0
+            book[1] += 1
+            book[2] += _days(ev['i'], ev['r'])
+            book[3] += late
+            for g in ev['g']:
+                self._row(self.genres, g, 2)[1] -= 1
+            month = self._row(self.months, ev['r'][:7], 4)
+            month[1] += 1
+            month[2] += late
+            month[3] += ev['f']
+
+    def summary(self, title_of: Callable[[int], Optional[str]], genre_sizes: Dict[str, int],
+                top: int = 10) -> Dict[str, Any]:
+        issues = sum(r[0] for r in self.books.values())
+        returns = sum(r[1] for r in self.books.values())
+        loan_days = sum(r[2] for r in self.books.values())
+        late = sum(r[3] for r in self.books.values())
+        most = heapq.nlargest(top, self.books.items(), key=lambda kv: (kv[1][0], -int(kv[0])))
+        genres = []
+        for g, (g_issues, active) in sorted(self.genres.items(), key=lambda kv: -kv[1][0]):
+            size = genre_sizes.get(g, 0)
+            genres.append({"genre": g, "issues": g_issues, "on_loan": active, "books": size,
+                           "utilization": round(active / size, 4) if size else None})
+        return {
+            "total_issues": issues,
+            "total_returns": returns,
+            "avg_loan_days": round(loan_days / returns, 2) if returns else None,
+            "returned_late_rate": round(late / returns, 4) if returns else None,
+            "fines_collected": sum(m[3] for m in self.months.values()),
+            "most_borrowed": [{"book_id": int(k), "title": title_of(int(k)) or f"Book #{k}", "issues": r[0]}
+                              for k, r in most if r[0]],
+            "genres": genres,
+            "months": [{"month": m, "issues": r[0], "returns": r[1], "returned_late": r[2], "fines": r[3]}
+                       for m, r in sorted(self.months.items())],
+        }
+
+
+def rebuild(history: List[Dict[str, Any]], genres_of: Callable[[int], Iterable[str]],
+            fine_per_day: int) -> Rollups:
+    # the same tables apply() builds event by event, from the loan history
+    out = Rollups()
+    if not history:
+        return out
+    book = np.array([r['book_id'] for r in history])
+    returned = np.array([bool(r.get('returned', False) and r.get('return_date')) for r in history])
+    issued = np.array([r['issue_date'][:10] for r in history], dtype="datetime64[D]")
+    due = np.array([r['due_date'][:10] for r in history], dtype="datetime64[D]")
+    back = np.array([r['return_date'][:10] if ok else "NaT" for r, ok in zip(history, returned)],
+                    dtype="datetime64[D]")
+    late = returned & (back > due)
+    loan_days = np.where(returned, (back - issued).astype(np.int64), 0)
+    fines = np.where(late, (back - due).astype(np.int64), 0) * fine_per_day
+    out.open = {_open_key(r['book_id'], r['user_email']) for r, ok in zip(history, returned) if not ok}
+
+    ids, at = np.unique(book, return_inverse=True)
+    n = len(ids)
+    per_book = np.stack([np.bincount(at, minlength=n),
+                         np.bincount(at, weights=returned, minlength=n),
+                         np.bincount(at, weights=loan_days, minlength=n),
+                         np.bincount(at, weights=late, minlength=n)], axis=1).astype(np.int64)
+    for book_id, row in zip(ids.tolist(), per_book.tolist()):
+        out.books[str(book_id)] = row
+        for g in genres_of(book_id):
+            genre = out._row(out.genres, g, 2)
+            genre[0] += row[0]
+            genre[1] += row[0] - row[1]
+
+    issue_months, at = np.unique(issued.astype("datetime64[M]"), return_inverse=True)
+    for month, count in zip(issue_months.astype(str).tolist(), np.bincount(at).tolist()):
+        out._row(out.months, month, 4)[0] = count
+    if returned.any():
+        back_months, at = np.unique(back[returned].astype("datetime64[M]"), return_inverse=True)
+        m = len(back_months)
+        counts = np.stack([np.bincount(at, minlength=m),
+                           np.bincount(at, weights=late[returned], minlength=m),
+                           np.bincount(at, weights=fines[returned], minlength=m)], axis=1).astype(np.int64)
+        for month, (n_back, n_late, fined) in zip(back_months.astype(str).tolist(), counts.tolist()):
+            row = out._row(out.months, month, 4)
+            row[1], row[2], row[3] = n_back, n_late, fined
+    return out
+
+
+class RollupStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        lock_dir = os.path.join(os.path.dirname(os.path.abspath(directory)), LOCK_DIR_NAME)
+        os.makedirs(lock_dir, exist_ok=True)
+        self.lock = FileLock(os.path.join(lock_dir, "analytics.lock"))
+        self._guard = threading.Lock()
+        # (generation, log offset folded in, rollups) as of the last read
+        self._state = None
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.directory, SNAPSHOT_NAME)
+
+    def _log_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"{LOG_PREFIX}{generation}.log")
+
+    def _read_snapshot(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _snapshot(self) -> Optional[Dict[str, Any]]:
+        # parsed once per snapshot file version; treat as read-only
+        return cached_load(self.snapshot_path, self._read_snapshot)
+
+    def _generation(self) -> Optional[int]:
+        snap = self._snapshot()
+        return snap['generation'] if snap else None
+
+    def _current(self) -> Optional[Rollups]:
+        # caller holds _guard; the live rollups, caught up with the log
+        for _ in range(3):
+            state = self._state
+            if state is None or not os.path.exists(self._log_path(state[0])):
+                # first read, or another process compacted into a new generation
+                snap = self._snapshot()
+                if snap is None:
+                    return None
+                state = (snap['generation'], 0, Rollups(snap['rollups']))
+            generation, offset, rollups = state
+            try:
+                with open(self._log_path(generation), "rb") as f:
+                    f.seek(offset)
+                    tail = f.read()
+            except FileNotFoundError:
+                self._state = None
+                continue
+            # only whole lines: a writer may be mid-append
+            end = tail.rfind(b"\n") + 1
+            for line in tail[:end].splitlines():
+                rollups.apply(json.loads(line))
+            self._state = (generation, offset + end, rollups)
+            return rollups
+        return None
+
+    def rollups(self) -> Optional[Rollups]:
+        # a private copy; None until the first rebuild()
+        with self._guard:
+            current = self._current()
+            return Rollups(current.to_dict()) if current is not None else None
+
+    def summary(self, title_of: Callable[[int], Optional[str]], genre_sizes: Dict[str, int],
+                top: int = 10) -> Optional[Dict[str, Any]]:
+        # read under the guard so no other thread folds events in mid-summary
+        with self._guard:
+            current = self._current()
+            return current.summary(title_of, genre_sizes, top) if current is not None else None
+
+    def events_since(self, cursor) -> Optional[Tuple[List[Dict[str, Any]], tuple]]:
+        # the events appended after `cursor` and the cursor to pass next time;
+        # None when there is no snapshot yet or the cursor's log was compacted
+        # or replaced, i.e. the caller has to start over from the history.
+        # cursor None returns no events, just the current end of the log.
+        snap = self._snapshot()
+        if snap is None or (cursor is not None and cursor[:2] != (self.directory, snap['generation'])):
+            return None
+        offset = cursor[2] if cursor is not None else 0
+        try:
+            with open(self._log_path(snap['generation']), "rb") as f:
+                f.seek(offset)
+                tail = f.read()
+        except FileNotFoundError:
+            return None
+        end = tail.rfind(b"\n") + 1
+        events = [json.loads(line) for line in tail[:end].splitlines()] if cursor is not None else []
+        return events, (self.directory, snap['generation'], offset + end)
+
+    def record(self, events: List[Dict[str, Any]]):
+        if not events:
+            return
+        payload = "".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in events)
+        with self.lock:
+            generation = self._generation()
+            if generation is None:
+                # nothing to add to yet; the first rebuild() reads the history
+                return
+            path = self._log_path(generation)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(payload)
+                size = f.tell()
+            metrics.inc("library_analytics_events_total", len(events))
+            if size > COMPACT_BYTES:
+                rollups = self.rollups()
+                if rollups is not None:
+                    self._write(rollups, generation + 1)
+
+    def replace(self, rollups: Rollups, since=None) -> bool:
+        # `since` is the events_since(None) cursor taken before the history
+        # behind `rollups` was read; the events appended after it are folded
+        # in first. False (nothing written) if that log is gone by now.
+        with self.lock:
+            generation = self._generation()
+            if since is not None:
+                got = self.events_since(since)
+                if got is None:
+                    return False
+                for ev in got[0]:
+                    rollups.apply(ev)
+            self._write(rollups, 0 if generation is None else generation + 1)
+            return True
+
+    def _write(self, rollups: Rollups, generation: int):
+        # caller holds the lock; the new generation starts with an empty log
+        open(self._log_path(generation), "a").close()
+        snap = {"generation": generation, "rollups": Rollups(rollups.to_dict()).to_dict()}
+        save_json(self.snapshot_path, snap)
+        remember(self.snapshot_path, snap)
+        with self._guard:
+            self._state = (generation, 0, Rollups(snap['rollups']))
+        for name in os.listdir(self.directory):
+            if name.startswith(LOG_PREFIX) and name.endswith(".log") and name != os.path.basename(
+                    self._log_path(generation)):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+# -------------------------
+# Process-wide store
+# -------------------------
+_sizes: Dict[str, int] = {}
+_sizes_version = None
+_sizes_lock = threading.Lock()
+
+
+def genre_sizes(catalog, version) -> Dict[str, int]:
+    # books per genre (the utilization denominator), recounted only when the
+    # catalog version moves
+    global _sizes, _sizes_version
+    with _sizes_lock:
+        if version != _sizes_version:
+            sizes: Dict[str, int] = {}
+            for b in catalog:
+                for g in b.genres:
+                    sizes[g] = sizes.get(g, 0) + 1
+            _sizes, _sizes_version = sizes, version
+        return _sizes
+
+
+_stores: Dict[str, RollupStore] = {}
+_stores_lock = threading.Lock()
+
+
+def rollup_store(directory: str) -> RollupStore:
+    key = os.path.abspath(directory)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = RollupStore(directory)
+        return store
+
+
+metrics.describe("library_analytics_events_total", "counter", "Circulation events added to the rollups")
+metrics.describe("library_analytics_dropped_total", "counter", "Circulation events lost to a busy rollup lock")
@@ -0,0 +1,411 @@
+import io
+import tempfile
+import time
+import zlib
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool as _run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+import bulk
+import covers
+import metrics
+from app import (API_TOKEN_TTL, APP_TITLE, BUSY_MESSAGE, COBORROW_WEIGHT, DEFAULT_LOAN_DAYS, MAX_BATCH_SIZE,
+                 STORAGE_MODE, add_favorite, also_borrowed, archive_months, archived_loans, bootstrap_files,
+                 catalog_models, circulation_analytics, cover_path, export_catalog, export_loans,
+                 favorite_books, feed_store, fines_for_records, get_book, get_book_details, get_storage,
+                 get_user, import_books, issue_book_to_user, issue_books, issue_token, loans_due_within,
+                 login_user, notification_scheduler, overdue_with_fines, recommend_for_user,
+                 remove_favorite, return_book_from_user, return_books, search_books, sheets_scheduler,
+                 signup_user, similar_books, suggest_titles, token_user, user_active_issues,
+                 user_notifications)
+
+# -------------------------
+# REST API
+# -------------------------
+# Run with `python app.py api` (or `uvicorn api:api`). The API lives in its
+# own module so Streamlit sessions never import FastAPI; the logic it serves
+# is app.py's, imported without Streamlit (see app.st). Handlers are async and
+# push the blocking storage work to the thread pool. Catalog reads carry an
+# ETag derived from the storage's books version, so polling clients that send
+# If-None-Match get a 304 without the catalog being read at all.
+#
+# Calls made for a user send the token from POST /login as
+# `Authorization: Bearer <token>` and act for that account; librarian calls
+# need a librarian's token. Books go out as PUBLIC_BOOK_FIELDS only, so who
+# holds a book and storage-internal fields (e.g. compact "_details") stay in.
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+IMPORT_SPOOL_BYTES = 8 * 1024 * 1024
+# the catalog export's columns
+PUBLIC_BOOK_FIELDS = tuple(bulk.BOOK_FIELDS)
+
+async def run_in_threadpool(fn, *args, **kwargs):
+    # the worker-thread part of a request is where the time goes, so that is
+    # what a requested profile (see metrics.PROFILE_DIR) records
+    return await _run_in_threadpool(metrics.profile_call, fn, *args, **kwargs)
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    await run_in_threadpool(bootstrap_files)
+    schedulers = [notification_scheduler(), sheets_scheduler()]
+    yield
+    for scheduler in filter(None, schedulers):
+        scheduler.stop()
+
+api = FastAPI(title=APP_TITLE, lifespan=lifespan)
+
+if metrics.ENABLED or metrics.PROFILE_DIR:
+    @api.middleware("http")
+    async def instrument(request: Request, call_next):
+        profiles = None
+        if metrics.PROFILE_DIR and "1" in (request.headers.get("x-profile"), request.query_params.get("profile")):
+            profiles = metrics.start_profile()
+        started = time.perf_counter()
+        status = 500
+        response = None
+        with metrics.scope() as calls:
+            try:
+                response = await call_next(request)
+                status = response.status_code
+            finally:
+                # route template, not the raw path, to keep label cardinality bounded
+                route = getattr(request.scope.get("route"), "path", "unmatched")
+                metrics.observe("library_http_request_seconds", time.perf_counter() - started,
+                                method=request.method, route=route)
+                metrics.inc("library_http_requests_total", method=request.method, route=route, status=status)
+                metrics.observe_storage_calls(calls, route=route)
+        if profiles is not None:
+            dumped = metrics.dump_profile(profiles, f"{request.method}-{request.url.path}")
+            if dumped:
+                response.headers["X-Profile-Path"] = dumped
+        return response
+
+class LoginRequest(BaseModel):
+    email: str
+    password: str
+
+class SignupRequest(BaseModel):
+    name: str
+    email: str
+    password: str
+    role: str = "user"
+
+class LoanRequest(BaseModel):
+    book_id: int
+    loan_days: int = DEFAULT_LOAN_DAYS
+
+class BookRequest(BaseModel):
+    book_id: int
+
+def _catalog_etag(request: Request) -> str:
+    query = zlib.crc32(str(request.url.query).encode())
+    return f'W/"{STORAGE_MODE}-{get_storage().books_version()}-{query:08x}"'
+
+async def _cached_catalog_response(request: Request, build):
+    etag = await run_in_threadpool(_catalog_etag, request)
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag})
+    body = await run_in_threadpool(build)
+    return JSONResponse(body, headers={"ETag": etag})
+
+def _public_book(b: Dict[str,Any]) -> Dict[str,Any]:
+    return {k: b[k] for k in PUBLIC_BOOK_FIELDS if k in b}
+
+def _public_books(books: List[Dict[str,Any]]) -> List[Dict[str,Any]]:
+    return [_public_book(b) for b in books]
+
+def _require_user(request: Request) -> Dict[str,Any]:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    u = token_user(token.strip()) if scheme.lower() == "bearer" else None
+    if not u:
+        raise HTTPException(status_code=401, detail="Log in (POST /login) and send the token as a Bearer credential.",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return u
+
+def _require_librarian(request: Request) -> Dict[str,Any]:
+    u = _require_user(request)
+    if u.get('role') != "librarian":
+        raise HTTPException(status_code=403, detail="Librarians only.")
+    return u
+
+def _require_account(request: Request, email: str) -> Dict[str,Any]:
+    # the account itself, or a librarian looking at it
+    u = _require_user(request)
+    if u['email'] != email.lower() and u.get('role') != "librarian":
+        raise HTTPException(status_code=403, detail="Not your account.")
+    return u
+
+def _require_format(fmt: str) -> str:
+    if fmt not in bulk.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(bulk.FORMATS)}")
+    return fmt
+
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+def list_books(offset: int = 0, limit: int = API_PAGE_SIZE, genre: Optional[str] = None,
+               author: Optional[str] = None, available: Optional[bool] = None) -> Dict[str,Any]:
+    genre_l = genre.lower() if genre else None
+    author_l = author.lower() if author else None
+    matches = [b for b in catalog_models() if b.matches(genre_l, author_l, available)]
+    return {"total": len(matches), "offset": offset, "limit": limit,
+            "items": [_public_book(b.to_dict()) for b in matches[offset:offset + limit]]}
+
+@api.get("/")
+async def home():
+    return {"message": "📚 Library Management System API running"}
+
+@api.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled.")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@api.get("/books")
+async def books_endpoint(request: Request, offset: int = 0, limit: int = API_PAGE_SIZE,
+                         genre: Optional[str] = None, author: Optional[str] = None,
+                         available: Optional[bool] = None):
+    offset = max(0, offset)
+    limit = max(1, min(limit, API_MAX_PAGE_SIZE))
+    return await _cached_catalog_response(request, lambda: list_books(offset, limit, genre, author, available))
+
+@api.get("/books/{book_id}")
+async def book_endpoint(request: Request, book_id: int):
+    def build():
+        b = get_book_details(book_id)
+        if not b:
+            raise HTTPException(status_code=404, detail="Book not found.")
+        return _public_book(b)
+    return await _cached_catalog_response(request, build)
+
+@api.get("/search")
+async def search_endpoint(request: Request, q: str, limit: int = 20):
+    limit = max(1, min(limit, API_MAX_PAGE_SIZE))
+    return await _cached_catalog_response(
+        request, lambda: {"query": q, "items": _public_books(search_books(q, limit=limit, prefix_last=True))})
+
+@api.get("/suggest")
+async def suggest(q: str, limit: int = 8):
+    return {"query": q, "suggestions": await run_in_threadpool(suggest_titles, q, max(1, min(limit, 50)))}
+
+@api.post("/login")
+async def login(req: LoginRequest):
+    def run():
+        u = login_user(req.email, req.password)
+        if not u:
+            raise HTTPException(status_code=401, detail="Invalid email or password.")
+        return {"token": issue_token(u['email']), "token_type": "bearer", "expires_in": API_TOKEN_TTL,
+                "user": {k: u[k] for k in ("name", "email", "role") if k in u}}
+    return await run_in_threadpool(run)
+
+@api.get("/users/{email}/loans")
+async def loans_endpoint(request: Request, email: str, active_only: bool = True):
+    def build():
+        _require_account(request, email)
+        if not get_user(email):
+            raise HTTPException(status_code=404, detail="User not found.")
+        loans = user_active_issues(email) if active_only else get_storage().user_loans(email)
+        fines = fines_for_records(loans)
+        return {"email": email.lower(), "items": [dict(r, fine=f) for r, f in zip(loans, fines)]}
+    return await run_in_threadpool(build)
+
+@api.get("/users/{email}/notifications")
+async def notifications_endpoint(request: Request, email: str):
+    def build():
+        _require_account(request, email)
+        if not get_user(email):
+            raise HTTPException(status_code=404, detail="User not found.")
+        return {"email": email.lower(), "generated_at": feed_store().meta().get('generated_at'),
+                "items": user_notifications(email)}
+    return await run_in_threadpool(build)
+
+@api.get("/loans/overdue")
+async def overdue_endpoint(request: Request, offset: int = 0, limit: int = API_PAGE_SIZE):
+    def build():
+        _require_librarian(request)
+        items = overdue_with_fines()
+        page = items[max(0, offset): max(0, offset) + max(1, min(limit, API_MAX_PAGE_SIZE))]
+        return {"total": len(items), "total_fines": sum(f for _, f in items),
+                "items": [dict(r, fine=f) for r, f in page]}
+    return await run_in_threadpool(build)
+
+@api.get("/loans/due-soon")
+async def due_soon_endpoint(request: Request, days: int = 3):
+    def build():
+        _require_librarian(request)
+        return {"days": days, "items": loans_due_within(max(0, min(days, 365)))}
+    return await run_in_threadpool(build)
+
+@api.get("/analytics")
+async def analytics_endpoint(request: Request, top: int = 10):
+    # served from the circulation rollups (see analytics.py)
+    await run_in_threadpool(_require_librarian, request)
+    return await run_in_threadpool(circulation_analytics, max(1, min(top, 100)))
+
+@api.get("/loans/archive")
+async def loan_archive_endpoint(request: Request, since: Optional[str] = None, until: Optional[str] = None,
+                                user: Optional[str] = None, book_id: Optional[int] = None,
+                                offset: int = 0, limit: int = API_PAGE_SIZE):
+    await run_in_threadpool(_require_librarian, request)
+    offset = max(0, offset)
+    limit = max(1, min(limit, API_MAX_PAGE_SIZE))
+    def build():
+        loans = archived_loans(since, until, user, book_id)
+        return {"total": len(loans), "offset": offset, "limit": limit, "months": archive_months(),
+                "items": loans[offset:offset + limit]}
+    return await run_in_threadpool(build)
+
+@api.post("/issue")
+async def issue_endpoint(request: Request, req: LoanRequest):
+    def run():
+        return issue_book_to_user(_require_user(request)['email'], req.book_id, req.loan_days)
+    ok, msg = await run_in_threadpool(run)
+    if not ok:
+        raise HTTPException(status_code=404 if msg == "Book not found." else 409, detail=msg)
+    return {"success": True, "message": msg}
+
+@api.post("/return")
+async def return_endpoint(request: Request, req: BookRequest):
+    def run():
+        return return_book_from_user(_require_user(request)['email'], req.book_id)
+    ok, msg, fine = await run_in_threadpool(run)
+    if not ok:
+        raise HTTPException(status_code=409 if msg == BUSY_MESSAGE else 404, detail=msg)
+    return {"success": True, "message": msg, "fine": fine}
+
+class BatchItem(BaseModel):
+    user_email: str
+    book_id: int
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    loan_days: int = DEFAULT_LOAN_DAYS
+    all_or_nothing: bool = False
+
+def _batch_items(request: Request, req: BatchRequest) -> List[tuple]:
+    _require_librarian(request)
+    if not req.items:
+        raise HTTPException(status_code=422, detail="No items in batch.")
+    if len(req.items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_BATCH_SIZE} items per batch.")
+    return [(i.user_email, i.book_id) for i in req.items]
+
+def _batch_response(items: List[Dict[str,Any]]) -> Dict[str,Any]:
+    applied = sum(1 for i in items if i['ok'])
+    return {"success": applied == len(items), "applied": applied, "items": items}
+
+@api.post("/loans/batch/issue")
+async def batch_issue_endpoint(request: Request, req: BatchRequest):
+    def run():
+        return _batch_response(issue_books(_batch_items(request, req), req.loan_days, req.all_or_nothing))
+    return await run_in_threadpool(run)
+
+@api.post("/loans/batch/return")
+async def batch_return_endpoint(request: Request, req: BatchRequest):
+    def run():
+        return _batch_response(return_books(_batch_items(request, req), req.all_or_nothing))
+    return await run_in_threadpool(run)
+
+@api.get("/favorites")
+async def favorites_endpoint(request: Request):
+    def build():
+        email = _require_user(request)['email']
+        return {"email": email, "items": _public_books(favorite_books(email))}
+    return await run_in_threadpool(build)
+
+@api.post("/favorites")
+async def add_favorite_endpoint(request: Request, req: BookRequest):
+    def run():
+        return add_favorite(_require_user(request)['email'], req.book_id)
+    ok, msg = await run_in_threadpool(run)
+    if not ok and msg != "Already in favorites.":
+        raise HTTPException(status_code=404, detail=msg)
+    return {"success": ok, "message": msg}
+
+@api.delete("/favorites")
+async def remove_favorite_endpoint(request: Request, book_id: int):
+    def run():
+        return remove_favorite(_require_user(request)['email'], book_id)
+    ok, msg = await run_in_threadpool(run)
+    if not ok:
+        raise HTTPException(status_code=404, detail=msg)
+    return {"success": True, "message": msg}
+
+@api.get("/recommendations")
+async def recommendations_endpoint(request: Request, top_k: int = 6, coborrow_weight: float = COBORROW_WEIGHT):
+    def build():
+        email = _require_user(request)['email']
+        items = recommend_for_user(email, top_k=max(1, min(top_k, 50)),
+                                   coborrow_weight=min(max(coborrow_weight, 0.0), 1.0))
+        return {"email": email, "items": _public_books(items)}
+    return await run_in_threadpool(build)
+
+@api.get("/books/{book_id}/similar")
+async def similar_endpoint(book_id: int, limit: int = 6):
+    def build():
+        if get_book(book_id) is None:
+            raise HTTPException(status_code=404, detail="Book not found.")
+        return {"book_id": book_id, "items": _public_books(similar_books(book_id, max(1, min(limit, 50))))}
+    return await run_in_threadpool(build)
+
+@api.get("/books/{book_id}/also-borrowed")
+async def also_borrowed_endpoint(book_id: int, limit: int = 6):
+    def build():
+        if get_book(book_id) is None:
+            raise HTTPException(status_code=404, detail="Book not found.")
+        return {"book_id": book_id, "items": _public_books(also_borrowed(book_id, max(1, min(limit, 50))))}
+    return await run_in_threadpool(build)
+
+@api.get("/books/{book_id}/cover")
+async def cover_endpoint(book_id: int, width: int = covers.CARD_WIDTH):
+    b = await run_in_threadpool(get_book, book_id)
+    if not b:
+        raise HTTPException(status_code=404, detail="Book not found.")
+    path = await run_in_threadpool(cover_path, b.get('cover_url', ''), width)
+    if not path:
+        raise HTTPException(status_code=404, detail="Cover not available.")
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=86400"})
+
+@api.post("/books/import")
+async def import_endpoint(request: Request, format: str = "csv"):
+    # the body is spooled to a temporary file as it arrives (memory-bounded),
+    # then parsed and committed chunk by chunk in the thread pool
+    _require_format(format)
+    await run_in_threadpool(_require_librarian, request)
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(spool.write, chunk)
+        spool.seek(0)
+        text = io.TextIOWrapper(spool, encoding="utf-8-sig", errors="surrogateescape", newline="")
+        return await run_in_threadpool(import_books, text, format)
+    finally:
+        spool.close()
+
+@api.get("/export/books")
+async def export_books_endpoint(request: Request, format: str = "csv"):
+    _require_format(format)
+    await run_in_threadpool(_require_librarian, request)
+    return StreamingResponse(export_catalog(format), media_type=EXPORT_MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="books.{format}"'})
+
+@api.get("/export/loans")
+async def export_loans_endpoint(request: Request, format: str = "csv"):
+    _require_format(format)
+    await run_in_threadpool(_require_librarian, request)
+    return StreamingResponse(export_loans(format), media_type=EXPORT_MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="loans.{format}"'})
+
+@api.post("/signup")
+async def signup(request: Request, req: SignupRequest):
+    # a JSON body, like /login, so passwords stay out of URLs and access logs
+    if req.role not in ("user", "librarian"):
+        raise HTTPException(status_code=400, detail="role must be user or librarian")
+    if req.role != "user":
+        # only a librarian can make another one
+        await run_in_threadpool(_require_librarian, request)
+    ok, msg = await run_in_threadpool(signup_user, req.name, "0000000000", req.email, req.password, req.role)
+    return {"success": ok, "message": msg}
@@ -1,28 +1,54 @@
-from fastapi import FastAPI
-import uvicorn
-
-app = FastAPI()
-
-@app.get("/")
-def home():
-    return {"message": "📚 Library Management System API running"}
-
-@app.post("/signup")
-def signup(name: str, email: str, password: str, role: str = "user"):
-    ok, msg = signup_user(name, "0000000000", email, password, role)
-    return {"success": ok, "message": msg}
-
-if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
-
-import json
 import os
-import shutil
-import time
+import sys
+import base64
 import hashlib
+import hmac
+import importlib
+import io
 import re
-from datetime import date, datetime, timedelta
-from typing import List, Dict, Any
+import secrets
+import time
+from datetime import date, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+
+import analytics
+import bulk
+import chatbot
+import covers
+import metrics
+import models
+import notifications
+import overdue
+import recommend
+import search
+import sheets
+import storage
+from locks import ConflictError
+
+# -------------------------
+# Lazy imports
+# -------------------------
+# Streamlit is only needed to draw pages, but the API process (api.py) imports
+# this module for everything else; `st` is resolved on first use so the API
+# never loads it. The REST API itself lives in api.py for the same reason in
+# the other direction.
+class _LazyModule:
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+st = _LazyModule("streamlit")
+
+def __getattr__(name):
+    # `uvicorn app:api` and `app.api` keep working
+    if name == "api":
+        return importlib.import_module("api").api
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # -------------------------
 # Config & filenames
@@ -31,12 +57,60 @@ BOOKS_FILE = "books_data.json"
 USERS_FILE = "users.json"
 ISSUED_FILE = "issued_books.json"
 
+# "json" rewrites the data files on every change (open loans only: returned ones
+# are archived by issue month under LOAN_ARCHIVE_DIR); "journal" appends issue/return
+# records to an fsync'd log under JOURNAL_DIR and compacts it in the background;
+# "sqlite" keeps everything in SQLITE_FILE (migrated from the JSON files on first use);
+# "compact" is the JSON backend with a slim catalog in COMPACT_BOOKS_FILE and
+# descriptions/chapter indexes in DETAILS_FILE, loaded only for detail views
+STORAGE_MODE = os.environ.get("LIBRARY_STORAGE", "json")
+JOURNAL_DIR = os.environ.get("LIBRARY_JOURNAL_DIR", "library_journal")
+JOURNAL_SNAPSHOT_EVERY = 500
+SQLITE_FILE = os.environ.get("LIBRARY_DB", "library.db")
+LOAN_ARCHIVE_DIR = os.environ.get("LIBRARY_LOAN_ARCHIVE", "loan_archive")
+COMPACT_BOOKS_FILE = "books_hot.json"
+DETAILS_FILE = "books_details.jsonl"
+# resized cover thumbnails, fetched once per URL and evicted LRU past the budget
+COVER_CACHE_DIR = os.environ.get("LIBRARY_COVER_DIR", "cover_cache")
+COVER_CACHE_BYTES = 64 * 1024 * 1024
+
+# materialized due-soon/overdue feeds, rebuilt by a scheduler thread every
+# NOTIFY_INTERVAL seconds and per user after each issue/return
+NOTIFY_FILE = "notifications.json"
+NOTIFY_INTERVAL = int(os.environ.get("LIBRARY_NOTIFY_INTERVAL", "300"))
+NOTIFY_WINDOW_DAYS = 3
+
+# optional mirror of the catalog and loans to a Google spreadsheet (set
+# LIBRARY_SHEETS_KEY to enable); synced in the background, changed rows only
+SHEETS_KEY = os.environ.get("LIBRARY_SHEETS_KEY", "")
+SHEETS_CREDENTIALS = os.environ.get("LIBRARY_SHEETS_CREDENTIALS", "service_account.json")
+SHEETS_STATE_FILE = "sheets_sync.json"
+SHEETS_INTERVAL = int(os.environ.get("LIBRARY_SHEETS_INTERVAL", str(sheets.DEFAULT_INTERVAL)))
+
+# circulation rollups behind the librarian Analytics page: issue/return append
+# to them, a rebuild recomputes them from the loan history
+ANALYTICS_DIR = os.environ.get("LIBRARY_ANALYTICS_DIR", "analytics")
+
+# REST API bearer tokens from login (see issue_token): signed with
+# LIBRARY_API_SECRET, or with a key generated on first use and kept in
+# API_SECRET_FILE so every API worker accepts every other worker's tokens
+API_SECRET_FILE = os.environ.get("LIBRARY_API_SECRET_FILE", "api_secret.key")
+API_TOKEN_TTL = int(os.environ.get("LIBRARY_API_TOKEN_TTL", str(12 * 3600)))
+
 FINE_PER_DAY = 10
 DEFAULT_LOAN_DAYS = 14
 APP_TITLE = "📚 Library Management System"
+CHATBOT_MAX_SUGGESTIONS = 5
+# share of "patrons who borrowed this also borrowed" in the recommendation blend
+COBORROW_WEIGHT = 0.3
+BOOKS_PAGE_SIZE = 20
+BUSY_MESSAGE = "This book is being updated by someone else right now. Please try again."
+# most (user, book) pairs one desk batch may carry
+MAX_BATCH_SIZE = 50
+ABORTED_MESSAGE = "Not applied: another item in this batch failed."
 
 # -------------------------
-# Safe JSON helpers
+# Validation
 # -------------------------
 def is_strong_password(password: str) -> (bool, str):
     if len(password) < 8:
@@ -51,35 +125,6 @@ def is_strong_password(password: str) -> (bool, str):
         return False, "Password must include at least one special character."
     return True, ""
     
-def backup_corrupt_file(path: str):
-    try:
-        ts = int(time.time())
-        bak = f"{path}.corrupt.{ts}"
-        shutil.copy(path, bak)
-    except Exception:
-        pass
-
-def save_json(path: str, data: Any):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
-def load_json(path: str, default):
-    if not os.path.exists(path):
-        save_json(path, default)
-        return default
-    try:
-        if os.path.getsize(path) == 0:
-            save_json(path, default)
-            return default
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        backup_corrupt_file(path)
-        save_json(path, default)
-        return default
-    except Exception:
-        return default
-
 # -------------------------
 # Bootstrapping initial data
 # -------------------------
@@ -141,30 +186,76 @@ def bootstrap_files():
         }
     ]
     sample_issued = []
-    load_json(BOOKS_FILE, sample_books)
-    load_json(USERS_FILE, sample_users)
-    load_json(ISSUED_FILE, sample_issued)
+    # once per process: Streamlit calls this on every rerun
+    storage.ensure_files({BOOKS_FILE: sample_books, USERS_FILE: sample_users, ISSUED_FILE: sample_issued})
 
 # -------------------------
 # Data helpers
 # -------------------------
+def get_storage() -> storage.Storage:
+    return storage.get_storage(STORAGE_MODE, BOOKS_FILE, USERS_FILE, ISSUED_FILE,
+                               journal_dir=JOURNAL_DIR, db_path=SQLITE_FILE,
+                               snapshot_every=JOURNAL_SNAPSHOT_EVERY,
+                               compact_books_file=COMPACT_BOOKS_FILE, details_file=DETAILS_FILE,
+                               archive_dir=LOAN_ARCHIVE_DIR)
+
 def get_books() -> List[Dict[str,Any]]:
-    return load_json(BOOKS_FILE, [])
+    return get_storage().books()
 
 def save_books(data: List[Dict[str,Any]]):
-    save_json(BOOKS_FILE, data)
+    get_storage().save_books(data)
 
 def get_users() -> List[Dict[str,Any]]:
-    return load_json(USERS_FILE, [])
+    return get_storage().users()
 
 def save_users(data: List[Dict[str,Any]]):
-    save_json(USERS_FILE, data)
+    get_storage().save_users(data)
+
+def save_user(user: Dict[str,Any]):
+    get_storage().save_user(user)
 
 def get_issued() -> List[Dict[str,Any]]:
-    return load_json(ISSUED_FILE, [])
+    return get_storage().issued()
 
 def save_issued(data: List[Dict[str,Any]]):
-    save_json(ISSUED_FILE, data)
+    get_storage().save_issued(data)
+
+def get_book(book_id: int) -> Optional[Dict[str,Any]]:
+    return get_storage().get_book(book_id)
+
+def catalog_models() -> List[models.Book]:
+    # typed, pre-normalized view of the catalog for filter loops
+    store = get_storage()
+    return models.catalog(store.books, (id(store), store.catalog_version()), store.books_version())
+
+def catalog_genres() -> Dict[int, Tuple[str, ...]]:
+    # book id -> normalized genres, rebuilt with the typed catalog
+    store = get_storage()
+    return models.catalog_genres(store.books, (id(store), store.catalog_version()))
+
+def genres_lookup():
+    # book dict -> its genres, off one catalog_genres() read (for loops)
+    genres = catalog_genres()
+    return lambda b: genres.get(b['id']) or storage.normalize_genres(b.get('genre'))
+
+def book_genres(book: Dict[str,Any]) -> List[str]:
+    return list(genres_lookup()(book))
+
+def get_book_details(book_id: int) -> Optional[Dict[str,Any]]:
+    # full record incl. description and chapter index (lazy in compact mode)
+    b = get_book(book_id)
+    return get_storage().with_details(b) if b else None
+
+def get_user(email: str) -> Optional[Dict[str,Any]]:
+    return get_storage().get_user(email)
+
+def cover_path(url: str, width: int = covers.CARD_WIDTH, block: bool = True) -> Optional[str]:
+    # local thumbnail for a cover URL; None when it cannot be fetched (or,
+    # with block=False, is not cached yet and now being fetched)
+    return covers.cover_cache(COVER_CACHE_DIR, COVER_CACHE_BYTES).get(url, width, block)
+
+def prefetch_covers(books: List[Dict[str,Any]]):
+    covers.cover_cache(COVER_CACHE_DIR, COVER_CACHE_BYTES).prefetch(b.get('cover_url') for b in books)
 
 # -------------------------
 # Auth
@@ -173,15 +264,14 @@ def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
 def signup_user(name: str, mobile: str, email: str, password: str, role: str) -> (bool,str):
-    users = get_users()
     email_l = email.strip().lower()
     ok, msg = is_strong_password(password)
     if not ok:
         return False, msg
 
-    if any(u['email'].lower() == email_l for u in users):
+    if get_user(email_l):
         return False, "Email already registered."
-    users.append({
+    save_user({
         "name": name.strip(),
         "mobile": mobile.strip(),
         "email": email_l,
@@ -189,173 +279,500 @@ def signup_user(name: str, mobile: str, email: str, password: str, role: str) ->
         "role": role,
         "favorites": []
     })
-    save_users(users)
     return True, "Account created."
 
 def login_user(email: str, password: str):
-    users = get_users()
-    email_l = email.strip().lower()
-    phash = hash_password(password)
-    for u in users:
-        if u['email'].lower() == email_l and u['password_hash'] == phash:
-            return {k: v for k,v in u.items() if k != 'password_hash'}
+    u = get_user(email)
+    if u and u['password_hash'] == hash_password(password):
+        return {k: v for k,v in u.items() if k != 'password_hash'}
     return None
 
+_api_key: Optional[bytes] = None
+
+def _api_secret() -> bytes:
+    global _api_key
+    if _api_key is None:
+        secret = os.environ.get("LIBRARY_API_SECRET", "")
+        if not secret:
+            if not os.path.exists(API_SECRET_FILE):
+                # written aside and linked in, so concurrent workers agree on one key
+                tmp = f"{API_SECRET_FILE}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(secrets.token_hex(32))
+                try:
+                    os.link(tmp, API_SECRET_FILE)
+                except FileExistsError:
+                    pass
+                finally:
+                    os.remove(tmp)
+            with open(API_SECRET_FILE, "r", encoding="utf-8") as f:
+                secret = f.read().strip()
+        _api_key = secret.encode()
+    return _api_key
+
+def _token_signature(payload: str, password_hash: str) -> str:
+    # the password hash is signed in, so changing the password revokes tokens
+    return hmac.new(_api_secret(), f"{payload}.{password_hash}".encode(), hashlib.sha256).hexdigest()
+
+def issue_token(email: str) -> str:
+    # "<email, base64url>.<expiry, unix time>.<HMAC>"; call after login_user()
+    u = get_user(email)
+    payload = f"{base64.urlsafe_b64encode(u['email'].encode()).decode()}.{int(time.time()) + API_TOKEN_TTL}"
+    return f"{payload}.{_token_signature(payload, u['password_hash'])}"
+
+def token_user(token: str) -> Optional[Dict[str,Any]]:
+    # the user a token from issue_token() was issued to, or None if it is
+    # malformed, expired or no longer valid for that account
+    try:
+        encoded, expires, signature = token.split(".")
+        email = base64.urlsafe_b64decode(encoded.encode()).decode()
+        if int(expires) < time.time():
+            return None
+    except ValueError:
+        return None
+    u = get_user(email)
+    if not u or not hmac.compare_digest(signature, _token_signature(f"{encoded}.{expires}", u['password_hash'])):
+        return None
+    return u
+
 # -------------------------
-# Issue / Return
+# Favorites
 # -------------------------
-def issue_book_to_user(user_email: str, book_id: int, loan_days: int = DEFAULT_LOAN_DAYS) -> (bool,str):
-    books = get_books()
-    issued = get_issued()
-    book = next((b for b in books if b['id'] == book_id), None)
-    if not book:
+def favorite_books(user_email: str) -> List[Dict[str,Any]]:
+    u = get_user(user_email) or {}
+    return [b for b in (get_book(i) for i in u.get('favorites', [])) if b]
+
+def add_favorite(user_email: str, book_id: int) -> (bool,str):
+    u = get_user(user_email)
+    if not u:
+        return False, "User not found."
+    if not get_book(book_id):
         return False, "Book not found."
-    if not book.get('available', True):
-        return False, "Book currently not available."
+    u.setdefault('favorites', [])
+    if book_id in u['favorites']:
+        return False, "Already in favorites."
+    u['favorites'].append(book_id)
+    save_user(u)
+    return True, "Added to favorites."
+
+def remove_favorite(user_email: str, book_id: int) -> (bool,str):
+    u = get_user(user_email)
+    if not u:
+        return False, "User not found."
+    if book_id not in u.get('favorites', []):
+        return False, "Not in favorites."
+    u['favorites'].remove(book_id)
+    save_user(u)
+    return True, "Removed from favorites."
+
+# -------------------------
+# Bulk import / export
+# -------------------------
+def import_books(stream, fmt: str, progress=None) -> Dict[str,Any]:
+    # `stream` is a text stream of CSV or JSONL rows; committed in chunks
+    return bulk.import_books(stream, fmt, get_storage().add_books, progress=progress)
+
+def export_catalog(fmt: str):
+    # full records: descriptions/indexes are read back in for compact catalogs
+    store = get_storage()
+    return bulk.export_books((store.with_details(b) for b in store.books()), fmt)
 
-    # set availability + who holds it (optional)
-    for b in books:
-        if b['id'] == book_id:
-            b['available'] = False
-            b['issued_to'] = user_email.lower()
-    save_books(books)
+def export_loans(fmt: str):
+    return bulk.export_loans(get_issued(), fmt)
 
+# -------------------------
+# Issue / Return
+# -------------------------
+@metrics.timed("library_op_seconds", op="issue")
+def issue_book_to_user(user_email: str, book_id: int, loan_days: int = DEFAULT_LOAN_DAYS) -> (bool,str):
     today = date.today()
     due = today + timedelta(days=loan_days)
-    issued.append({
-        "user_email": user_email.lower(),
-        "book_id": book_id,
-        "issue_date": str(today),
-        "due_date": str(due),
-        "returned": False,
-        "return_date": None
-    })
-    save_issued(issued)
+    try:
+        status, book = get_storage().issue(user_email.lower(), book_id, str(today), str(due))
+    except ConflictError:
+        return False, BUSY_MESSAGE
+    if status == "not_found":
+        return False, "Book not found."
+    if status == "unavailable":
+        return False, "Book currently not available."
+    refresh_user_notifications(user_email)
+    record_circulation([analytics.issue_event(book_id, _book_genres(book_id), str(today), user_email.lower())])
     return True, f"Issued '{book['title']}'. Due on {due.isoformat()}."
 
 
+@metrics.timed("library_op_seconds", op="return")
 def return_book_from_user(user_email: str, book_id: int) -> (bool,str,int):
-    books = get_books()
-    issued = get_issued()
-    rec = next((r for r in issued if r['user_email'].lower() == user_email.lower() and r['book_id'] == book_id and not r['returned']), None)
+    today = date.today()
+    try:
+        rec = get_storage().return_book(user_email.lower(), book_id, str(today))
+    except ConflictError:
+        return False, BUSY_MESSAGE, 0
     if not rec:
         return False, "No active issue found for this user & book.", 0
+    refresh_user_notifications(user_email)
+    fine = calculate_fine_for_record(rec)
+    record_circulation([analytics.return_event(rec, _book_genres(book_id), str(today), fine)])
+    return True, "Book returned.", fine
+
+# Desk batches: every pair is checked against one snapshot of the store and
+# the valid ones are written together (one books write, one loans write),
+# instead of a full load + rewrite per book. With all_or_nothing a single bad
+# pair leaves the whole batch unapplied.
+def _batch_results(items, results, messages) -> List[Dict[str,Any]]:
+    out = []
+    for (email, book_id), (status, rec) in zip(items, results):
+        out.append({"user_email": email, "book_id": book_id, "ok": status == "ok",
+                    "status": status, "message": messages(status, rec)})
+    return out
+
+@metrics.timed("library_op_seconds", op="issue_batch")
+def issue_books(items: List[tuple], loan_days: int = DEFAULT_LOAN_DAYS,
+                all_or_nothing: bool = False) -> List[Dict[str,Any]]:
+    today = date.today()
+    due = today + timedelta(days=loan_days)
+    items = [(email.lower(), book_id) for email, book_id in items]
+    known = [get_user(email) is not None for email, _ in items]
+    valid = [item for item, ok in zip(items, known) if ok]
+    if all_or_nothing and len(valid) < len(items):
+        valid = []
+    try:
+        results = get_storage().issue_many(valid, str(today), str(due), all_or_nothing) if valid else []
+    except ConflictError:
+        return _batch_results(items, [("busy", None)] * len(items), lambda *_: BUSY_MESSAGE)
+    record_circulation([analytics.issue_event(book_id, _book_genres(book_id), str(today), email)
+                        for (email, book_id), (status, _) in zip(valid, results) if status == "ok"])
+    results = iter(results)
+    merged = []
+    for ok in known:
+        if not ok:
+            merged.append(("no_user", None))
+        elif valid:
+            merged.append(next(results))
+        else:
+            merged.append(("aborted", None))
+
+    def message(status, book):
+        if status == "ok":
+            return f"Issued '{book['title']}'. Due on {due.isoformat()}."
+        return {"not_found": "Book not found.", "unavailable": "Book currently not available.",
+                "no_user": "User not found.", "aborted": ABORTED_MESSAGE}[status]
+    out = _batch_results(items, merged, message)
+    for r in out:
+        if r['ok']:
+            r['due_date'] = due.isoformat()
+    refresh_user_notifications(*{r['user_email'] for r in out if r['ok']})
+    return out
+
+@metrics.timed("library_op_seconds", op="return_batch")
+def return_books(items: List[tuple], all_or_nothing: bool = False) -> List[Dict[str,Any]]:
     today = date.today()
-    due = datetime.fromisoformat(rec['due_date']).date()
-    fine = (today - due).days * FINE_PER_DAY if today > due else 0
-    rec['returned'] = True
-    rec['return_date'] = str(today)
-    save_issued(issued)
-    for b in books:
-        if b['id'] == book_id:
-            b['available'] = True
-            b.pop('issued_to', None)
-    save_books(books)
-    return True, "Book returned.", max(0, fine)
+    items = [(email.lower(), book_id) for email, book_id in items]
+    try:
+        results = get_storage().return_many(items, str(today), all_or_nothing)
+    except ConflictError:
+        return _batch_results(items, [("busy", None)] * len(items), lambda *_: BUSY_MESSAGE)
+    returned = [rec for status, rec in results if status == "ok"]
+    fines = fines_for_records([dict(rec, returned=False) for rec in returned]) if returned else []
+    record_circulation([analytics.return_event(rec, _book_genres(rec['book_id']), str(today), fine)
+                        for rec, fine in zip(returned, fines)])
+    messages = {"ok": "Book returned.", "not_found": "No active issue found for this user & book.",
+                "aborted": ABORTED_MESSAGE}
+    out = _batch_results(items, results, lambda status, _: messages[status])
+    for r, fine in zip([r for r in out if r['ok']], fines):
+        r['fine'] = fine
+    refresh_user_notifications(*{r['user_email'] for r in out if r['ok']})
+    return out
+
+@metrics.timed("library_op_seconds", op="search")
+def search_books(query: str, limit: Optional[int] = None, prefix_last: bool = False) -> List[Dict[str,Any]]:
+    store = get_storage()
+    idx = search.catalog_index(store.books(), (id(store), store.catalog_version()), store.with_details,
+                               genres_lookup())
+    hits = idx.search(query, limit=limit, prefix_last=prefix_last)
+    return [b for b in (get_book(book_id) for book_id, _ in hits) if b]
+
+@metrics.timed("library_op_seconds", op="suggest")
+def suggest_titles(query: str, limit: int = 8) -> List[Dict[str,Any]]:
+    # typo-tolerant typeahead over titles and authors
+    store = get_storage()
+    idx = search.catalog_suggester(store.books(), (id(store), store.catalog_version()))
+    return idx.suggest(query, limit)
 
 def user_active_issues(user_email: str) -> List[Dict[str,Any]]:
-    return [r for r in get_issued() if r['user_email'].lower() == user_email.lower() and not r.get('returned', False)]
+    return get_storage().active_issues(user_email)
+
+def due_index() -> overdue.DueIndex:
+    store = get_storage()
+    return overdue.due_index(store.active_loans, (id(store), store.loans_version()))
+
+def overdue_with_fines() -> List[tuple]:
+    # (loan, fine so far), most overdue first
+    return due_index().overdue(date.today(), FINE_PER_DAY)
+
+def loans_due_within(days: int) -> List[Dict[str,Any]]:
+    return due_index().due_within(days, date.today())
+
+def archived_loans(since: Optional[str] = None, until: Optional[str] = None,
+                   user_email: Optional[str] = None, book_id: Optional[int] = None) -> List[Dict[str,Any]]:
+    # returned loans for reports; since/until are inclusive issue months (YYYY-MM)
+    return get_storage().archived_loans(since, until, user_email, book_id)
+
+def archive_months() -> List[str]:
+    return get_storage().archive_months()
+
+def fines_for_records(records: List[Dict[str,Any]]) -> List[int]:
+    return overdue.fines_for(records, date.today(), FINE_PER_DAY).tolist()
 
 def calculate_fine_for_record(rec: Dict[str,Any]) -> int:
-    due = datetime.fromisoformat(rec['due_date']).date()
-    today = date.today()
-    return max(0, (today - due).days * FINE_PER_DAY) if today > due else 0
+    return fines_for_records([dict(rec, returned=False)])[0]
 
 # -------------------------
-# Recommendations & Chatbot
+# Notifications
 # -------------------------
-def recommend_for_user(user_email: str, top_k: int = 6) -> List[Dict[str,Any]]:
-    books = get_books()
-    users = get_users()
-    user = next((u for u in users if u['email'].lower() == user_email.lower()), {})
-    fav_ids = user.get('favorites', [])
-    issued = user_active_issues(user_email)
-    genres = set()
-    for b in books:
-        if b['id'] in fav_ids or any(r['book_id']==b['id'] for r in issued):
-            genres.update(b.get('genre',[]))
-    def score(b):
-        s = 0
-        if any(g in b.get('genre',[]) for g in genres):
-            s += 2
-        if b.get('available', False):
-            s += 1
-        return s
-    ranked = sorted(books, key=score, reverse=True)
-    return ranked[:top_k]
-def chatbot_response_for_user(user_email: str, message: str) -> str:
-    m = message.strip().lower()
-    if not m:
-        return "Ask me for book recommendations, or how to issue/return books."
+def feed_store() -> notifications.FeedStore:
+    return notifications.FeedStore(NOTIFY_FILE)
 
-    # Book recommendation by user interest keywords
-    if "recommend" in m or "suggest" in m:
-        keywords = m.replace("recommend","").replace("suggest","").strip().split()
-        books = get_books()
-        # filter books by keywords in title, genre, or description
-        recs = []
-        for b in books:
-            text = (b.get('title','') + ' ' + ' '.join(b.get('genre',[])) + ' ' + b.get('description','')).lower()
-            if any(k in text for k in keywords) and b.get('available', False):
-                recs.append(b)
-        # fallback to previous issued or favorites
-        if not recs:
-            recs = recommend_for_user(user_email, top_k=3)
-        if not recs:
-            return "No recommendations found right now. Try another keyword."
-        return "I suggest:\n" + "\n".join([f"- {r['title']} by {r['author']}" for r in recs])
+def _book_title(book_id: int) -> Optional[str]:
+    b = get_book(book_id)
+    return b['title'] if b else None
+
+def refresh_notifications() -> int:
+    # the scheduled job: every user's feed from the open loans
+    store = get_storage()
+    version = str(store.loans_version())
+    today = date.today()
+    feeds = notifications.build_feeds(store.active_loans(), _book_title, today, FINE_PER_DAY, NOTIFY_WINDOW_DAYS)
+    feed_store().replace(feeds, {"today": str(today), "loans_version": version})
+    return len(feeds)
+
+def refresh_user_notifications(*user_emails: str):
+    # an issue/return only changes the borrowers' own notes
+    store = get_storage()
+    emails = {e.lower() for e in user_emails}
+    if not emails:
+        return
+    loans = [r for e in emails for r in store.active_issues(e)]
+    feeds = notifications.build_feeds(loans, _book_title, date.today(), FINE_PER_DAY, NOTIFY_WINDOW_DAYS)
+    try:
+        feed_store().update_users({e: feeds.get(e, []) for e in emails},
+                                  {"loans_version": str(store.loans_version())})
+    except ConflictError:
+        notification_scheduler().trigger()
 
-    if "how to issue" in m or "issue a book" in m:
-        return "Go to 'All Books', then click the Issue button (only available for Users)."
+def notification_scheduler() -> notifications.Scheduler:
+    return notifications.scheduler("notifications", refresh_notifications, NOTIFY_INTERVAL)
+
+# -------------------------
+# Google Sheets sync
+# -------------------------
+def sync_sheets(spreadsheet=None) -> Optional[List[Dict[str,Any]]]:
+    # per-sheet stats; None if another process was mid-sync
+    store = get_storage()
+    spreadsheet = spreadsheet or sheets.open_spreadsheet(SHEETS_CREDENTIALS, SHEETS_KEY)
+    return sheets.SheetSync(spreadsheet, SHEETS_STATE_FILE).run([
+        sheets.Source("Catalog", sheets.BOOK_COLUMNS, store.books_version(), store.books,
+                      sheets.book_row, sheets.book_key),
+        sheets.Source("Loans", sheets.LOAN_COLUMNS, store.loans_version(), store.issued,
+                      sheets.loan_row, sheets.loan_keys()),
+    ])
+
+def sheets_scheduler() -> Optional[notifications.Scheduler]:
+    if not SHEETS_KEY:
+        return None
+    return notifications.scheduler("sheets", sync_sheets, SHEETS_INTERVAL)
+
+def user_notifications(user_email: str) -> List[Dict[str,Any]]:
+    store = feed_store()
+    meta = store.meta()
+    if meta.get('today') != str(date.today()):
+        # first run, or the day rolled over: days left and fines all moved
+        refresh_notifications()
+    elif meta.get('loans_version') != str(get_storage().loans_version()):
+        # loans changed outside issue/return (imports, edits); serve what we
+        # have and let the scheduler catch up
+        notification_scheduler().trigger()
+    notification_scheduler()
+    return store.feed(user_email)
+
+# -------------------------
+# Circulation analytics
+# -------------------------
+def analytics_store() -> analytics.RollupStore:
+    return analytics.rollup_store(ANALYTICS_DIR)
 
-    if "how to return" in m or "return a book" in m:
-        return "Go to 'Issued Books' and click Return next to the book you want to return."
+def _book_genres(book_id: int) -> List[str]:
+    return list(catalog_genres().get(book_id, ()))
 
-    if "genres" in m or "categories" in m:
-        genres = sorted({g for b in get_books() for g in b.get('genre',[])} )
-        return "Available genres: " + ", ".join(genres) if genres else "No genre data available."
+def record_circulation(events: List[Dict[str,Any]]):
+    # called once the loan is committed, holding no storage lock; the rollups
+    # skip events a concurrent rebuild already read from the history (see
+    # analytics.Rollups.apply). A missed event only skews the rollups until
+    # the next rebuild
+    try:
+        analytics_store().record(events)
+    except ConflictError:
+        metrics.inc("library_analytics_dropped_total", len(events))
+
+@metrics.timed("library_op_seconds", op="analytics_rebuild")
+def rebuild_analytics() -> analytics.Rollups:
+    # one pass over the whole loan history. Issue/return keep appending while
+    # it runs; the events logged since `start` are folded into the result.
+    # Only without a log to follow (the first rebuild) or when it was
+    # compacted meanwhile are appends held off for the whole pass.
+    rollups_store = analytics_store()
+    genres = catalog_genres()
+    start = rollups_store.events_since(None)
+    if start is not None:
+        rollups = analytics.rebuild(get_issued(), lambda book_id: genres.get(book_id, ()), FINE_PER_DAY)
+        if rollups_store.replace(rollups, start[1]):
+            return rollups
+    with rollups_store.lock:
+        rollups = analytics.rebuild(get_issued(), lambda book_id: genres.get(book_id, ()), FINE_PER_DAY)
+        rollups_store.replace(rollups)
+    return rollups
+
+@metrics.timed("library_op_seconds", op="analytics")
+def circulation_analytics(top: int = 10) -> Dict[str,Any]:
+    store = get_storage()
+    sizes = analytics.genre_sizes(catalog_models(), (id(store), store.catalog_version()))
+    out = analytics_store().summary(_book_title, sizes, top)
+    if out is None:
+        out = rebuild_analytics().summary(_book_title, sizes, top)
+    # loans out right now and the share of them past due come from the
+    # due-date index, not the history
+    idx = due_index()
+    late = len(idx.overdue(date.today(), FINE_PER_DAY))
+    out['on_loan_now'] = len(idx)
+    out['overdue_now'] = late
+    out['overdue_rate'] = round(late / len(idx), 4) if len(idx) else None
+    return out
 
-    if any(x in m for x in ["hi","hello","hey"]):
-        return "Hello! I'm the Chatbot. Try: 'Recommend Python books', 'How to issue a book', or 'What genres are available?'."
+# -------------------------
+# Recommendations & Chatbot
+# -------------------------
+@metrics.timed("library_op_seconds", op="recommend")
+def recommend_for_user(user_email: str, top_k: int = 6, coborrow_weight: float = COBORROW_WEIGHT) -> List[Dict[str,Any]]:
+    store = get_storage()
+    books = store.books()
+    engine = recommend.catalog_recommender(books, (id(store), store.catalog_version()), store.with_details,
+                                           genres_lookup())
+    user = get_user(user_email) or {}
+    loans = store.user_loans(user_email)
+    seeds = recommend.user_seeds(user.get('favorites', []), loans)
+    held = {r['book_id'] for r in loans if not r.get('returned', False)}
+    # over-fetch so books that are on the shelf right now can be ranked first
+    scored = engine.recommend(seeds, exclude=held, limit=top_k * 3)
+    if coborrow_weight > 0:
+        coborrow = coborrow_model()
+        scored = recommend.blend(scored, coborrow.recommend(seeds, exclude=held, limit=top_k * 3), coborrow_weight)
+    ranked = [get_book(i) for i, _ in scored[:top_k * 3]]
+    ranked = [b for b in ranked if b]
+    if len(ranked) < top_k:
+        # no history yet (or a tiny catalog): fill with whatever is available
+        seen = {b['id'] for b in ranked} | set(seeds)
+        ranked += [b for b in books if b['id'] not in seen][:top_k * 3 - len(ranked)]
+    ranked.sort(key=lambda b: not b.get('available', False))
+    return ranked[:top_k]
 
-    return "Sorry — I didn't understand. Try: 'Recommend Python books', 'How to issue a book', or 'What genres are available?'."
+def similar_books(book_id: int, limit: int = 6) -> List[Dict[str,Any]]:
+    # nearest neighbours in the content model's top-K similarity table
+    store = get_storage()
+    engine = recommend.catalog_recommender(store.books(), (id(store), store.catalog_version()), store.with_details,
+                                           genres_lookup())
+    return [b for b in (get_book(i) for i, _ in engine.similar(book_id, limit)) if b]
+
+def _issued_since(cursor):
+    # new loans for the co-borrow counts, read off the analytics event log
+    got = analytics_store().events_since(cursor)
+    if got is None:
+        return None
+    events, cursor = got
+    return [(e['u'], e['b']) for e in events if e['e'] == "issue"], cursor
+
+def coborrow_model() -> recommend.CoBorrowModel:
+    # issues from every process reach the counts through the event log, so the
+    # whole loan history is only read again after a rebuild or compaction.
+    # Until the rollups exist there is no log to follow and the counts sync
+    # from the history whenever the loans version moves.
+    store = get_storage()
+    return recommend.coborrow_model(store.issued, _issued_since, (id(store), store.loans_version()))
+
+def also_borrowed(book_id: int, limit: int = 6) -> List[Dict[str,Any]]:
+    coborrow = coborrow_model()
+    return [b for b in (get_book(i) for i, _ in coborrow.also_borrowed(book_id, limit)) if b]
+
+CHATBOT_HINT = "Try: 'Recommend Python books', 'How to issue a book', or 'What genres are available?'."
+
+def _chat_recommend(user_email: str, keywords: str) -> str:
+    # ranked full-text matches over the catalog, available books only
+    recs = [b for b in search_books(keywords) if b.get('available', False)][:CHATBOT_MAX_SUGGESTIONS] if keywords else []
+    # fallback to previous issued or favorites
+    if not recs:
+        recs = recommend_for_user(user_email, top_k=3)
+    if not recs:
+        return "No recommendations found right now. Try another keyword."
+    return "I suggest:\n" + "\n".join([f"- {r['title']} by {r['author']}" for r in recs])
+
+def _chat_genres(user_email: str, rest: str) -> str:
+    store = get_storage()
+    genres = chatbot.cached_answer("genres", (id(store), store.catalog_version()),
+                                   lambda: sorted({g for b in catalog_models() for g in b.genres}))
+    return "Available genres: " + ", ".join(genres) if genres else "No genre data available."
+
+# checked in this order; see chatbot.py for the trigger syntax
+CHATBOT_INTENTS = [
+    chatbot.Intent("recommend", ["recommend*", "suggest*"], _chat_recommend),
+    chatbot.Intent("how_to_issue", ["how to issue", "issue a book"],
+                   lambda email, rest: "Go to 'All Books', then click the Issue button (only available for Users)."),
+    chatbot.Intent("how_to_return", ["how to return", "return a book"],
+                   lambda email, rest: "Go to 'Issued Books' and click Return next to the book you want to return."),
+    chatbot.Intent("genres", ["genre*", "categor*"], _chat_genres),
+    chatbot.Intent("greeting", ["hi", "hello", "hey"],
+                   lambda email, rest: "Hello! I'm the Chatbot. " + CHATBOT_HINT),
+]
+
+@metrics.timed("library_op_seconds", op="chatbot")
+def chatbot_response_for_user(user_email: str, message: str) -> str:
+    if not message.strip():
+        return "Ask me for book recommendations, or how to issue/return books."
+    hit = chatbot.IntentMatcher(CHATBOT_INTENTS).match(message)
+    if hit is None:
+        return "Sorry — I didn't understand. " + CHATBOT_HINT
+    intent, rest = hit
+    metrics.inc("library_chatbot_intents_total", intent=intent.name)
+    return intent.handler(user_email, rest)
 
 
 # -------------------------
 # UI helpers
 # -------------------------
-def book_card_ui(book: Dict[str, Any], current_user_email: str):
+def book_card_ui(book: Dict[str, Any], current_user_email: str, active_ids: Optional[set] = None):
+    # active_ids: ids of books the user currently holds; pass it in when
+    # rendering many cards so it is computed once per page, not per card
+    if active_ids is None:
+        active_ids = {r['book_id'] for r in user_active_issues(current_user_email)}
     cols = st.columns([1, 3])
 
     # LEFT: cover
     with cols[0]:
-        if book.get('cover_url'):
-            try:
-                st.image(book['cover_url'], width=110)
-            except Exception:
-                st.write("[No Image]")
+        cover_ui(book, covers.CARD_WIDTH)
 
     # RIGHT: details + actions
     with cols[1]:
         st.markdown(f"### {book['title']}")
-        genres = book.get('genre', [])
-        if isinstance(genres, str):
-            genres = [genres]
-        st.markdown(f"*Genre:* {', '.join(genres)}")
-        desc = book.get('description', '')
-        st.write(desc[:400] + ("…" if len(desc) > 400 else ""))
+        st.markdown(f"*Genre:* {', '.join(book_genres(book))}")
+        if 'description' in book:
+            desc = book['description']
+            st.write(desc[:400] + ("…" if len(desc) > 400 else ""))
+        else:
+            # compact catalog: a short summary is kept with the hot record
+            st.write(book.get('summary', ''))
         st.write(f"*Available:* {'✅ Yes' if book.get('available', True) else '❌ No'}")
 
         c1, c2, c3 = st.columns([1, 1, 1])
 
         # --- check if this user already issued this book ---
-        issued_records = get_issued()
-        active_for_user = any(
-            r for r in issued_records
-            if r['book_id'] == book['id']
-            and r['user_email'].lower() == current_user_email.lower()
-            and not r.get('returned', False)
-        )
+        active_for_user = book['id'] in active_ids
 
         # ---------- Issue flow ----------
         with c1:
@@ -395,38 +812,71 @@ def book_card_ui(book: Dict[str, Any], current_user_email: str):
         # ---------- Favorites ----------
         with c2:
             if st.button("⭐ Add to Favorites", key=f"fav_{book['id']}_{current_user_email}"):
-                users = get_users()
-                for u in users:
-                    if u['email'].lower() == current_user_email.lower():
-                        u.setdefault('favorites', [])
-                        if book['id'] not in u['favorites']:
-                            u['favorites'].append(book['id'])
-                            save_users(users)
-                            st.session_state['user'] = {
-                                k: v for k, v in u.items() if k != 'password_hash'
-                            }
-                            st.success("Added to favorites.")
-                        else:
-                            st.info("Already in favorites.")
+                ok, msg = add_favorite(current_user_email, book['id'])
+                if ok:
+                    u = get_user(current_user_email)
+                    st.session_state['user'] = {
+                        k: v for k, v in u.items() if k != 'password_hash'
+                    }
+                    st.success(msg)
+                else:
+                    st.info(msg)
                 st.rerun()
 
         # ---------- Overview ----------
+        # a toggle instead of an expander: expander bodies are built on every
+        # rerun even when collapsed, this only renders once it is switched on
         with c3:
-            with st.expander("🔎 Overview"):
-                if book.get('cover_url'):
-                    st.image(book['cover_url'], width=150)
-                st.markdown(f"*Title:* {book.get('title','')}")
-                st.markdown(f"*Author:* {book.get('author','')}")
-                genres2 = book.get('genre', [])
-                if isinstance(genres2, str):
-                    genres2 = [genres2]
-                st.markdown(f"*Genre:* {', '.join(genres2)}")
-                st.markdown("*Description:*")
-                st.write(book.get('description',''))
-                if book.get('index'):
-                    st.markdown("*Index:*")
-                    for idx in book.get('index', []):
-                        st.write(f"- {idx}")
+            show_overview = st.toggle("🔎 Overview", key=f"overview_{book['id']}_{current_user_email}")
+
+    if show_overview:
+        book_overview_ui(get_storage().with_details(book))
+
+def cover_ui(book: Dict[str, Any], width: int):
+    # served from the local thumbnail cache, never hot-linked; a cover that is
+    # still downloading shows the placeholder until a later rerun
+    if not book.get('cover_url'):
+        return
+    path = cover_path(book['cover_url'], width, block=False)
+    if path:
+        st.image(path, width=width)
+    else:
+        st.write("[No Image]")
+
+def book_overview_ui(book: Dict[str, Any]):
+    cover_ui(book, covers.OVERVIEW_WIDTH)
+    st.markdown(f"*Title:* {book.get('title','')}")
+    st.markdown(f"*Author:* {book.get('author','')}")
+    st.markdown(f"*Genre:* {', '.join(book_genres(book))}")
+    st.markdown("*Description:*")
+    st.write(book.get('description',''))
+    if book.get('index'):
+        st.markdown("*Index:*")
+        for idx in book.get('index', []):
+            st.write(f"- {idx}")
+    similar = similar_books(book['id'], limit=5)
+    if similar:
+        st.markdown("*Similar books:*")
+        for b in similar:
+            st.write(f"- {b['title']} by {b['author']}")
+
+def paginate_ui(items: List[Any], key: str, page_size: int = BOOKS_PAGE_SIZE, noun: str = "books") -> List[Any]:
+    # only the current page is ever rendered, whatever the catalog size
+    pages = max(1, (len(items) + page_size - 1) // page_size)
+    page_key = f"{key}_page"
+    page = min(st.session_state.get(page_key, 1), pages)
+    if pages > 1:
+        c1, c2, c3 = st.columns([1, 2, 1])
+        with c1:
+            if st.button("◀ Previous", key=f"{key}_prev", disabled=page <= 1):
+                page -= 1
+        with c3:
+            if st.button("Next ▶", key=f"{key}_next", disabled=page >= pages):
+                page += 1
+        with c2:
+            st.caption(f"Page {page} of {pages} · {len(items)} {noun}")
+    st.session_state[page_key] = page
+    return items[(page - 1) * page_size: page * page_size]
 
 # -------------------------
 # Main app
@@ -435,6 +885,7 @@ def app():
     st.set_page_config(page_title=APP_TITLE, layout="wide")
     st.title(APP_TITLE)
     bootstrap_files()
+    sheets_scheduler()
     if 'user' not in st.session_state:
         st.session_state['user'] = None
     if 'view_book' not in st.session_state:
@@ -478,19 +929,8 @@ def app():
     st.sidebar.markdown(f"*Role:* {current_user['role'].capitalize()}")
     st.sidebar.markdown("---")
 
-    # Notifications
-    notes = []
-    user_issued = user_active_issues(current_user['email'])
-    for rec in user_issued:
-        due = datetime.fromisoformat(rec['due_date']).date()
-        days_left = (due - date.today()).days
-        book = next((b for b in get_books() if b['id']==rec['book_id']), None)
-        title = book['title'] if book else f"Book #{rec['book_id']}"
-        if days_left <= 3 and days_left > 0:
-            notes.append(f"⏳ {days_left} days left: {title} (due {rec['due_date']})")
-        if days_left < 0:
-            fine_now = calculate_fine_for_record(rec)
-            notes.append(f"⚠ Overdue: {title} — fine ₹{fine_now}")
+    # Notifications (precomputed feed, see notifications.py)
+    notes = [n['message'] for n in user_notifications(current_user['email'])]
     if notes:
         st.sidebar.markdown("#### 🔔 Notifications")
         for n in notes:
@@ -510,7 +950,8 @@ def app():
     if current_user['role']=="user":
         page = st.sidebar.radio("Navigate", ["Dashboard","All Books","Favorites","Issued Books","Recommendations","Account","Logout"])
     else:
-        page = st.sidebar.radio("Navigate", ["Dashboard","All Books","Add Book","Delete Book","Issued Overview","Account","Logout"])
+        page = st.sidebar.radio("Navigate", ["Dashboard","All Books","Add Book","Bulk Import/Export","Delete Book","Issued Overview","Analytics","Account","Logout"])
+    metrics.label_render(page=page)
 
     # ---------- Pages ----------
     if page=="Logout":
@@ -519,31 +960,44 @@ def app():
 
     elif page=="Dashboard":
         st.header("📊 Dashboard")
-        users = get_users()
-        u = next((x for x in users if x['email'].lower()==current_user['email'].lower()), current_user)
+        u = get_user(current_user['email']) or current_user
         st.write(f"- ⭐ Favorites: *{len(u.get('favorites', []))}*")
         st.write(f"- 📥 Active borrowed books: *{len(user_active_issues(current_user['email']))}*")
 
     elif page=="All Books":
         st.header("📚 All Books")
         all_books = get_books()
-        q = st.text_input("Search by title / author / genre (press Enter)", key="search_books")
+        q = st.text_input("Search by title / author / genre / keywords (press Enter)", key="search_books")
         filtered = all_books
         if q:
-            ql = q.lower()
-            filtered = [b for b in all_books if ql in b.get('title','').lower() or ql in b.get('author','').lower() or any(ql in g.lower() for g in b.get('genre',[]))]
-        for b in filtered:
-            book_card_ui(b, current_user['email'])
+            filtered = search_books(q, prefix_last=True)
+            suggestions = suggest_titles(q, limit=5)
+            if not filtered and suggestions:
+                # nothing matched as typed; fall back to the closest titles/authors
+                st.caption("Did you mean: " + ", ".join(s['text'] for s in suggestions))
+                ids = []
+                for s in suggestions:
+                    ids.extend(i for i in s['book_ids'] if i not in ids)
+                filtered = [b for b in (get_book(i) for i in ids) if b]
+        if st.session_state.get('search_books_last') != q:
+            # new query: back to the first page
+            st.session_state['search_books_last'] = q
+            st.session_state['all_books_page'] = 1
+        active_ids = {r['book_id'] for r in user_active_issues(current_user['email'])}
+        page_books = paginate_ui(filtered, "all_books")
+        prefetch_covers(page_books)
+        for b in page_books:
+            book_card_ui(b, current_user['email'], active_ids)
             st.divider()
 
         if st.session_state.get('view_book'):
             bid = st.session_state['view_book']
-            b = next((x for x in all_books if x['id']==bid), None)
+            b = get_book_details(bid)
             if b:
                 st.subheader(f"📖 Detailed Overview: {b['title']}")
-                st.image(b.get('cover_url',''), width=150)
+                cover_ui(b, covers.OVERVIEW_WIDTH)
                 st.markdown(f"*Author:* {b.get('author','')}")
-                st.markdown(f"*Genre:* {', '.join(b.get('genre',[]))}")
+                st.markdown(f"*Genre:* {', '.join(book_genres(b))}")
                 st.markdown("*Description:*")
                 st.write(b.get('description',''))
                 st.markdown("*Index:*")
@@ -554,11 +1008,13 @@ def app():
 
     elif page=="Favorites":
         st.header("⭐ Favorites")
-        fav_ids = current_user.get('favorites', [])
-        fav_books = [b for b in get_books() if b['id'] in fav_ids]
+        fav_books = favorite_books(current_user['email'])
         if not fav_books: st.info("No favorites yet.")
-        for b in fav_books:
-            book_card_ui(b, current_user['email'])
+        active_ids = {r['book_id'] for r in user_active_issues(current_user['email'])}
+        page_books = paginate_ui(fav_books, "favorites")
+        prefetch_covers(page_books)
+        for b in page_books:
+            book_card_ui(b, current_user['email'], active_ids)
             st.divider()
 
     elif page=="Issued Books":
@@ -566,13 +1022,12 @@ def app():
         active = user_active_issues(current_user['email'])
         if not active:
             st.info("No active issues.")
-        for rec in active:
-            b = next((x for x in get_books() if x['id']==rec['book_id']), None)
+        for rec, fine_now in zip(active, fines_for_records(active)):
+            b = get_book(rec['book_id'])
             if not b:
                 continue
             st.markdown(f"### {b['title']} by {b['author']}")
             st.write(f"*Issued on:* {rec['issue_date']}  |  *Due:* {rec['due_date']}")
-            fine_now = calculate_fine_for_record(rec)
             if fine_now > 0:
                 st.warning(f"⚠ Fine so far: ₹{fine_now}")
 
@@ -588,9 +1043,13 @@ def app():
 
     elif page=="Recommendations":
         st.header("💡 Recommendations for you")
-        recs = recommend_for_user(current_user['email'], top_k=6)
+        coborrow_weight = st.slider("Weight of \"patrons who borrowed this also borrowed\"", 0.0, 1.0,
+                                    COBORROW_WEIGHT, 0.1, key="coborrow_weight")
+        recs = recommend_for_user(current_user['email'], top_k=6, coborrow_weight=coborrow_weight)
+        active_ids = {r['book_id'] for r in user_active_issues(current_user['email'])}
+        prefetch_covers(recs)
         for b in recs:
-            book_card_ui(b, current_user['email'])
+            book_card_ui(b, current_user['email'], active_ids)
             st.divider()
 
     # ---------- Librarian Pages ----------
@@ -604,10 +1063,7 @@ def app():
         keywords = st.text_input("Keywords (comma separated)")
 
         if st.button("Add Book"):
-            books = get_books()
-            new_id = max([b['id'] for b in books], default=0) + 1
             new_book = {
-                "id": new_id,
                 "title": title.strip(),
                 "author": author.strip(),
                 "cover_url": cover_url.strip(),
@@ -618,10 +1074,37 @@ def app():
                 "available": True,
                 "added_on": str(date.today())
             }
-            books.append(new_book)
-            save_books(books)
+            # the store assigns the id and appends without rewriting the catalog by hand
+            get_storage().add_books([new_book])
             st.success(f"Book '{title}' added successfully ✅")
 
+    elif page=="Bulk Import/Export" and current_user['role']=="librarian":
+        st.header("📦 Bulk Import / Export")
+        st.caption("CSV columns: title, author, cover_url, description, index, genre, keywords, added_on "
+                   "(list fields separated by |). JSONL: one book object per line.")
+        upload = st.file_uploader("Catalog file", type=list(bulk.FORMATS))
+        if upload is not None and st.button("Import"):
+            fmt = "jsonl" if upload.name.lower().endswith(".jsonl") else "csv"
+            status = st.empty()
+            text = io.TextIOWrapper(upload, encoding="utf-8-sig", errors="surrogateescape", newline="")
+            summary = import_books(text, fmt,
+                                   progress=lambda s: status.info(f"Imported {s['imported']} books so far…"))
+            status.success(f"Imported {summary['imported']} books, rejected {summary['rejected']} rows.")
+            if summary['stopped']:
+                st.error(f"Import stopped at line {summary['stopped']['line']}: {summary['stopped']['error']}. "
+                         "Rows before it were imported; fix the file and import the rest.")
+            if summary['errors']:
+                st.warning("\n".join(f"Line {e['line']}: {e['error']}" for e in summary['errors']))
+
+        st.subheader("Export")
+        fmt = st.radio("Format", list(bulk.FORMATS), horizontal=True, key="export_format")
+        what = st.radio("Data", ["Catalog", "Loan history"], horizontal=True, key="export_what")
+        if st.button("Prepare export"):
+            # Streamlit download buttons need the whole payload; the API streams it instead
+            chunks = export_catalog(fmt) if what == "Catalog" else export_loans(fmt)
+            name = "books" if what == "Catalog" else "loans"
+            st.download_button(f"Download {name}.{fmt}", "".join(chunks), file_name=f"{name}.{fmt}")
+
     elif page=="Delete Book" and current_user['role']=="librarian":
         st.header("🗑 Delete a Book")
         books = get_books()
@@ -635,22 +1118,83 @@ def app():
 
     elif page=="Issued Overview" and current_user['role']=="librarian":
         st.header("📖 Issued Books Overview")
-        issued = get_issued()
+        issued = get_storage().active_loans()
         if not issued:
-            st.info("No issued books yet.")
+            st.info("No books are out on loan right now.")
         else:
-            for rec in issued:
-                b = next((x for x in get_books() if x['id']==rec['book_id']), None)
+            late = overdue_with_fines()
+            if late:
+                st.warning(f"⚠ {len(late)} loan(s) overdue — ₹{sum(f for _, f in late)} in fines so far")
+                with st.expander("Overdue loans"):
+                    for rec, fine_now in late:
+                        b = get_book(rec['book_id'])
+                        title = b['title'] if b else f"Book #{rec['book_id']}"
+                        st.write(f"{title} — {rec['user_email']} — due {rec['due_date']} — ₹{fine_now}")
+            days = st.number_input("Due within (days)", min_value=0, max_value=365, value=3, key="due_within_days")
+            soon = loans_due_within(int(days))
+            with st.expander(f"Due within {int(days)} day(s): {len(soon)}"):
+                for rec in soon:
+                    b = get_book(rec['book_id'])
+                    title = b['title'] if b else f"Book #{rec['book_id']}"
+                    st.write(f"{title} — {rec['user_email']} — due {rec['due_date']}")
+
+            page_recs = paginate_ui(issued, "issued_overview", noun="loans")
+            for rec, fine_now in zip(page_recs, fines_for_records(page_recs)):
+                b = get_book(rec['book_id'])
                 if not b: continue
                 st.markdown(f"### {b['title']} by {b['author']}")
                 st.write(f"*Issued to:* {rec['user_email']}")
                 st.write(f"*Issued on:* {rec['issue_date']}  |  *Due:* {rec['due_date']}")
-                if rec['returned']:
-                    st.success(f"✅ Returned on {rec['return_date']}")
-                else:
-                    fine_now = calculate_fine_for_record(rec)
-                    if fine_now > 0:
-                        st.warning(f"⚠ Overdue — Fine so far: ₹{fine_now}")
+                if fine_now > 0:
+                    st.warning(f"⚠ Overdue — Fine so far: ₹{fine_now}")
+
+        st.subheader("🗄 Loan archive")
+        months = archive_months()
+        if not months:
+            st.info("No returned loans yet.")
+        else:
+            month = st.selectbox("Issued in", list(reversed(months)), key="archive_month")
+            returned = archived_loans(since=month, until=month)
+            st.caption(f"{len(returned)} returned loan(s)")
+            for rec in paginate_ui(returned, "loan_archive", noun="loans"):
+                b = get_book(rec['book_id'])
+                title = b['title'] if b else f"Book #{rec['book_id']}"
+                st.write(f"{title} — {rec['user_email']} — issued {rec['issue_date']} — returned {rec['return_date']}")
+
+    elif page=="Analytics" and current_user['role']=="librarian":
+        st.header("📈 Circulation Analytics")
+        stats = circulation_analytics()
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Loans issued", stats['total_issues'])
+        c2.metric("Avg loan length", f"{stats['avg_loan_days']} days" if stats['avg_loan_days'] is not None else "—")
+        c3.metric("Overdue now", f"{stats['overdue_now']} / {stats['on_loan_now']}")
+        c4.metric("Fines collected", f"₹{stats['fines_collected']}")
+        if stats['returned_late_rate'] is not None:
+            st.caption(f"{stats['returned_late_rate']:.1%} of returned loans came back late.")
+
+        st.subheader("Most borrowed")
+        if stats['most_borrowed']:
+            st.table([{"Title": b['title'], "Loans": b['issues']} for b in stats['most_borrowed']])
+        else:
+            st.info("No loans yet.")
+
+        st.subheader("Genre utilization")
+        if stats['genres']:
+            st.table([{"Genre": g['genre'], "Loans": g['issues'], "On loan": g['on_loan'], "Books": g['books'],
+                       "Utilization": f"{g['utilization']:.0%}" if g['utilization'] is not None else "—"}
+                      for g in stats['genres']])
+
+        st.subheader("Fines collected by month")
+        if stats['months']:
+            st.bar_chart({"Fines (₹)": {m['month']: m['fines'] for m in stats['months']}})
+            st.table([{"Month": m['month'], "Issued": m['issues'], "Returned": m['returns'],
+                       "Returned late": m['returned_late'], "Fines (₹)": m['fines']} for m in stats['months']])
+
+        if st.button("Rebuild from loan history", key="analytics_rebuild"):
+            # e.g. after a bulk loan import or editing the data files by hand
+            rebuild_analytics()
+            st.success("Analytics rebuilt.")
+            st.rerun()
 
     elif page=="Account":
         st.header("👤 Account Details")
@@ -663,19 +1207,41 @@ def app():
             new = st.text_input("New password", type="password", key="new_pass")
             confirm = st.text_input("Confirm new password", type="password", key="confirm_pass")
             if st.button("Submit Password Change", key="submit_pass"):
-                users = get_users()
-                u = next((x for x in users if x['email'].lower()==current_user['email'].lower()), None)
+                u = get_user(current_user['email'])
                 if not u or u['password_hash'] != hash_password(old):
                     st.error("Current password incorrect.")
                 elif new != confirm:
                     st.error("New passwords do not match.")
                 else:
                     u['password_hash'] = hash_password(new)
-                    save_users(users)
+                    save_user(u)
                     st.success("Password changed successfully.")
 
 # -------------------------
 # Entry point
 # -------------------------
 if __name__ == "__main__":
-    app()
+    if sys.argv[1:2] == ["api"]:
+        import uvicorn
+        uvicorn.run("api:api", host="0.0.0.0", port=8000)
+    elif sys.argv[1:2] == ["notify"]:
+        # one-shot rebuild of every feed, e.g. from cron
+        bootstrap_files()
+        print(f"Notification feeds written for {refresh_notifications()} user(s) to {NOTIFY_FILE}")
+    elif sys.argv[1:2] == ["analytics-rebuild"]:
+        bootstrap_files()
+        rollups = rebuild_analytics()
+        print(f"Analytics rebuilt from {sum(r[0] for r in rollups.books.values())} loan(s) into {ANALYTICS_DIR}/")
+    elif sys.argv[1:2] == ["sheets-sync"]:
+        if not SHEETS_KEY:
+            sys.exit("Set LIBRARY_SHEETS_KEY to the spreadsheet key first.")
+        bootstrap_files()
+        stats = sync_sheets()
+        if stats is None:
+            print("Another process is syncing right now.")
+        for s in stats or []:
+            print(f"{s['sheet']}: " + ("unchanged" if s['skipped'] else
+                  f"{s['rows_written']} row(s) written, {s['rows_cleared']} cleared, {s['requests']} request(s)"))
+    else:
+        with metrics.render_scope():
+            app()
@@ -0,0 +1,95 @@
+"""Circulation analytics benchmark: rollup reads vs. recomputing from history.
+
+Generates a library, then reports
+  rebuild        one vectorized pass over the whole loan history (what the
+                 first analytics read and `python app.py analytics-rebuild` do)
+  read           circulation_analytics() from the in-memory rollups
+  issue/return   --ops issue_book_to_user + return_book_from_user calls, with
+                 the time spent appending their rollup events
+  catch_up       a fresh reader folding the events appended since the snapshot
+and checks that the incrementally maintained rollups equal a rebuild.
+
+    python benchmarks/analytics_bench.py --scale 10k --ops 200
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_data  # noqa: E402
+
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - started
+
+
+def run(data_dir: str, n_ops: int, seed: int) -> dict:
+    os.chdir(data_dir)
+    import app  # noqa: E402  (after chdir: the app resolves its files relative to cwd)
+    import analytics  # noqa: E402
+    rnd = random.Random(seed)
+    report = {"loans": len(app.get_issued())}
+    _, report["rebuild_seconds"] = _timed(app.rebuild_analytics)
+    reads = [_timed(app.circulation_analytics)[1] for _ in range(20)]
+    report["read_seconds_median"] = round(statistics.median(reads), 5)
+
+    record = app.record_circulation
+    spent = []
+
+    def timed_record(events):
+        _, seconds = _timed(record, events)
+        spent.append(seconds)
+    app.record_circulation = timed_record
+    users = [u['email'] for u in app.get_users()]
+    available = [b['id'] for b in app.get_books() if b.get('available', True)]
+    pairs = [(rnd.choice(users), book_id) for book_id in rnd.sample(available, min(n_ops, len(available)))]
+    _, issue_seconds = _timed(lambda: [app.issue_book_to_user(e, b) for e, b in pairs])
+    _, return_seconds = _timed(lambda: [app.return_book_from_user(e, b) for e, b in pairs])
+    app.record_circulation = record
+    report["issue_return_ops"] = 2 * len(pairs)
+    report["op_seconds_mean"] = round((issue_seconds + return_seconds) / max(1, 2 * len(pairs)), 5)
+    report["record_seconds_mean"] = round(statistics.mean(spent), 6) if spent else 0.0
+
+    fresh = analytics.RollupStore(app.ANALYTICS_DIR)
+    _, report["catch_up_seconds"] = _timed(fresh.rollups)
+    incremental = app.circulation_analytics(top=50)
+    app.rebuild_analytics()
+    report["matches_rebuild"] = incremental == app.circulation_analytics(top=50)
+    report["rebuild_seconds"] = round(report["rebuild_seconds"], 4)
+    report["catch_up_seconds"] = round(report["catch_up_seconds"], 5)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", help="directory made by generate_data.py (copied first)")
+    parser.add_argument("--scale", choices=sorted(generate_data.SCALES), default="10k")
+    parser.add_argument("--ops", type=int, default=200, help="books issued and then returned")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="library-analytics-")
+    try:
+        data_dir = os.path.join(scratch, "data")
+        if args.data:
+            shutil.copytree(args.data, data_dir)
+        else:
+            generate_data.generate(data_dir, *generate_data.SCALES[args.scale], seed=args.seed)
+        print(json.dumps(run(data_dir, args.ops, args.seed), indent=2))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Chatbot benchmark: substring intent chain vs. the compiled chatbot.IntentMatcher.
+
+Classifies a mixed corpus of chat messages with both matchers and reports
+messages per second and how many messages each one routes differently
+(the substring chain fires "hi" inside words such as "this" or "history"),
+also with the intent table grown by synthetic intents (--table-sizes).
+Then times the "what genres are available?" answer over a generated catalog,
+recomputed per message as before vs. served from chatbot.cached_answer().
+Recommendation handlers are left out: they are search/recommender latency,
+which run_benchmarks.py already covers.
+
+    python benchmarks/chatbot_bench.py --messages 50000 --books 100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chatbot  # noqa: E402
+from storage import normalize_genres  # noqa: E402
+
+TEMPLATES = [
+    "recommend {w} books", "Can you suggest something about {w}?", "any recommendations for {w}",
+    "how to issue a book", "How do I return a book?", "how to return {w}",
+    "what genres are available?", "list all categories", "hi", "Hello there!", "hey",
+    "this is about {w} history", "which {w} titles are in the library", "thanks, that was it",
+]
+WORDS = ["python", "history", "physics", "poetry", "thriller", "chess", "cooking", "space", "ethics", "this"]
+GENRES = ["Classic Fiction", "Dystopian", "Romance", "Fantasy", "Science Fiction", "Mystery", "Thriller",
+          "History", "Biography", "Self-Help", "Software Engineering", "Data Science", "Philosophy"]
+
+
+def legacy_intent(message: str):
+    # the substring chain chatbot_response_for_user used before
+    m = message.strip().lower()
+    if not m:
+        return None
+    if "recommend" in m or "suggest" in m:
+        return "recommend"
+    if "how to issue" in m or "issue a book" in m:
+        return "how_to_issue"
+    if "how to return" in m or "return a book" in m:
+        return "how_to_return"
+    if "genres" in m or "categories" in m:
+        return "genres"
+    if any(x in m for x in ["hi", "hello", "hey"]):
+        return "greeting"
+    return None
+
+
+def compiled_matcher(extra: int = 0):
+    noop = lambda email, rest: ""
+    return chatbot.IntentMatcher([
+        chatbot.Intent("recommend", ["recommend*", "suggest*"], noop),
+        chatbot.Intent("how_to_issue", ["how to issue", "issue a book"], noop),
+        chatbot.Intent("how_to_return", ["how to return", "return a book"], noop),
+        chatbot.Intent("genres", ["genre*", "categor*"], noop),
+    ] + extra_intents(extra, noop) + [
+        chatbot.Intent("greeting", ["hi", "hello", "hey"], noop),
+    ])
+
+
+def extra_intents(n: int, handler):
+    # stand-ins for a larger table (opening hours, fines, renewals, ...)
+    return [chatbot.Intent(f"extra{i}", [f"topic{i}", f"ask about topic{i}", f"topic{i}x*"], handler)
+            for i in range(n)]
+
+
+def legacy_chain(n: int):
+    # the substring chain grown by the same extra intents
+    extra = [(f"extra{i}", (f"topic{i}", f"ask about topic{i}", f"topic{i}x")) for i in range(n)]
+
+    def classify(message):
+        intent = legacy_intent(message)
+        if intent not in (None, "greeting"):
+            return intent
+        m = message.strip().lower()
+        for name, triggers in extra:
+            if any(t in m for t in triggers):
+                return name
+        return intent
+    return classify
+
+
+def rate(fn, items):
+    started = time.perf_counter()
+    for x in items:
+        fn(x)
+    elapsed = time.perf_counter() - started
+    return round(len(items) / elapsed, 1) if elapsed else None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--books", type=int, default=100000)
+    parser.add_argument("--genre-questions", type=int, default=200)
+    parser.add_argument("--table-sizes", default="0,20,100", help="extra intents to add for the scaling runs")
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+
+    messages = [rnd.choice(TEMPLATES).format(w=rnd.choice(WORDS)) for _ in range(args.messages)]
+    matcher = compiled_matcher()
+
+    def compiled_intent(message):
+        hit = matcher.match(message)
+        return hit[0].name if hit else None
+
+    differ = {}
+    for msg in set(messages):
+        old, new = legacy_intent(msg), compiled_intent(msg)
+        if old != new:
+            differ[msg] = {"substring": old, "compiled": new}
+
+    catalog = [{"id": i, "genre": rnd.sample(GENRES, rnd.choice((1, 2))) if i % 3 else rnd.choice(GENRES)}
+               for i in range(1, args.books + 1)]
+
+    def genres_uncached(_):
+        return sorted({g for b in catalog for g in normalize_genres(b.get('genre'))})
+
+    def genres_cached(_):
+        return chatbot.cached_answer("bench_genres", 1, lambda: genres_uncached(None))
+
+    scaling = {}
+    for n in (int(x) for x in args.table_sizes.split(",")):
+        big = compiled_matcher(n)
+        scaling[str(5 + n)] = {"substring": rate(legacy_chain(n), messages),
+                               "compiled": rate(big.match, messages)}
+
+    questions = list(range(args.genre_questions))
+    report = {
+        "messages": args.messages,
+        "intent_messages_per_second": {"substring": rate(legacy_intent, messages),
+                                       "compiled": rate(compiled_intent, messages)},
+        "messages_per_second_by_table_size": scaling,
+        "routed_differently": differ,
+        "genre_answer": {"books": args.books,
+                         "uncached_per_second": rate(genres_uncached, questions),
+                         "cached_per_second": rate(genres_cached, questions)},
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
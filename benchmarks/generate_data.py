@@ -0,0 +1,142 @@
+"""Seeded synthetic library generator.
+
+Writes books_data.json, users.json and issued_books.json in the app's schema
+into a directory, streaming one record per line so 1M-book catalogs never
+have to sit in memory as a whole. Loan histories are consistent with the
+catalog: a book has at most one open loan and is marked unavailable exactly
+when it has one. Every generated user's password is BENCH_PASSWORD.
+
+    python benchmarks/generate_data.py --scale 10k --out /tmp/lib10k
+    python benchmarks/generate_data.py --books 250000 --users 20000 --loans 500000 --out /tmp/lib
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+from datetime import date, timedelta
+
+SCALES = {
+    # books, users, loans
+    "10k": (10_000, 1_000, 20_000),
+    "100k": (100_000, 10_000, 200_000),
+    "1m": (1_000_000, 100_000, 2_000_000),
+}
+BENCH_PASSWORD = "Bench#1234"
+LOAN_DAYS = 14
+ACTIVE_SHARE = 0.05
+
+GENRES = ["Classic Fiction", "Dystopian", "Romance", "Fantasy", "Science Fiction", "Mystery", "Thriller",
+          "History", "Biography", "Self-Help", "Software Engineering", "Data Science", "Philosophy",
+          "Poetry", "Travel", "Economics", "Psychology", "Children", "Horror", "Science"]
+SYLLABLES = ["ka", "lo", "mi", "ra", "ten", "dor", "vel", "an", "is", "or", "um", "bra", "thi", "sol",
+             "mar", "qu", "nex", "zu", "pel", "cor", "ian", "eth", "ul", "ry"]
+
+
+def _words(rnd: random.Random, n: int):
+    return ["".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 3))) for _ in range(n)]
+
+
+def _write_array(path: str, records):
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for rec in records:
+            if count:
+                f.write(",\n")
+            f.write(json.dumps(rec, ensure_ascii=False))
+            count += 1
+        f.write("\n]\n")
+    return count
+
+
+def generate(out: str, n_books: int, n_users: int, n_loans: int, seed: int = 42, today: date = None):
+    rnd = random.Random(seed)
+    today = today or date.today()
+    os.makedirs(out, exist_ok=True)
+    vocab = _words(rnd, 20_000)
+    authors = [f"{w.title()} {v.title()}" for w, v in zip(_words(rnd, max(100, n_books // 20)),
+                                                          _words(rnd, max(100, n_books // 20)))]
+    emails = [f"user{i}@example.com" for i in range(n_users)]
+
+    # loans first: they decide which books are currently out
+    holder = {}
+    loans = []
+    for _ in range(n_loans):
+        book_id = rnd.randint(1, n_books)
+        issue = today - timedelta(days=rnd.randint(0, 730))
+        due = issue + timedelta(days=LOAN_DAYS)
+        email = rnd.choice(emails)
+        active = book_id not in holder and rnd.random() < ACTIVE_SHARE
+        if active:
+            holder[book_id] = email
+        else:
+            returned = issue + timedelta(days=rnd.randint(1, LOAN_DAYS + 10))
+        loans.append({
+            "user_email": email,
+            "book_id": book_id,
+            "issue_date": str(issue),
+            "due_date": str(due),
+            "returned": not active,
+            "return_date": None if active else str(min(returned, today))
+        })
+    loans.sort(key=lambda r: r['issue_date'])
+
+    def books():
+        for i in range(1, n_books + 1):
+            words = rnd.sample(vocab, 8)
+            book = {
+                "id": i,
+                "title": " ".join(words[:rnd.randint(1, 4)]).title(),
+                "author": rnd.choice(authors),
+                "cover_url": "",
+                "description": " ".join(words) + ".",
+                "index": [f"Chapter {c}: {w.title()}" for c, w in enumerate(words[:3], 1)],
+                "genre": rnd.sample(GENRES, rnd.choice((1, 1, 2))),
+                "keywords": words[4:7],
+                "available": i not in holder,
+                "added_on": str(today - timedelta(days=rnd.randint(0, 3650)))
+            }
+            if i in holder:
+                book['issued_to'] = holder[i]
+            yield book
+
+    password_hash = hashlib.sha256(BENCH_PASSWORD.encode()).hexdigest()
+
+    def users():
+        for i, email in enumerate(emails):
+            yield {
+                "name": f"User {i}",
+                "mobile": f"9{i:09d}",
+                "email": email,
+                "password_hash": password_hash,
+                "role": "librarian" if i == 0 else "user",
+                "favorites": rnd.sample(range(1, n_books + 1), min(n_books, rnd.randint(0, 5)))
+            }
+
+    return {
+        "books": _write_array(os.path.join(out, "books_data.json"), books()),
+        "users": _write_array(os.path.join(out, "users.json"), users()),
+        "loans": _write_array(os.path.join(out, "issued_books.json"), loans),
+        "active_loans": len(holder),
+        "seed": seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--scale", choices=sorted(SCALES), default="10k")
+    parser.add_argument("--books", type=int)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--loans", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    n_books, n_users, n_loans = SCALES[args.scale]
+    summary = generate(args.out, args.books or n_books, args.users or n_users,
+                       args.loans if args.loans is not None else n_loans, args.seed)
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+"""End-to-end load test of the REST API (api.py) on one machine.
+
+Starts `uvicorn api:api` on a copy of a generated library (see
+generate_data.py) and drives it with virtual users: client processes with
+one thread and one keep-alive HTTP connection per user, each logging in
+(POST /login, outside the timings) and then picking operations from --mix for
+--duration seconds:
+
+  search      GET  /search?q=<two title words>
+  issue       POST /issue      a book from a pool of --pool ids, so desks collide
+  return      POST /return     one of the user's own loans from this run
+                               (an issue instead while it holds none)
+  recommend   GET  /recommendations
+  signup      POST /signup     a fresh account
+
+--users takes a list of concurrency levels, run one after another against the
+same server. Each level reports throughput and latency percentiles overall and
+per operation; responses are counted as ok (2xx), rejected (4xx: the book was
+taken, busy, ...) or errors (5xx, dropped connections). With --p99-budget the
+first level whose overall p99 exceeds it is reported as the degradation point.
+
+After the last level the server is stopped and the data is checked: no book
+out on two open loans, availability flags agree with the open loans, no loan
+pointing at a missing book or user, every successful issue/return/signup
+accounted for in the stored data. Nothing but this machine is used; the
+script exits non-zero when the check fails.
+
+    python benchmarks/load_test.py --scale 10k --users 1,8,32,64 --duration 10
+    python benchmarks/load_test.py --data /tmp/lib100k --backend sqlite --workers 4 --p99-budget 250
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_data  # noqa: E402
+from run_benchmarks import PERCENTILES, _percentile  # noqa: E402
+
+DEFAULT_MIX = "search=50,issue=15,return=15,recommend=15,signup=5"
+OPERATIONS = ("search", "issue", "return", "recommend", "signup")
+SIGNUP_PASSWORD = "Load-test-1!"
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r} (choose from {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one operation with a positive weight")
+    return mix
+
+
+# -------------------------
+# Server
+# -------------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(data_dir: str, backend: str, workers: int, deadline: float = 120.0):
+    port = _free_port()
+    env = dict(os.environ, LIBRARY_STORAGE=backend)
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "api:api", "--app-dir", REPO, "--port", str(port),
+                             "--workers", str(workers), "--log-level", "warning"], cwd=data_dir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    started = time.perf_counter()
+    while True:
+        if proc.poll() is not None:
+            raise RuntimeError("API server exited during startup")
+        if time.perf_counter() - started > deadline:
+            proc.terminate()
+            raise RuntimeError("API server not ready in time")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1.0)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return proc, port
+        except OSError:
+            time.sleep(0.05)
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+# -------------------------
+# Virtual users
+# -------------------------
+class Connection:
+    def __init__(self, port: int):
+        self.port = port
+        self.conn = None
+        self.token = None
+
+    def login(self, email: str, password: str = generate_data.BENCH_PASSWORD) -> bool:
+        status, payload = self.request("POST", "/login", {"email": email, "password": password})
+        self.token = json.loads(payload)['token'] if status == 200 else None
+        return self.token is not None
+
+    def request(self, method: str, path: str, body=None):
+        # (status, body); status 0 when the connection failed. Never retried,
+        # so a dropped POST is reported instead of possibly applied twice
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        try:
+            self.conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            resp = self.conn.getresponse()
+            return resp.status, resp.read()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = None
+            return 0, b""
+
+
+def _empty_totals() -> dict:
+    return {"ops": {op: {"latencies": [], "ok": 0, "rejected": 0, "errors": 0} for op in OPERATIONS},
+            "issued": 0, "returned": 0, "signed_up": [], "unsure_issues": 0, "unsure_returns": 0}
+
+
+def client_process(port: int, emails: list, mix: dict, pool: list, words: list, duration: float,
+                   tag: str, seed: int) -> dict:
+    totals = _empty_totals()
+    guard = threading.Lock()
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    start = threading.Barrier(len(emails))
+
+    def run(n: int, email: str):
+        rnd = random.Random(f"{seed}-{tag}-{n}")
+        conn = Connection(port)
+        conn.login(email)
+        local = _empty_totals()
+        held = []
+        start.wait()
+        deadline = time.perf_counter() + duration
+        count = 0
+        while time.perf_counter() < deadline:
+            op = rnd.choices(names, weights)[0]
+            if op == "return" and not held:
+                op = "issue"
+            book_id = rnd.choice(held) if op == "return" else rnd.choice(pool)
+            if op == "search":
+                call = ("GET", "/search?" + urllib.parse.urlencode({"q": " ".join(rnd.sample(words, 2))}), None)
+            elif op == "issue":
+                call = ("POST", "/issue", {"book_id": book_id})
+            elif op == "return":
+                call = ("POST", "/return", {"book_id": book_id})
+            elif op == "recommend":
+                call = ("GET", "/recommendations", None)
+            else:
+                count += 1
+                new_email = f"load-{tag}-{n}-{count}@example.com"
+                call = ("POST", "/signup", {"name": f"Load {n}", "email": new_email, "password": SIGNUP_PASSWORD})
+            t = time.perf_counter_ns()
+            status, payload = conn.request(*call)
+            stats = local["ops"][op]
+            stats["latencies"].append((time.perf_counter_ns() - t) / 1e6)
+            if op == "signup" and status == 200 and not json.loads(payload).get("success"):
+                # the endpoint answers 200 with success=false for refusals
+                status = 400
+            if 200 <= status < 300:
+                stats["ok"] += 1
+                if op == "issue":
+                    held.append(book_id)
+                    local["issued"] += 1
+                elif op == "return":
+                    held.remove(book_id)
+                    local["returned"] += 1
+                elif op == "signup":
+                    local["signed_up"].append(new_email)
+            elif 400 <= status < 500:
+                stats["rejected"] += 1
+                if op == "return" and status == 404:
+                    held.remove(book_id)
+            else:
+                stats["errors"] += 1
+                if op == "issue":
+                    local["unsure_issues"] += 1
+                elif op == "return":
+                    # it may have gone through; stop treating the book as ours
+                    held.remove(book_id)
+                    local["unsure_returns"] += 1
+        with guard:
+            _merge(totals, local)
+
+    threads = [threading.Thread(target=run, args=(n, email)) for n, email in enumerate(emails)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return totals
+
+
+def _merge(into: dict, part: dict):
+    for op, stats in part["ops"].items():
+        target = into["ops"][op]
+        target["latencies"].extend(stats["latencies"])
+        for k in ("ok", "rejected", "errors"):
+            target[k] += stats[k]
+    for k in ("issued", "returned", "unsure_issues", "unsure_returns"):
+        into[k] += part[k]
+    into["signed_up"].extend(part["signed_up"])
+
+
+def _latency_summary(latencies: list, seconds: float) -> dict:
+    latencies = sorted(latencies)
+    out = {"requests": len(latencies), "per_second": round(len(latencies) / seconds, 1)}
+    if latencies:
+        out["mean_ms"] = round(sum(latencies) / len(latencies), 2)
+        for p in PERCENTILES:
+            out[f"p{p}_ms"] = round(_percentile(latencies, p), 2)
+        out["max_ms"] = round(latencies[-1], 2)
+    return out
+
+
+def run_level(port: int, n_users: int, clients: int, mix: dict, pool: list, words: list, emails: list,
+              duration: float, level: int, seed: int) -> dict:
+    clients = max(1, min(clients, n_users))
+    picked = [emails[i % len(emails)] for i in range(n_users)]
+    shares = [picked[c::clients] for c in range(clients)]
+    ctx = multiprocessing.get_context("spawn")
+    started = time.perf_counter()
+    with ctx.Pool(clients) as workers:
+        parts = workers.starmap(client_process, [(port, share, mix, pool, words, duration, f"{level}-{c}", seed)
+                                                 for c, share in enumerate(shares)])
+    # wall time includes client start-up; the users themselves ran for `duration`
+    wall = time.perf_counter() - started
+    totals = _empty_totals()
+    for part in parts:
+        _merge(totals, part)
+    every = [ms for stats in totals["ops"].values() for ms in stats["latencies"]]
+    result = {"users": n_users, "seconds": duration, "wall_seconds": round(wall, 2),
+              "all": _latency_summary(every, duration),
+              "ok": sum(s["ok"] for s in totals["ops"].values()),
+              "rejected": sum(s["rejected"] for s in totals["ops"].values()),
+              "errors": sum(s["errors"] for s in totals["ops"].values()),
+              "ops": {}}
+    for op, stats in totals["ops"].items():
+        if stats["latencies"]:
+            result["ops"][op] = dict(_latency_summary(stats["latencies"], duration), ok=stats["ok"],
+                                     rejected=stats["rejected"], errors=stats["errors"])
+    return result, totals
+
+
+# -------------------------
+# Consistency check
+# -------------------------
+def verify(data_dir: str, backend: str, before: dict, totals: dict) -> dict:
+    # runs in a child process: the app reads the data directory it starts in
+    code = f"""
+import json, os, sys
+sys.path.insert(0, {REPO!r})
+import app
+store = app.get_storage()
+loans = store.issued()
+books = {{b['id']: b for b in store.books()}}
+users = {{u['email'] for u in app.get_users()}}
+open_by_book = {{}}
+problems = []
+for r in loans:
+    if r['book_id'] not in books:
+        problems.append(f"loan of missing book {{r['book_id']}} by {{r['user_email']}}")
+    if r['user_email'] not in users:
+        problems.append(f"loan of book {{r['book_id']}} by unknown user {{r['user_email']}}")
+    if not r.get('returned', False):
+        if r['book_id'] in open_by_book:
+            problems.append(f"book {{r['book_id']}} is out on two open loans")
+        open_by_book[r['book_id']] = r
+for book_id, b in books.items():
+    if b.get('available', True) == (book_id in open_by_book):
+        problems.append(f"book {{book_id}} availability disagrees with its loans")
+signed_up = json.load(sys.stdin)
+problems += [f"signed-up user {{e}} is missing" for e in signed_up if e not in users]
+print(json.dumps({{"problems": problems, "loans": len(loans),
+                  "returned": sum(1 for r in loans if r.get('returned', False)),
+                  "open": len(open_by_book), "users": len(users)}}))
+"""
+    out = subprocess.run([sys.executable, "-c", code], cwd=data_dir, env=dict(os.environ, LIBRARY_STORAGE=backend),
+                         input=json.dumps(totals["signed_up"]), capture_output=True, text=True, check=True)
+    after = json.loads(out.stdout.strip().splitlines()[-1])
+    problems = after.pop("problems")
+    new_loans = after["loans"] - before["loans"]
+    new_returns = after["returned"] - before["returned"]
+    if not totals["issued"] <= new_loans <= totals["issued"] + totals["unsure_issues"]:
+        problems.append(f"{totals['issued']} successful issues but {new_loans} new loan records")
+    if not totals["returned"] <= new_returns <= totals["returned"] + totals["unsure_returns"]:
+        problems.append(f"{totals['returned']} successful returns but {new_returns} loans newly returned")
+    return {"before": before, "after": after, "issued": totals["issued"], "returned": totals["returned"],
+            "signed_up": len(totals["signed_up"]), "problems": problems}
+
+
+def _counts(data_dir: str, backend: str) -> dict:
+    code = (f"import json, sys\nsys.path.insert(0, {REPO!r})\nimport app\nloans = app.get_issued()\n"
+            "print(json.dumps({'loans': len(loans), 'returned': sum(1 for r in loans if r.get('returned', False))}))")
+    out = subprocess.run([sys.executable, "-c", code], cwd=data_dir, env=dict(os.environ, LIBRARY_STORAGE=backend),
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+# -------------------------
+# Driver
+# -------------------------
+def run(data_dir: str, backend: str, workers: int, levels: list, clients: int, mix: dict, duration: float,
+        pool_size: int, p99_budget: float, seed: int) -> dict:
+    rnd = random.Random(seed)
+    with open(os.path.join(data_dir, "books_data.json"), "r", encoding="utf-8") as f:
+        books = json.load(f)
+    with open(os.path.join(data_dir, "users.json"), "r", encoding="utf-8") as f:
+        emails = [u['email'] for u in json.load(f) if u.get('role') != "librarian"]
+    rnd.shuffle(emails)
+    words = [w for b in rnd.sample(books, min(len(books), 500)) for w in b['title'].split()]
+    shelf = [b['id'] for b in books if b.get('available', True)]
+    pool = rnd.sample(shelf, min(pool_size, len(shelf)))
+    del books
+
+    before = _counts(data_dir, backend)
+    proc, port = start_server(data_dir, backend, workers)
+    totals = _empty_totals()
+    report = {"backend": backend, "workers": workers, "mix": mix, "pool": len(pool), "levels": []}
+    try:
+        # first searches/recommendations build each worker's indexes; keep
+        # that out of the first level. Fresh connections in parallel so the
+        # kernel hands them to every worker process
+        def warm(n: int):
+            conn = Connection(port)
+            conn.request("GET", "/search?q=" + urllib.parse.quote(words[n % len(words)]))
+            conn.login(emails[n % len(emails)])
+            conn.request("GET", "/recommendations")
+        warmers = [threading.Thread(target=warm, args=(n,)) for n in range(4 * workers)]
+        for t in warmers:
+            t.start()
+        for t in warmers:
+            t.join()
+        for level, n_users in enumerate(levels):
+            result, level_totals = run_level(port, n_users, clients, mix, pool, words, emails, duration, level, seed)
+            _merge(totals, level_totals)
+            report["levels"].append(result)
+    finally:
+        stop_server(proc)
+    if p99_budget:
+        over = [r["users"] for r in report["levels"] if r["all"].get("p99_ms", 0) > p99_budget]
+        report["p99_budget_ms"] = p99_budget
+        report["p99_exceeded_at_users"] = over[0] if over else None
+    report["consistency"] = verify(data_dir, backend, before, totals)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", help="directory made by generate_data.py (copied first)")
+    parser.add_argument("--scale", choices=sorted(generate_data.SCALES), default="10k")
+    parser.add_argument("--backend", choices=["json", "sqlite", "journal", "compact"], default="json")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--users", default="1,8,32", help="concurrent virtual users per level, comma-separated")
+    parser.add_argument("--clients", type=int, default=max(1, min(4, (os.cpu_count() or 2) // 2)),
+                        help="client processes the virtual users are spread over")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--pool", type=int, default=200, help="books the issue operations draw from")
+    parser.add_argument("--p99-budget", type=float, default=0.0, help="ms; report the first level above it")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="also write the report to this file")
+    args = parser.parse_args()
+    levels = [int(n) for n in args.users.split(",") if n.strip()]
+
+    scratch = tempfile.mkdtemp(prefix="library-load-")
+    try:
+        data_dir = os.path.join(scratch, "data")
+        if args.data:
+            shutil.copytree(args.data, data_dir)
+        else:
+            generate_data.generate(data_dir, *generate_data.SCALES[args.scale], seed=args.seed)
+        report = run(data_dir, args.backend, args.workers, levels, args.clients, args.mix, args.duration,
+                     args.pool, args.p99_budget, args.seed)
+        text = json.dumps(report, indent=2)
+        print(text)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+        for p in report["consistency"]["problems"]:
+            print("FAIL:", p, file=sys.stderr)
+        if report["consistency"]["problems"]:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Record model benchmark: plain catalog dicts vs. models.Book (__slots__).
+
+Generates a library with generate_data.py, parses the catalog the way the
+JSON backend does and compares the memory retained by the parsed dicts
+against the memory retained by typed models built from a fresh parse once
+those dicts are gone (tracemalloc), plus the model build cost. Then times the
+hot loops over both forms: the catalog filter behind GET /books (genre /
+author / availability) and the chatbot's genre listing.
+
+    python benchmarks/models_bench.py --scale 100k
+"""
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_data  # noqa: E402
+import models  # noqa: E402
+from storage import normalize_genres  # noqa: E402
+
+
+def _load(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def footprint(build):
+    # bytes still allocated after build() returns, and how long it took
+    gc.collect()
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        result = build()
+        seconds = time.perf_counter() - started
+        return result, tracemalloc.get_traced_memory()[0], seconds
+    finally:
+        tracemalloc.stop()
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def dict_filter(books, genre_l, author_l, available):
+    return [
+        b for b in books
+        if (available is None or b.get('available', True) == available)
+        and (author_l is None or author_l in b.get('author', '').lower())
+        and (genre_l is None or any(g.lower() == genre_l for g in normalize_genres(b.get('genre'))))
+    ]
+
+
+def model_filter(books, genre_l, author_l, available):
+    return [b for b in books if b.matches(genre_l, author_l, available)]
+
+
+def run(data_dir: str, repeat: int):
+    report = {"memory": {}, "throughput": {}}
+    for name, fname, build in (("books", "books_data.json", models.books_from),):
+        dicts, dict_bytes, parse_s = footprint(lambda: _load(os.path.join(data_dir, fname)))
+        typed, model_bytes, _ = footprint(lambda: build(_load(os.path.join(data_dir, fname))))
+        build_s = best_of(lambda: build(dicts), 1)
+        report["memory"][name] = {
+            "records": len(dicts),
+            "dict_bytes": dict_bytes,
+            "model_bytes": model_bytes,
+            "ratio": round(model_bytes / dict_bytes, 3) if dict_bytes else None,
+            "parse_seconds": round(parse_s, 4),
+            "model_build_seconds": round(build_s, 4),
+        }
+        report.setdefault("_data", {})[name] = (dicts, typed)
+
+    books, book_models = report["_data"]["books"]
+    del report["_data"]
+    genre_l = normalize_genres(books[0].get('genre'))[0].lower()
+    author_l = books[0]['author'].split()[0].lower()
+    cases = {
+        "filter_genre": ((genre_l, None, None),),
+        "filter_author": ((None, author_l, None),),
+        "filter_genre_available": ((genre_l, None, True),),
+    }
+    for case, (args,) in cases.items():
+        assert len(dict_filter(books, *args)) == len(model_filter(book_models, *args))
+        d = best_of(lambda: dict_filter(books, *args), repeat)
+        m = best_of(lambda: model_filter(book_models, *args), repeat)
+        report["throughput"][case] = {"dict_ms": round(d * 1000, 3), "model_ms": round(m * 1000, 3),
+                                      "speedup": round(d / m, 2) if m else None}
+    d = best_of(lambda: sorted({g for b in books for g in normalize_genres(b.get('genre'))}), repeat)
+    m = best_of(lambda: sorted({g for b in book_models for g in b.genres}), repeat)
+    report["throughput"]["genre_listing"] = {"dict_ms": round(d * 1000, 3), "model_ms": round(m * 1000, 3),
+                                             "speedup": round(d / m, 2) if m else None}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", help="directory made by generate_data.py")
+    parser.add_argument("--scale", choices=sorted(generate_data.SCALES), default="10k")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    scratch = None
+    data_dir = args.data
+    if not data_dir:
+        scratch = tempfile.mkdtemp(prefix="library-models-")
+        data_dir = scratch
+        generate_data.generate(data_dir, *generate_data.SCALES[args.scale], seed=args.seed)
+    try:
+        print(json.dumps(run(data_dir, args.repeat), indent=2))
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Recommendation benchmark: legacy genre scoring vs. recommend.ContentRecommender.
+
+Builds a synthetic catalog where every book belongs to a genre and a narrower
+topic (shared author + topic words), gives every user a borrowing history
+drawn from one topic, hides one of those books and checks whether each engine
+ranks it in the top K (hit rate) and how many of the top K share the user's
+topic (precision). Also reports model build time, incremental add time and
+per-user query latency.
+
+    python benchmarks/recommend_bench.py --books 10000 --users 200
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import recommend  # noqa: E402
+
+GENRES = ["Fiction", "Science", "History", "Fantasy", "Mystery", "Romance", "Biography",
+          "Technology", "Philosophy", "Poetry", "Travel", "Economics"]
+WORDS = [f"w{i}" for i in range(5000)]
+
+
+def make_catalog(n_books: int, n_topics: int, rnd: random.Random):
+    topics = []
+    for t in range(n_topics):
+        topics.append({
+            "genre": rnd.choice(GENRES),
+            "author": f"Author {t}",
+            "words": rnd.sample(WORDS, 6),
+        })
+    books, topic_of = [], {}
+    for i in range(1, n_books + 1):
+        t = rnd.randrange(n_topics)
+        topic = topics[t]
+        words = rnd.sample(topic["words"], 3) + rnd.sample(WORDS, 4)
+        books.append({
+            "id": i,
+            "title": " ".join(words[:3]).title(),
+            "author": topic["author"] if rnd.random() < 0.7 else f"Author {rnd.randrange(n_topics)}",
+            "genre": [topic["genre"]],
+            "keywords": words[:2],
+            "description": " ".join(words),
+            "available": rnd.random() < 0.8,
+        })
+        topic_of[i] = t
+    return books, topic_of
+
+
+def make_users(n_users: int, books, topic_of, history: int, rnd: random.Random):
+    by_topic = {}
+    for b in books:
+        by_topic.setdefault(topic_of[b['id']], []).append(b['id'])
+    eligible = [t for t, ids in by_topic.items() if len(ids) > history + 1]
+    users = []
+    for _ in range(n_users):
+        t = rnd.choice(eligible)
+        picked = rnd.sample(by_topic[t], history + 1)
+        users.append({"topic": t, "history": picked[:-1], "held_out": picked[-1]})
+    return users
+
+
+def legacy_recommend(books, by_id, seed_ids, top_k):
+    # the scoring recommend_for_user used before the vector engine
+    genres = set()
+    for bid in seed_ids:
+        b = by_id.get(bid)
+        if b:
+            genres.update(b.get('genre', []))
+
+    def score(b):
+        s = 0
+        if any(g in b.get('genre', []) for g in genres):
+            s += 2
+        if b.get('available', False):
+            s += 1
+        return s
+    return [b['id'] for b in sorted(books, key=score, reverse=True)[:top_k]]
+
+
+def vector_recommend(engine, seed_ids, top_k):
+    seeds = recommend.user_seeds([], [{"book_id": i, "returned": True} for i in seed_ids])
+    return [i for i, _ in engine.recommend(seeds, exclude=seed_ids, limit=top_k)]
+
+
+def evaluate(name, fn, users, topic_of, top_k):
+    hits, precision, latencies = 0, [], []
+    for u in users:
+        started = time.perf_counter()
+        ranked = fn(u["history"])
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += u["held_out"] in ranked
+        precision.append(sum(topic_of[i] == u["topic"] for i in ranked) / top_k)
+    latencies.sort()
+    return {
+        "engine": name,
+        f"hit_rate@{top_k}": round(hits / len(users), 3),
+        f"topic_precision@{top_k}": round(statistics.mean(precision), 3),
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--topics", type=int, default=0, help="defaults to books / 25")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--history", type=int, default=4)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--adds", type=int, default=100, help="books added incrementally after the build")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+
+    books, topic_of = make_catalog(args.books + args.adds, args.topics or max(1, args.books // 25), rnd)
+    base, extra = books[:args.books], books[args.books:]
+    by_id = {b['id']: b for b in books}
+
+    engine = recommend.ContentRecommender()
+    started = time.perf_counter()
+    engine.build(base)
+    build_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for b in extra:
+        engine.add(b)
+    add_ms = (time.perf_counter() - started) * 1000 / max(1, len(extra))
+
+    users = make_users(args.users, books, topic_of, args.history, rnd)
+    results = [
+        evaluate("legacy", lambda seeds: legacy_recommend(books, by_id, seeds, args.top_k), users, topic_of, args.top_k),
+        evaluate("vector", lambda seeds: vector_recommend(engine, seeds, args.top_k), users, topic_of, args.top_k),
+    ]
+    print(json.dumps({
+        "books": len(books),
+        "users": args.users,
+        "build_seconds": round(build_s, 3),
+        "incremental_add_ms": round(add_ms, 3),
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""Benchmark harness for the app's core operations.
+
+Runs get_books, search_books, issue_book_to_user, return_book_from_user,
+the desk batches issue_books / return_books (--batch pairs per call),
+recommend_for_user and chatbot_response_for_user against a generated library
+(see generate_data.py) and records latency percentiles, throughput and the
+peak memory each operation allocates. Results are written as JSON together
+with the commit, backend and data sizes so runs can be diffed across commits;
+--baseline compares against an earlier result file and exits non-zero when an
+operation's p50 regressed by more than --tolerance.
+
+    python benchmarks/run_benchmarks.py --scale 10k --out bench-10k.json
+    python benchmarks/run_benchmarks.py --data /tmp/lib100k --backend sqlite --out new.json --baseline old.json
+
+The data directory is copied to a scratch directory first (issue/return
+write to it) unless --in-place is given.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_data  # noqa: E402
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _percentile(sorted_ms, p):
+    return sorted_ms[min(len(sorted_ms) - 1, int(round(p / 100 * (len(sorted_ms) - 1))))]
+
+
+def measure(fn, calls):
+    latencies = []
+    started = time.perf_counter()
+    for args in calls:
+        t = time.perf_counter_ns()
+        fn(*args)
+        latencies.append((time.perf_counter_ns() - t) / 1e6)
+    total = time.perf_counter() - started
+    latencies.sort()
+    out = {
+        "ops": len(calls),
+        "seconds": round(total, 4),
+        "ops_per_second": round(len(calls) / total, 2) if total else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 4),
+        "max_ms": round(latencies[-1], 4),
+    }
+    for p in PERCENTILES:
+        out[f"p{p}_ms"] = round(_percentile(latencies, p), 4)
+    return out
+
+
+def peak_memory(fn, calls):
+    # bytes allocated on top of what was live before the calls
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        for args in calls:
+            fn(*args)
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+
+def run(data_dir: str, backend: str, n_ops: int, n_writes: int, memory_ops: int, seed: int, batch: int = 10):
+    os.environ["LIBRARY_STORAGE"] = backend
+    os.chdir(data_dir)
+    import app  # noqa: E402  (after chdir/env: the app resolves its files relative to cwd)
+    rnd = random.Random(seed)
+
+    started = time.perf_counter()
+    books = app.get_books()
+    first_load = time.perf_counter() - started
+    users = [u['email'] for u in app.get_users()]
+    available = [b['id'] for b in books if b.get('available', False)]
+    words = [w for b in rnd.sample(books, min(len(books), 500)) for w in b['title'].split()]
+
+    # each issued pair is returned again, so the data ends where it started
+    pairs = list(zip((rnd.choice(users) for _ in range(n_writes)), rnd.sample(available, min(n_writes, len(available)))))
+    # desk batches take books the single-call pairs leave alone
+    single = {book_id for _, book_id in pairs}
+    rest = [b for b in available if b not in single]
+    batch_pairs = list(zip((rnd.choice(users) for _ in range(n_writes)), rnd.sample(rest, min(n_writes, len(rest)))))
+    batches = [(batch_pairs[i:i + batch],) for i in range(0, len(batch_pairs), batch)]
+    operations = {
+        "get_books": (app.get_books, [() for _ in range(n_ops)]),
+        "search_books": (app.search_books, [(" ".join(rnd.sample(words, 2)),) for _ in range(n_ops)]),
+        "issue_book_to_user": (app.issue_book_to_user, pairs),
+        "return_book_from_user": (app.return_book_from_user, pairs),
+        "issue_books": (app.issue_books, batches),
+        "return_books": (app.return_books, batches),
+        "recommend_for_user": (app.recommend_for_user, [(rnd.choice(users),) for _ in range(n_ops)]),
+        "chatbot_response_for_user": (app.chatbot_response_for_user,
+                                      [(rnd.choice(users), f"recommend {rnd.choice(words)}") for _ in range(n_ops)]),
+    }
+
+    results = {}
+    for name, (fn, calls) in operations.items():
+        if not calls:
+            continue
+        # warm derived indexes (search, recommendations) outside the timed loop
+        if name not in ("issue_book_to_user", "return_book_from_user", "issue_books", "return_books"):
+            fn(*calls[0])
+        results[name] = measure(fn, calls)
+    # memory pass: a few fresh calls per read operation under tracemalloc
+    for name in ("get_books", "search_books", "recommend_for_user", "chatbot_response_for_user"):
+        fn, calls = operations[name]
+        results[name]["peak_alloc_bytes"] = peak_memory(fn, calls[:memory_ops])
+    if pairs and memory_ops:
+        probe = pairs[:memory_ops]
+        results["issue_book_to_user"]["peak_alloc_bytes"] = peak_memory(app.issue_book_to_user, probe)
+        results["return_book_from_user"]["peak_alloc_bytes"] = peak_memory(app.return_book_from_user, probe)
+
+    sizes = {"books": len(books), "users": len(users), "loans": len(app.get_issued())}
+    return first_load, sizes, results
+
+
+def compare(results, baseline_path: str, tolerance: float):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    for name, cur in results.items():
+        old = baseline.get(name)
+        if not old or not old.get("p50_ms"):
+            continue
+        ratio = cur["p50_ms"] / old["p50_ms"]
+        cur["p50_vs_baseline"] = round(ratio, 3)
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: p50 {old['p50_ms']}ms -> {cur['p50_ms']}ms ({ratio:.2f}x)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", help="directory made by generate_data.py")
+    parser.add_argument("--scale", choices=sorted(generate_data.SCALES), default="10k",
+                        help="generate a library of this size when --data is not given")
+    parser.add_argument("--backend", choices=["json", "journal", "sqlite"], default="json")
+    parser.add_argument("--ops", type=int, default=200, help="calls per read operation")
+    parser.add_argument("--writes", type=int, default=50, help="issue/return pairs")
+    parser.add_argument("--batch", type=int, default=10, help="pairs per issue_books/return_books call")
+    parser.add_argument("--memory-ops", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--in-place", action="store_true")
+    parser.add_argument("--out", help="write the JSON result here (default: stdout)")
+    parser.add_argument("--baseline", help="earlier result file to compare p50 latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="library-bench-")
+    try:
+        if args.data and args.in_place:
+            data_dir = os.path.abspath(args.data)
+        elif args.data:
+            data_dir = os.path.join(scratch, "data")
+            shutil.copytree(args.data, data_dir)
+        else:
+            data_dir = os.path.join(scratch, "data")
+            generate_data.generate(data_dir, *generate_data.SCALES[args.scale], seed=args.seed)
+        out_path = os.path.abspath(args.out) if args.out else None
+        baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+        first_load, sizes, results = run(data_dir, args.backend, args.ops, args.writes, args.memory_ops, args.seed,
+                                        args.batch)
+        report = {
+            "meta": {
+                "commit": _commit(),
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "backend": args.backend,
+                "seed": args.seed,
+                "batch": args.batch,
+                **sizes,
+                "first_load_seconds": round(first_load, 4),
+                # ru_maxrss is KiB on Linux, bytes on macOS
+                "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            },
+            "results": results,
+        }
+        regressions = compare(results, baseline, args.tolerance) if baseline else []
+        payload = json.dumps(report, indent=2)
+        if out_path:
+            with open(out_path, "w", encoding="utf-8") as f:
+                f.write(payload + "\n")
+        else:
+            print(payload)
+        for r in regressions:
+            print("REGRESSION:", r, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Google Sheets sync benchmark against the in-memory FakeSpreadsheet.
+
+Generates a library, mirrors it once (the initial full upload), then runs
+--rounds rounds of --ops issue/return calls followed by a sync, and reports
+per round the requests, ranges and cells pushed and the local time spent
+diffing, next to the cells a whole-sheet re-upload would have written. A
+final sync with nothing changed shows the version check short-circuit.
+Transient failures can be injected with --fail-every to exercise backoff.
+
+    python benchmarks/sheets_bench.py --scale 10k --ops 50 --rounds 5
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_data  # noqa: E402
+
+
+def _totals(stats):
+    keys = ("rows_written", "rows_cleared", "requests", "ranges", "cells")
+    return {k: sum(s[k] for s in stats) for k in keys}
+
+
+def run(data_dir: str, n_ops: int, rounds: int, fail_every: int, seed: int):
+    os.chdir(data_dir)
+    import app  # noqa: E402  (after chdir: the app resolves its files relative to cwd)
+    import sheets  # noqa: E402
+    sheets.BACKOFF_BASE = 0.001
+    rnd = random.Random(seed)
+    fake = sheets.FakeSpreadsheet()
+
+    def sync():
+        started = time.perf_counter()
+        stats = app.sync_sheets(fake)
+        return dict(_totals(stats), seconds=round(time.perf_counter() - started, 4))
+
+    report = {"initial": sync(), "rounds": []}
+    users = [u['email'] for u in app.get_users()]
+    for n in range(rounds):
+        available = [b['id'] for b in app.get_books() if b.get('available', True)]
+        picked = rnd.sample(available, min(n_ops, len(available)))
+        pairs = [(rnd.choice(users), book_id) for book_id in picked]
+        app.issue_books(pairs)
+        app.return_books(pairs[: len(pairs) // 2])
+        if fail_every and n % fail_every == 0:
+            fake.fail_next(429)
+        round_stats = sync()
+        store = app.get_storage()
+        full = ((len(store.books()) + 1) * len(sheets.BOOK_COLUMNS)
+                + (len(store.issued()) + 1) * len(sheets.LOAN_COLUMNS))
+        round_stats["full_upload_cells"] = full
+        round_stats["cell_ratio"] = round(round_stats["cells"] / full, 5)
+        report["rounds"].append(round_stats)
+    report["unchanged"] = sync()
+    report["spreadsheet_calls"] = fake.calls
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", help="directory made by generate_data.py (copied first)")
+    parser.add_argument("--scale", choices=sorted(generate_data.SCALES), default="10k")
+    parser.add_argument("--ops", type=int, default=50, help="books issued per round (half are returned)")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--fail-every", type=int, default=0, help="inject a 429 every N rounds")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="library-sheets-")
+    try:
+        data_dir = os.path.join(scratch, "data")
+        if args.data:
+            shutil.copytree(args.data, data_dir)
+        else:
+            generate_data.generate(data_dir, *generate_data.SCALES[args.scale], seed=args.seed)
+        print(json.dumps(run(data_dir, args.ops, args.rounds, args.fail_every, args.seed), indent=2))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Cold-start benchmark: module imports, first page render and API readiness.
+
+Every measurement runs in a fresh interpreter against a generated library
+(see generate_data.py), --repeat times:
+
+  import_app    `import app` (what each Streamlit session and the API share)
+  import_api    `import api`
+  first_page    process start -> login page rendered -> first signed-in page
+                rendered (streamlit.testing AppTest, includes importing
+                Streamlit itself)
+  api_ready     `uvicorn api:api` spawned -> first 200 from GET /, and the
+                first GET /books after that
+
+Each import case also records which heavy optional modules ended up loaded,
+so a stray top-level import shows up even when it is fast on this machine.
+Medians are compared against --render-budget and --api-budget; the script
+exits non-zero when either is exceeded.
+
+    python benchmarks/startup_bench.py --scale 10k
+    python benchmarks/startup_bench.py --data /tmp/lib100k --render-budget 4 --api-budget 2
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_data  # noqa: E402
+
+HEAVY_MODULES = ("streamlit", "fastapi", "uvicorn", "PIL", "numpy", "pandas", "gspread", "oauth2client")
+
+IMPORT_CHILD = """
+import json, sys, time
+sys.path.insert(0, {repo!r})
+started = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - started,
+                  "loaded": sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+
+RENDER_CHILD = """
+import json, sys, time
+sys.path.insert(0, {repo!r})
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=120)
+at.run()
+login = time.perf_counter()
+with open("users.json", encoding="utf-8") as f:
+    user = next(u for u in json.load(f) if u.get("role") != "librarian")
+at.session_state["user"] = {{k: v for k, v in user.items() if k != "password_hash"}}
+at.run()
+print(json.dumps({{"login_done": login, "page_done": time.perf_counter(),
+                  "errors": [e.message for e in at.exception]}}))
+"""
+
+
+def _child(code: str, cwd: str) -> dict:
+    out = subprocess.run([sys.executable, "-c", code], cwd=cwd, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def import_time(module: str, cwd: str) -> dict:
+    return _child(IMPORT_CHILD.format(repo=REPO, module=module, heavy=HEAVY_MODULES), cwd)
+
+
+def first_page(cwd: str) -> dict:
+    # perf_counter is system-wide on Linux/macOS, so parent and child clocks
+    # can be compared directly
+    spawned = time.perf_counter()
+    r = _child(RENDER_CHILD.format(repo=REPO, app=os.path.join(REPO, "app.py")), cwd)
+    if r["errors"]:
+        raise RuntimeError(f"page raised: {r['errors']}")
+    return {"login_seconds": r["login_done"] - spawned, "seconds": r["page_done"] - spawned}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get(url: str, timeout: float = 5.0) -> int:
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        resp.read()
+        return resp.status
+
+
+def api_ready(cwd: str, deadline: float = 60.0) -> dict:
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    spawned = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "api:api", "--app-dir", REPO,
+                             "--port", str(port), "--log-level", "warning"], cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError("API server exited during startup")
+            if time.perf_counter() - spawned > deadline:
+                raise RuntimeError("API server not ready in time")
+            try:
+                if _get(base + "/", timeout=1.0) == 200:
+                    break
+            except OSError:
+                time.sleep(0.01)
+        ready = time.perf_counter() - spawned
+        _get(base + "/books?limit=20")
+        return {"seconds": ready, "first_books_seconds": time.perf_counter() - spawned}
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def _summary(runs, keys=("seconds",)):
+    out = {}
+    for key in keys:
+        values = [r[key] for r in runs]
+        out[f"{key}_median"] = round(statistics.median(values), 4)
+        out[f"{key}_min"] = round(min(values), 4)
+    return out
+
+
+def run(data_dir: str, repeat: int) -> dict:
+    results = {}
+    for module in ("app", "api"):
+        runs = [import_time(module, data_dir) for _ in range(repeat)]
+        results[f"import_{module}"] = dict(_summary(runs), loaded=runs[-1]["loaded"])
+    results["first_page"] = _summary([first_page(data_dir) for _ in range(repeat)], ("login_seconds", "seconds"))
+    results["api_ready"] = _summary([api_ready(data_dir) for _ in range(repeat)], ("seconds", "first_books_seconds"))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", help="directory made by generate_data.py (copied first)")
+    parser.add_argument("--scale", choices=sorted(generate_data.SCALES), default="10k")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--render-budget", type=float, default=5.0,
+                        help="seconds from process start to the first signed-in page")
+    parser.add_argument("--api-budget", type=float, default=3.0,
+                        help="seconds from spawning the API server to its first response")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="library-startup-")
+    try:
+        data_dir = os.path.join(scratch, "data")
+        if args.data:
+            shutil.copytree(args.data, data_dir)
+        else:
+            generate_data.generate(data_dir, *generate_data.SCALES[args.scale], seed=args.seed)
+        results = run(data_dir, args.repeat)
+        print(json.dumps({"budgets": {"render": args.render_budget, "api": args.api_budget},
+                          "results": results}, indent=2))
+        over = []
+        if results["first_page"]["seconds_median"] > args.render_budget:
+            over.append(f"first page {results['first_page']['seconds_median']}s > {args.render_budget}s")
+        if results["api_ready"]["seconds_median"] > args.api_budget:
+            over.append(f"API ready {results['api_ready']['seconds_median']}s > {args.api_budget}s")
+        for o in over:
+            print("BUDGET:", o, file=sys.stderr)
+        if over:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
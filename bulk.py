@@ -0,0 +1,201 @@
+import csv
+import io
+import json
+from datetime import date
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from storage import normalize_genres
+
+# -------------------------
+# Bulk catalog import / export
+# -------------------------
+# Imports read CSV or JSONL one record at a time from a text stream, validate
+# and normalize rows into book records and hand them to Storage.add_books()
+# in chunks, so memory stays bounded by the chunk size rather than the file
+# and ids come from the store's counter. Exports go the other way: the
+# catalog or loan history is written out as a generator of text chunks that
+# callers can stream (HTTP) or write to a file.
+#
+# CSV list fields (genre, keywords, index) are "|"-separated; genre and
+# keywords also accept commas, matching the Add Book form.
+
+FORMATS = ("csv", "jsonl")
+IMPORT_CHUNK = 5000
+EXPORT_CHUNK = 1000
+MAX_ERRORS = 50
+
+BOOK_FIELDS = ["id", "title", "author", "cover_url", "description", "index", "genre", "keywords",
+               "available", "added_on"]
+LOAN_FIELDS = ["user_email", "book_id", "issue_date", "due_date", "returned", "return_date"]
+
+
+def _split(value, allow_commas: bool) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    value = str(value)
+    sep = "|" if "|" in value or not allow_commas else ","
+    return [v.strip() for v in value.split(sep) if v.strip()]
+
+
+def normalize_book(row: Dict[str, Any]) -> Dict[str, Any]:
+    # raises ValueError with a readable message for rejected rows
+    title = str(row.get('title') or "").strip()
+    author = str(row.get('author') or "").strip()
+    if not title:
+        raise ValueError("missing title")
+    if not author:
+        raise ValueError("missing author")
+    added_on = str(row.get('added_on') or "").strip() or str(date.today())
+    try:
+        date.fromisoformat(added_on[:10])
+    except ValueError:
+        raise ValueError(f"bad added_on date: {added_on!r}") from None
+    return {
+        "title": title,
+        "author": author,
+        "cover_url": str(row.get('cover_url') or "").strip(),
+        "description": str(row.get('description') or "").strip(),
+        "index": _split(row.get('index'), allow_commas=False),
+        "genre": normalize_genres(_split(row.get('genre'), allow_commas=True)),
+        "keywords": _split(row.get('keywords'), allow_commas=True),
+        # imported copies start on the shelf; circulation state is not imported
+        "available": True,
+        "added_on": added_on[:10],
+    }
+
+
+class UnreadableInput(Exception):
+    # the stream cannot be read past `line` (bad encoding, broken CSV
+    # quoting); every row before it has been yielded
+    def __init__(self, line: int, error: Exception):
+        super().__init__(f"line {line}: {error}")
+        self.line = line
+        self.error = error
+
+
+def _lines(stream: IO[str], seen: List[int]) -> Iterator[str]:
+    # counts lines as they are handed on and stops at text that is not valid
+    # UTF-8: streams opened with errors="surrogateescape" carry undecodable
+    # bytes through as lone surrogates, which pins the error to its line
+    for line in stream:
+        seen[0] += 1
+        try:
+            line.encode("utf-8")
+        except UnicodeEncodeError:
+            raise UnreadableInput(seen[0], ValueError("not valid UTF-8 text")) from None
+        yield line
+
+
+def iter_records(stream: IO[str], fmt: str) -> Iterator[Tuple[int, Any]]:
+    # (line number, raw row or the exception that made it unparseable)
+    seen = [0]
+    try:
+        if fmt == "csv":
+            reader = csv.DictReader(_lines(stream, seen))
+            try:
+                for row in reader:
+                    yield seen[0], row
+            except csv.Error as e:
+                raise UnreadableInput(seen[0], e) from e
+        elif fmt == "jsonl":
+            for line in _lines(stream, seen):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                    if not isinstance(row, dict):
+                        raise ValueError("expected a JSON object")
+                except ValueError as e:
+                    yield seen[0], e
+                    continue
+                yield seen[0], row
+        else:
+            raise ValueError(f"Unknown format: {fmt}")
+    except UnicodeDecodeError as e:
+        # a strictly decoding stream fails a whole read buffer at once
+        raise UnreadableInput(seen[0] + 1, e) from e
+
+
+def import_books(stream: IO[str], fmt: str, add_books: Callable[[List[Dict[str, Any]]], List[int]],
+                 chunk_size: int = IMPORT_CHUNK,
+                 progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    # "stopped" is {"line", "error"} when the input could not be read to the end
+    summary = {"imported": 0, "rejected": 0, "first_id": None, "last_id": None, "errors": [], "stopped": None}
+    batch: List[Dict[str, Any]] = []
+
+    def flush():
+        if not batch:
+            return
+        ids = add_books(batch)
+        summary["imported"] += len(ids)
+        if ids:
+            summary["first_id"] = summary["first_id"] or ids[0]
+            summary["last_id"] = ids[-1]
+        batch.clear()
+        if progress:
+            progress(summary)
+
+    try:
+        for line, row in iter_records(stream, fmt):
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                batch.append(normalize_book(row))
+            except ValueError as e:
+                summary["rejected"] += 1
+                if len(summary["errors"]) < MAX_ERRORS:
+                    summary["errors"].append({"line": line, "error": str(e)})
+                continue
+            if len(batch) >= chunk_size:
+                flush()
+    except UnreadableInput as e:
+        # earlier chunks are already committed: keep the rows read so far and
+        # report where reading stopped, so the rest can be fixed and re-imported
+        summary["stopped"] = {"line": e.line, "error": str(e.error)}
+    flush()
+    return summary
+
+
+def _csv_value(value) -> Any:
+    if isinstance(value, (list, tuple)):
+        return "|".join(str(v) for v in value)
+    if value is None:
+        return ""
+    return value
+
+
+def export_rows(rows: Iterable[Dict[str, Any]], fmt: str, fields: List[str],
+                chunk_size: int = EXPORT_CHUNK) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(buf, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+    elif fmt != "jsonl":
+        raise ValueError(f"Unknown format: {fmt}")
+    pending = 0
+    for row in rows:
+        if writer is not None:
+            writer.writerow({f: _csv_value(row.get(f)) for f in fields})
+        else:
+            buf.write(json.dumps({f: row.get(f) for f in fields}, ensure_ascii=False) + "\n")
+        pending += 1
+        if pending >= chunk_size:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            pending = 0
+    tail = buf.getvalue()
+    if tail or pending:
+        yield tail
+
+
+def export_books(books: Iterable[Dict[str, Any]], fmt: str) -> Iterator[str]:
+    rows = (dict(b, genre=normalize_genres(b.get('genre'))) for b in books)
+    return export_rows(rows, fmt, BOOK_FIELDS)
+
+
+def export_loans(loans: Iterable[Dict[str, Any]], fmt: str) -> Iterator[str]:
+    return export_rows(loans, fmt, LOAN_FIELDS)
@@ -0,0 +1,116 @@
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# -------------------------
+# Intent matching
+# -------------------------
+# Every trigger phrase of every intent is compiled into one word-level trie
+# (Aho-Corasick over word tokens: phrases can only start at a word, so the
+# automaton restarts at each token instead of following failure links). A
+# message is tokenized once and walked through the trie, so classification
+# costs O(words x longest phrase) whatever the size of the intent table, and
+# triggers only ever match whole words: "hi" no longer fires inside "this" or
+# "history". A trailing "*" turns the last word of a trigger into a prefix
+# ("recommend*" also covers "recommendations"). When several intents match,
+# the one listed first in the table wins, so table order is priority order.
+#
+# Compiled tries are cached by the (name, triggers) signature of the table:
+# Streamlit re-runs app.py on every interaction and rebuilds its handler
+# functions, but the trie is only built once per process.
+
+WORD_RE = re.compile(r"\w+")
+
+
+class Intent:
+    __slots__ = ("name", "triggers", "handler")
+
+    def __init__(self, name: str, triggers: Iterable[str], handler: Callable[..., str]):
+        self.name = name
+        self.triggers = tuple(triggers)
+        self.handler = handler
+
+
+class _Node:
+    __slots__ = ("next", "end", "prefixes", "prefix_lens")
+
+    def __init__(self):
+        self.next: Dict[str, "_Node"] = {}
+        self.end: Optional[int] = None
+        # last-word prefixes ending a trigger here: prefix -> intent index
+        self.prefixes: Dict[str, int] = {}
+        self.prefix_lens: Tuple[int, ...] = ()
+
+
+def _better(current: Optional[int], k: int) -> int:
+    return k if current is None else min(current, k)
+
+
+@lru_cache(maxsize=32)
+def _compile(signature: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> _Node:
+    root = _Node()
+    for k, (_, triggers) in enumerate(signature):
+        for trigger in triggers:
+            prefix = trigger.endswith("*")
+            words = WORD_RE.findall(trigger.rstrip("*").lower())
+            if not words:
+                continue
+            node = root
+            for w in words[:-1]:
+                node = node.next.setdefault(w, _Node())
+            if prefix:
+                node.prefixes[words[-1]] = _better(node.prefixes.get(words[-1]), k)
+                node.prefix_lens = tuple(sorted({len(p) for p in node.prefixes}))
+            else:
+                node = node.next.setdefault(words[-1], _Node())
+                node.end = _better(node.end, k)
+    return root
+
+
+class IntentMatcher:
+    def __init__(self, intents: Iterable[Intent]):
+        self.intents: List[Intent] = list(intents)
+        self.root = _compile(tuple((i.name, i.triggers) for i in self.intents))
+
+    def match(self, message: str) -> Optional[Tuple[Intent, str]]:
+        # (intent, the message's words minus the trigger that fired), or None
+        words = WORD_RE.findall(message.lower())
+        best, span = len(self.intents), None
+        for i in range(len(words)):
+            node, j = self.root, i
+            while node is not None and j < len(words):
+                w = words[j]
+                for n in node.prefix_lens:
+                    k = node.prefixes.get(w[:n])
+                    if k is not None and k < best:
+                        best, span = k, (i, j + 1)
+                node = node.next.get(w)
+                if node is not None and node.end is not None and node.end < best:
+                    best, span = node.end, (i, j + 1)
+                j += 1
+            if best == 0:
+                break
+        if span is None:
+            return None
+        return self.intents[best], " ".join(words[:span[0]] + words[span[1]:])
+
+
+# -------------------------
+# Cached answers
+# -------------------------
+# Answers derived from the catalog (e.g. the genre list) are kept until the
+# version they were computed at moves, like the other process-wide models.
+_answers: Dict[str, Tuple[Any, Any]] = {}
+_answers_lock = threading.Lock()
+
+
+def cached_answer(name: str, version, compute: Callable[[], Any]) -> Any:
+    with _answers_lock:
+        hit = _answers.get(name)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+    value = compute()
+    with _answers_lock:
+        _answers[name] = (version, value)
+    return value
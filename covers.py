@@ -0,0 +1,316 @@
+import functools
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import metrics
+
+# -------------------------
+# Cover thumbnail cache
+# -------------------------
+# Each cover URL is downloaded once, resized to every width the UI shows
+# (cards and overviews) and kept on disk as JPEG thumbnails named after a
+# hash of the URL. The directory is bounded by size: entries are kept in
+# least-recently-used order (seeded from file mtimes on startup) and the
+# oldest are deleted once the total goes over max_bytes. URLs that fail to
+# download or decode are remembered for FAILURE_TTL seconds so a broken link
+# costs one timeout, not one per rerun; callers show a placeholder instead.
+# Pages ask with block=False: a miss is queued for the background pool and the
+# placeholder shows until a later rerun finds the thumbnail on disk.
+#
+# Cover URLs come from librarians and imports, so downloads only go to public
+# addresses: http(s) only, and every connection (redirects included) checks
+# the address it actually reached before sending the request, which also
+# covers DNS names that resolve to internal hosts. Downloads do not go through
+# environment proxies, whose address would be the one checked.
+
+CARD_WIDTH = 110
+OVERVIEW_WIDTH = 150
+SIZES = (CARD_WIDTH, OVERVIEW_WIDTH)
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+FETCH_TIMEOUT = 5
+MAX_DOWNLOAD_BYTES = 10 * 1024 * 1024
+FAILURE_TTL = 600
+PREFETCH_WORKERS = 8
+JPEG_QUALITY = 85
+USER_AGENT = "LibraryManagement-CoverCache/1.0"
+
+
+def _check_peer(sock, allow_private: bool):
+    addr = ipaddress.ip_address(sock.getpeername()[0].split("%")[0])
+    if addr.version == 6 and addr.ipv4_mapped:
+        addr = addr.ipv4_mapped
+    if not allow_private and (not addr.is_global or addr.is_multicast):
+        raise ValueError(f"Cover URL points at a non-public address ({addr})")
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, allow_private: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.allow_private = allow_private
+
+    def connect(self):
+        super().connect()
+        _check_peer(self.sock, self.allow_private)
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection, _PublicHTTPConnection):
+    # HTTPSConnection.connect() opens the socket through
+    # _PublicHTTPConnection.connect(), so the check runs before the handshake
+    def __init__(self, *args, allow_private: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.allow_private = allow_private
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def __init__(self, allow_private: bool):
+        super().__init__()
+        self.allow_private = allow_private
+
+    def http_open(self, req):
+        return self.do_open(functools.partial(_PublicHTTPConnection, allow_private=self.allow_private), req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self, allow_private: bool):
+        super().__init__()
+        self.allow_private = allow_private
+
+    def https_open(self, req):
+        return self.do_open(functools.partial(_PublicHTTPSConnection, allow_private=self.allow_private), req,
+                            context=self._context)
+
+
+class _RedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if not newurl.lower().startswith(("http://", "https://")):
+            raise ValueError(f"Cover URL redirects to an unsupported URL: {newurl!r}")
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+@functools.lru_cache(maxsize=2)
+def _opener(allow_private: bool) -> urllib.request.OpenerDirector:
+    return urllib.request.build_opener(urllib.request.ProxyHandler({}), _PublicHTTPHandler(allow_private),
+                                       _PublicHTTPSHandler(allow_private), _RedirectHandler)
+
+
+def fetch_url(url: str, allow_private: bool = False) -> bytes:
+    # allow_private is for tests against a local stand-in server
+    if not url.lower().startswith(("http://", "https://")):
+        raise ValueError(f"Unsupported cover URL: {url!r}")
+    req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+    with _opener(allow_private).open(req, timeout=FETCH_TIMEOUT) as resp:
+        data = resp.read(MAX_DOWNLOAD_BYTES + 1)
+    if len(data) > MAX_DOWNLOAD_BYTES:
+        raise ValueError("Cover image too large")
+    return data
+
+
+def thumbnails(data: bytes, sizes: Iterable[int]) -> Dict[int, bytes]:
+    # JPEG bytes per width; never upscales, transparent images go on white.
+    # Pillow is imported here, on the first cover miss, not at startup.
+    from PIL import Image
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        flat = Image.new("RGB", img.size, (255, 255, 255))
+        flat.paste(img, mask=img.getchannel("A"))
+        img = flat
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+    out = {}
+    for width in sizes:
+        thumb = img
+        if img.width > width:
+            thumb = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+        buf = io.BytesIO()
+        thumb.save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        out[width] = buf.getvalue()
+    return out
+
+
+class CoverCache:
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES, sizes: Tuple[int, ...] = SIZES,
+                 fetch: Callable[[str], bytes] = fetch_url):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sizes = tuple(sorted(sizes))
+        self.fetch = fetch
+        self.lock = threading.Lock()
+        # file name -> size in bytes, least recently used first
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.total = 0
+        self.failures: Dict[str, float] = {}
+        self.inflight: Dict[str, threading.Lock] = {}
+        # URLs handed to the background pool and not fetched yet
+        self.queued: set = set()
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                # left behind by a crash mid-write
+                os.remove(path)
+            elif name.endswith(".jpg"):
+                st = os.stat(path)
+                found.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.total += size
+        self._evict()
+
+    def width_for(self, width: int) -> int:
+        # the smallest stored size that is at least `width`
+        for size in self.sizes:
+            if size >= width:
+                return size
+        return self.sizes[-1]
+
+    def _name(self, url: str, width: int) -> str:
+        return f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}-{width}.jpg"
+
+    def _hit(self, name: str) -> Optional[str]:
+        # caller holds self.lock
+        if name not in self.entries:
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # removed behind our back; fetch it again
+            self.total -= self.entries.pop(name)
+            return None
+        self.entries.move_to_end(name)
+        return path
+
+    def get(self, url: str, width: int = CARD_WIDTH, block: bool = True) -> Optional[str]:
+        # local path of the thumbnail, or None when the cover is unavailable;
+        # with block=False a miss is fetched in the background and None
+        # returned straight away
+        if not url:
+            return None
+        name = self._name(url, self.width_for(width))
+        with self.lock:
+            path = self._hit(name)
+            if path:
+                metrics.inc("library_cover_cache_hits_total")
+                return path
+            failed_at = self.failures.get(url)
+            if failed_at is not None and time.time() - failed_at < FAILURE_TTL:
+                return None
+            if not block:
+                self._queue(url)
+                return None
+            url_lock = self.inflight.setdefault(url, threading.Lock())
+        # one download per URL, however many threads ask for it at once
+        with url_lock:
+            with self.lock:
+                path = self._hit(name)
+                if path:
+                    metrics.inc("library_cover_cache_hits_total")
+                    return path
+            metrics.inc("library_cover_cache_misses_total")
+            try:
+                with metrics.timer("library_cover_fetch_seconds"):
+                    self._store(url, thumbnails(self.fetch(url), self.sizes))
+            except Exception:
+                metrics.inc("library_cover_fetch_failures_total")
+                with self.lock:
+                    self.failures[url] = time.time()
+                return None
+            finally:
+                with self.lock:
+                    self.inflight.pop(url, None)
+        with self.lock:
+            self.failures.pop(url, None)
+            return self._hit(name)
+
+    def _store(self, url: str, thumbs: Dict[int, bytes]):
+        for width, data in thumbs.items():
+            name = self._name(url, width)
+            path = os.path.join(self.directory, name)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            with self.lock:
+                self.total += len(data) - self.entries.pop(name, 0)
+                self.entries[name] = len(data)
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        # caller holds self.lock (or is the constructor)
+        while self.total > self.max_bytes and self.entries:
+            name, size = self.entries.popitem(last=False)
+            self.total -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            metrics.inc("library_cover_cache_evictions_total")
+        metrics.set_gauge("library_cover_cache_bytes", self.total)
+
+    def _queue(self, url: str):
+        # caller holds self.lock
+        if url in self.queued:
+            return
+        self.queued.add(url)
+        _executor().submit(self._fetch_queued, url)
+
+    def _fetch_queued(self, url: str):
+        try:
+            self.get(url)
+        finally:
+            with self.lock:
+                self.queued.discard(url)
+
+    def prefetch(self, urls: Iterable[str]):
+        # start fetching a page of covers in parallel; does not wait for them
+        for url in dict.fromkeys(u for u in urls if u):
+            self.get(url, block=False)
+
+
+# -------------------------
+# Process-wide cache
+# -------------------------
+_caches: Dict[Tuple[str, int], CoverCache] = {}
+_pool: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="cover-fetch")
+        return _pool
+
+
+def cover_cache(directory: str, max_bytes: int = DEFAULT_MAX_BYTES) -> CoverCache:
+    key = (os.path.abspath(directory), max_bytes)
+    with _lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = CoverCache(directory, max_bytes)
+        return cache
+
+
+metrics.describe("library_cover_cache_hits_total", "counter", "Cover thumbnails served from the disk cache")
+metrics.describe("library_cover_cache_misses_total", "counter", "Cover images downloaded and resized")
+metrics.describe("library_cover_cache_evictions_total", "counter", "Cover thumbnails evicted (LRU)")
+metrics.describe("library_cover_fetch_failures_total", "counter", "Cover downloads or decodes that failed")
+metrics.describe("library_cover_fetch_seconds", "histogram", "Cover download + resize time")
+metrics.describe("library_cover_cache_bytes", "gauge", "Bytes held by the cover cache")
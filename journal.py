@@ -0,0 +1,364 @@
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+from locks import DEFAULT_TIMEOUT, ConflictError, FileLock
+
+# -------------------------
+# Journaled storage for books + loans
+# -------------------------
+# Every issue/return is appended to the active log segment as one JSON line and
+# fsync'd before the call returns. Once `snapshot_every` records have piled up
+# a background thread writes a compacted snapshot (books + loans + the last seq
+# it covers) and drops the segments it made redundant. On startup the latest
+# snapshot is loaded and only the log tail after its seq is replayed; a torn
+# last line left by a crash mid-append is truncated away.
+#
+# Several processes (API workers, Streamlit) can share one journal. Writers
+# serialize their read-validate-append sequence with `journal.lock`, a
+# FileLock on WRITER_LOCK_NAME; taking it first replays whatever other
+# processes appended since this one last looked, so validation always sees
+# the latest state. Reads catch up the same way through refresh(), which is a
+# stat when nothing changed. Snapshots are written by one process at a time
+# (COMPACT_LOCK_NAME). The cost of sharing is one global writer lock: every
+# issue/return in every process queues on it for its fsync'd append.
+
+SNAPSHOT_NAME = "library.snapshot.json"
+SEGMENT_PREFIX = "library.journal."
+WRITER_LOCK_NAME = "writer.lock"
+COMPACT_LOCK_NAME = "compact.lock"
+DEFAULT_SNAPSHOT_EVERY = 500
+
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path: str, payload: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(os.path.dirname(os.path.abspath(path)))
+
+
+class _LogGap(Exception):
+    # the log no longer holds the records right after this process's seq
+    pass
+
+
+class _WriterLock(FileLock):
+    # the outermost acquire catches the journal up with other processes
+    def __init__(self, path: str, on_acquire: Callable[[], None]):
+        super().__init__(path)
+        self._on_acquire = on_acquire
+
+    def acquire(self, timeout: float = DEFAULT_TIMEOUT):
+        super().acquire(timeout)
+        if self._depth == 1:
+            try:
+                self._on_acquire()
+            except BaseException:
+                self.release()
+                raise
+
+
+class Journal:
+    def __init__(self, directory: str, seed: Callable[[], Dict[str, List[Dict[str, Any]]]],
+                 snapshot_every: int = DEFAULT_SNAPSHOT_EVERY):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self._seed = seed
+        os.makedirs(directory, exist_ok=True)
+        self.lock = _WriterLock(os.path.join(directory, WRITER_LOCK_NAME), lambda: self._catch_up(locked=True))
+        self._compact_lock = FileLock(os.path.join(directory, COMPACT_LOCK_NAME))
+        # guards the in-memory state against a reader's refresh() in another
+        # thread; taken inside `lock`, never the other way round
+        self._state_lock = threading.RLock()
+        self.seq = 0
+        # bumped whenever the catalog itself (not just availability) changes
+        self.catalog_version = 0
+        self.max_id = 0
+        self.books: List[Dict[str, Any]] = []
+        self.issued: List[Dict[str, Any]] = []
+        self._by_id: Dict[int, Dict[str, Any]] = {}
+        self._active: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self._history: Dict[str, List[Dict[str, Any]]] = {}
+        # the segment appended to, and how far into it this process has read
+        self._fh = None
+        self._tail: Optional[str] = None
+        self._offset = 0
+        self._since_snapshot = 0
+        self._compacting = False
+        with self.lock:
+            pass  # loads the snapshot (seeding it on first use) and replays the log
+
+    # ---------- paths ----------
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.directory, SNAPSHOT_NAME)
+
+    def _segment_path(self, first_seq: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{first_seq:012d}")
+
+    def _segments(self) -> List[str]:
+        names = sorted(n for n in os.listdir(self.directory)
+                       if n.startswith(SEGMENT_PREFIX) and n[len(SEGMENT_PREFIX):].isdigit())
+        return [os.path.join(self.directory, n) for n in names]
+
+    # ---------- state ----------
+    def _reindex(self):
+        self._by_id = {b['id']: b for b in self.books}
+        self.max_id = max(self._by_id, default=0)
+        self._active = {}
+        self._history = {}
+        for r in self.issued:
+            self._history.setdefault(r['user_email'].lower(), []).append(r)
+            if not r.get('returned', False):
+                self._active.setdefault(r['user_email'].lower(), {})[r['book_id']] = r
+
+    def _apply(self, rec: Dict[str, Any]):
+        op = rec['op']
+        if op == "issue":
+            email = rec['user_email']
+            book = self._by_id.get(rec['book_id'])
+            if book is not None:
+                book['available'] = False
+                book['issued_to'] = email
+            loan = {
+                "user_email": email,
+                "book_id": rec['book_id'],
+                "issue_date": rec['issue_date'],
+                "due_date": rec['due_date'],
+                "returned": False,
+                "return_date": None
+            }
+            self.issued.append(loan)
+            self._active.setdefault(email, {})[rec['book_id']] = loan
+            self._history.setdefault(email.lower(), []).append(loan)
+        elif op == "return":
+            loans = self._active.get(rec['user_email'], {})
+            loan = loans.pop(rec['book_id'], None)
+            if loan is not None:
+                loan['returned'] = True
+                loan['return_date'] = rec['return_date']
+            book = self._by_id.get(rec['book_id'])
+            if book is not None:
+                book['available'] = True
+                book.pop('issued_to', None)
+        elif op == "batch":
+            for sub in rec['ops']:
+                self._apply(sub)
+        elif op == "add_books":
+            for b in rec['books']:
+                self.books.append(b)
+                self._by_id[b['id']] = b
+                self.max_id = max(self.max_id, b['id'])
+            self.catalog_version += 1
+        elif op == "books":
+            self.books = rec['books']
+            self.catalog_version += 1
+            self._reindex()
+        elif op == "issued":
+            self.issued = rec['issued']
+            self._reindex()
+        else:
+            raise ValueError(f"Unknown journal op: {op}")
+
+    def _load_snapshot(self, locked: bool):
+        if os.path.exists(self.snapshot_path) or not locked:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+            self.seq = snap['seq']
+            self.books = snap['books']
+            self.issued = snap['issued']
+        else:
+            data = self._seed()
+            self.books = data.get('books', [])
+            self.issued = data.get('issued', [])
+            write_atomic(self.snapshot_path, self._snapshot_payload())
+        self._reindex()
+        self.catalog_version += 1
+        self._since_snapshot = 0
+        # read on from the segment holding seq + 1 (records before it are skipped)
+        covering = [p for p in self._segments() if self._first_seq(p) <= self.seq + 1]
+        self._tail = covering[-1] if covering else self._segment_path(self.seq + 1)
+        self._offset = 0
+
+    def _catch_up(self, locked: bool):
+        # replays what was appended since this process last read the log.
+        # `locked`: the writer lock is held, so a partial last record is a
+        # crashed append and is cut off rather than waited for, and the tail
+        # can be opened for appending
+        with self._state_lock:
+            if self._tail is None:
+                self._load_snapshot(locked)
+            while True:
+                try:
+                    segments = [p for p in self._segments() if p >= self._tail]
+                    for path in segments:
+                        if path != self._tail:
+                            if self._first_seq(path) > self.seq + 1:
+                                raise _LogGap(path)
+                            self._tail, self._offset = path, 0
+                        self._offset = self._replay(path, self._offset, path == segments[-1], locked)
+                except (FileNotFoundError, _LogGap):
+                    # another process snapshotted and dropped records we never read
+                    self._load_snapshot(locked)
+                    continue
+                break
+            if locked:
+                self._open_tail()
+
+    def _open_tail(self):
+        # writer lock held; only writers ever create segment files
+        if self._fh is None or self._fh.name != self._tail:
+            if self._fh is not None:
+                self._fh.close()
+            self._fh = open(self._tail, "ab")
+
+    def _first_seq(self, path: str) -> int:
+        return int(path[len(os.path.join(self.directory, SEGMENT_PREFIX)):])
+
+    def _replay(self, path: str, offset: int, is_last: bool, locked: bool) -> int:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for raw in f:
+                try:
+                    if not raw.endswith(b"\n"):
+                        raise ValueError("torn record")
+                    rec = json.loads(raw)
+                except ValueError:
+                    if not is_last:
+                        raise
+                    if not locked:
+                        # mid-append in another process (or a crash the
+                        # next writer will clean up)
+                        return offset
+                    # crash mid-append: drop the partial record
+                    with open(path, "r+b") as w:
+                        w.truncate(offset)
+                        os.fsync(w.fileno())
+                    return offset
+                if rec['seq'] > self.seq + 1:
+                    raise _LogGap(path)
+                offset += len(raw)
+                if rec['seq'] <= self.seq:
+                    continue
+                self._apply(rec)
+                self.seq = rec['seq']
+                self._since_snapshot += 1
+        return offset
+
+    def refresh(self):
+        # picks up records other processes appended; a stat or two when
+        # nothing changed
+        tail = self._tail
+        if self._fh is None:
+            return
+        try:
+            grown = os.stat(tail).st_size > self._offset
+        except FileNotFoundError:
+            grown = True
+        following = self._segment_path(self.seq + 1)
+        if grown or (following != tail and os.path.exists(following)):
+            self._catch_up(locked=False)
+
+    def _snapshot_payload(self) -> str:
+        return json.dumps({"seq": self.seq, "books": self.books, "issued": self.issued},
+                          ensure_ascii=False, separators=(",", ":"))
+
+    # ---------- reads ----------
+    def get_book(self, book_id: int) -> Optional[Dict[str, Any]]:
+        return self._by_id.get(book_id)
+
+    def active_for_user(self, user_email: str) -> List[Dict[str, Any]]:
+        return list(self._active.get(user_email.lower(), {}).values())
+
+    def active_loans(self) -> List[Dict[str, Any]]:
+        return [r for loans in self._active.values() for r in loans.values()]
+
+    def loans_for_user(self, user_email: str) -> List[Dict[str, Any]]:
+        return list(self._history.get(user_email.lower(), []))
+
+    # ---------- writes ----------
+    def append(self, record: Dict[str, Any]):
+        with self.lock, self._state_lock:
+            self._open_tail()
+            rec = dict(record, seq=self.seq + 1)
+            line = json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n"
+            metrics.inc("library_journal_appends_total", op=rec['op'])
+            with metrics.timer("library_journal_append_seconds"):
+                self._fh.write(line.encode("utf-8"))
+                self._fh.flush()
+                os.fsync(self._fh.fileno())
+            self._offset += len(line.encode("utf-8"))
+            self.seq = rec['seq']
+            self._apply(rec)
+            self._since_snapshot += 1
+            # whole-document replacements make the log expensive to replay,
+            # so compact right after them
+            due = self._since_snapshot >= self.snapshot_every or rec['op'] in ("books", "issued")
+            if due and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact(timeout=0)
+        except ConflictError:
+            pass  # another process is writing a snapshot right now
+        finally:
+            self._compacting = False
+
+    def compact(self, timeout: float = DEFAULT_TIMEOUT):
+        # one snapshot writer at a time, so a slower one never replaces a
+        # newer snapshot after the segments it covered are gone
+        with self._compact_lock.hold(timeout):
+            with self.lock, self._state_lock:
+                payload = self._snapshot_payload()
+                covered = self.seq
+                self._tail, self._offset = self._segment_path(covered + 1), 0
+                self._open_tail()
+                self._since_snapshot = 0
+            write_atomic(self.snapshot_path, payload)
+            for path in self._segments():
+                if self._first_seq(path) <= covered:
+                    os.remove(path)
+
+    def close(self):
+        with self._state_lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+
+# -------------------------
+# Process-wide instance
+# -------------------------
+_instances: Dict[str, Journal] = {}
+_instances_lock = threading.Lock()
+
+
+def get_journal(directory: str, seed: Callable[[], Dict[str, List[Dict[str, Any]]]],
+                snapshot_every: int = DEFAULT_SNAPSHOT_EVERY) -> Journal:
+    key = os.path.abspath(directory)
+    with _instances_lock:
+        j = _instances.get(key)
+        if j is None:
+            j = Journal(directory, seed, snapshot_every)
+            _instances[key] = j
+        return j
@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: thread-level locking only
+    fcntl = None
+
+# -------------------------
+# Cross-thread / cross-process locks
+# -------------------------
+# FileLock pairs a thread lock with an flock() on a lock file, so it excludes
+# other threads of this process and other processes (Streamlit + API workers)
+# alike. It is re-entrant within a thread.
+
+DEFAULT_TIMEOUT = 10.0
+POLL_INTERVAL = 0.005
+
+
+class ConflictError(Exception):
+    # raised when a lock could not be taken in time; the operation did not
+    # happen and can be retried
+    pass
+
+
+class FileLock:
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._owner = None
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self, timeout: float = DEFAULT_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        if not self._thread_lock.acquire(timeout=max(0.0, timeout)):
+            raise ConflictError(f"Timed out waiting for {self.path}")
+        if self._depth:
+            self._depth += 1
+            return
+        try:
+            if fcntl is not None:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                while True:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() >= deadline:
+                            os.close(fd)
+                            raise ConflictError(f"Timed out waiting for {self.path}")
+                        time.sleep(POLL_INTERVAL)
+                self._fd = fd
+            self._depth = 1
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+    @contextmanager
+    def hold(self, timeout: float = DEFAULT_TIMEOUT):
+        self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
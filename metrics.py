@@ -0,0 +1,319 @@
+import bisect
+import cProfile
+import contextvars
+import os
+import pstats
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# -------------------------
+# Instrumentation
+# -------------------------
+# A small in-process registry of counters, gauges and histograms rendered in
+# the Prometheus text format (served by the API at /metrics). Hot paths are
+# wrapped with @timed(...) or `with timer(...)`. With LIBRARY_METRICS=0 the
+# decorators hand back the undecorated function and timer() yields a shared
+# no-op, so a disabled build pays one flag check per call site at most.
+#
+# scope() tallies the counters incremented inside it (e.g. JSON loads during
+# one Streamlit render or one API request) so per-render/per-request call
+# counts can be observed as histograms.
+#
+# Streamlit runs in its own process; set LIBRARY_METRICS_TEXTFILE to have it
+# write its metrics after every render for a textfile collector to pick up.
+
+ENABLED = os.environ.get("LIBRARY_METRICS", "1") != "0"
+TEXTFILE = os.environ.get("LIBRARY_METRICS_TEXTFILE")
+# per-request cProfile dumps (API): requests with `X-Profile: 1` or
+# `?profile=1` are profiled into this directory when it is set
+PROFILE_DIR = os.environ.get("LIBRARY_PROFILE_DIR")
+
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_lock = threading.Lock()
+_types: Dict[str, Tuple[str, str]] = {}
+_counters: Dict[Tuple[str, tuple], float] = {}
+_gauges: Dict[Tuple[str, tuple], float] = {}
+_histograms: Dict[Tuple[str, tuple], "_Histogram"] = {}
+# context-local so API handlers running in the threadpool count towards the
+# request that started them
+_scopes: contextvars.ContextVar = contextvars.ContextVar("library_metric_scopes", default=())
+_render_labels: contextvars.ContextVar = contextvars.ContextVar("library_render_labels", default=None)
+
+# counters that make up "storage calls" in per-render/per-request histograms
+STORAGE_COUNTERS = {
+    "library_json_loads_total": "json_load",
+    "library_json_saves_total": "json_save",
+    "library_cache_misses_total": "cache_miss",
+    "library_journal_appends_total": "journal_append",
+    "library_sqlite_tx_total": "sqlite_tx",
+}
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def describe(name: str, kind: str, help_text: str):
+    _types[name] = (kind, help_text)
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, tuple]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    for counts in _scopes.get():
+        counts[name] = counts.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    if not ENABLED:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = _Histogram(buckets)
+        h.observe(value)
+
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+def timer(name: str, **labels):
+    return _Timer(name, labels) if ENABLED else _NOOP
+
+
+def timed(name: str, **labels):
+    def decorate(fn: Callable):
+        if not ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started, **labels)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def scope():
+    counts: Dict[str, float] = {}
+    token = _scopes.set(_scopes.get() + (counts,))
+    try:
+        yield counts
+    finally:
+        _scopes.reset(token)
+
+
+def observe_storage_calls(counts: Dict[str, float], **labels):
+    for name, kind in STORAGE_COUNTERS.items():
+        observe("library_render_storage_calls", counts.get(name, 0), buckets=COUNT_BUCKETS, kind=kind, **labels)
+
+
+@contextmanager
+def render_scope():
+    # one Streamlit script run; the app names the page via label_render()
+    if not ENABLED:
+        yield
+        return
+    labels = {"page": "login"}
+    token = _render_labels.set(labels)
+    started = time.perf_counter()
+    try:
+        with scope() as counts:
+            yield
+    finally:
+        _render_labels.reset(token)
+        observe("library_page_render_seconds", time.perf_counter() - started, **labels)
+        observe_storage_calls(counts, **labels)
+        if TEXTFILE:
+            write_textfile(TEXTFILE)
+
+
+def label_render(**labels):
+    current = _render_labels.get()
+    if current is not None:
+        current.update(labels)
+
+
+# -------------------------
+# Exposition
+# -------------------------
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(pairs) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render() -> str:
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted((k, (h.buckets, list(h.counts), h.sum, h.count)) for k, h in _histograms.items())
+    lines: List[str] = []
+    seen = set()
+
+    def header(name, kind):
+        if name in seen:
+            return
+        seen.add(name)
+        help_text = _types.get(name, (kind, ""))[1]
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for (name, pairs), value in counters:
+        header(name, "counter")
+        lines.append(f"{name}{_labels(pairs)} {_fmt(value)}")
+    for (name, pairs), value in gauges:
+        header(name, "gauge")
+        lines.append(f"{name}{_labels(pairs)} {_fmt(value)}")
+    for (name, pairs), (buckets, counts, total, count) in histograms:
+        header(name, "histogram")
+        cumulative = 0
+        for bound, c in zip(buckets + (float("inf"),), counts):
+            cumulative += c
+            lines.append(f"{name}_bucket{_labels(pairs, ('le', _fmt(bound)))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(pairs)} {_fmt(total)}")
+        lines.append(f"{name}_count{_labels(pairs)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+# -------------------------
+# Per-request profiling
+# -------------------------
+_profile: contextvars.ContextVar = contextvars.ContextVar("library_profile", default=None)
+
+
+def start_profile() -> List[cProfile.Profile]:
+    # the request's profiles are collected here; worker-thread calls made
+    # through profile_call() while it is set add theirs
+    profiles: List[cProfile.Profile] = []
+    _profile.set(profiles)
+    return profiles
+
+
+def profile_call(fn: Callable, *args, **kwargs):
+    profiles = _profile.get()
+    if profiles is None:
+        return fn(*args, **kwargs)
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(fn, *args, **kwargs)
+    finally:
+        profiles.append(prof)
+
+
+def dump_profile(profiles: List[cProfile.Profile], label: str) -> Optional[str]:
+    if not profiles or not PROFILE_DIR:
+        return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stats = pstats.Stats(profiles[0])
+    for p in profiles[1:]:
+        stats.add(p)
+    safe = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_") or "request"
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{safe}.prof")
+    stats.dump_stats(path)
+    return path
+
+
+describe("library_json_loads_total", "counter", "JSON documents parsed from disk")
+describe("library_json_saves_total", "counter", "JSON documents written to disk")
+describe("library_json_load_seconds", "histogram", "Time spent parsing a JSON data file")
+describe("library_json_save_seconds", "histogram", "Time spent writing a JSON data file")
+describe("library_file_bytes", "gauge", "Size of a data file at its last load/save")
+describe("library_cache_hits_total", "counter", "In-process data cache hits")
+describe("library_cache_misses_total", "counter", "In-process data cache misses (file re-read)")
+describe("library_journal_appends_total", "counter", "Records appended to the journal")
+describe("library_journal_append_seconds", "histogram", "Journal append incl. fsync")
+describe("library_sqlite_tx_total", "counter", "SQLite write transactions")
+describe("library_sqlite_tx_seconds", "histogram", "SQLite write transaction time")
+describe("library_op_seconds", "histogram", "Latency of library operations")
+describe("library_page_render_seconds", "histogram", "Streamlit page render time")
+describe("library_render_storage_calls", "histogram", "Storage calls made during one page render or API request")
+describe("library_http_request_seconds", "histogram", "API request latency")
+describe("library_http_requests_total", "counter", "API requests by route and status")
+describe("library_chatbot_intents_total", "counter", "Chatbot messages by matched intent")
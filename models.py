@@ -0,0 +1,144 @@
+import sys
+import threading
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from storage import normalize_genres
+
+# -------------------------
+# Typed records
+# -------------------------
+# Storage hands out plain dicts (that is what gets persisted and mutated).
+# Book is the read-side form of a catalog record, built once per catalog
+# version: genre is always a tuple of interned strings, the fields the
+# filters compare against are lowercased up front and added_on is a `date`,
+# so hot loops neither re-normalize nor re-parse per access. Repeated strings
+# (genres, authors) are interned so a large catalog shares one copy of each.
+# to_dict() gives back the storage/API shape; fields a class does not know
+# are carried through in `extra`.
+
+_intern = sys.intern
+
+
+def _date(value) -> Optional[date]:
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10]) if value else None
+    except ValueError:
+        return None
+
+
+def _tuple(value) -> Tuple[str, ...]:
+    if isinstance(value, str):
+        value = [value]
+    return tuple(str(v) for v in value or ())
+
+
+class Book:
+    __slots__ = ("id", "title", "author", "cover_url", "description", "index", "genres", "keywords",
+                 "available", "added_on", "issued_to", "title_l", "author_l", "genres_l", "extra")
+
+    FIELDS = ("id", "title", "author", "cover_url", "description", "index", "genre", "keywords",
+              "available", "added_on", "issued_to")
+
+    def __init__(self, record: Dict[str, Any]):
+        self.id = record['id']
+        self.title = record.get('title', '')
+        self.author = _intern(record.get('author', ''))
+        self.cover_url = record.get('cover_url', '')
+        self.description = record.get('description')
+        self.index = _tuple(record.get('index')) if 'index' in record else None
+        self.genres = tuple(_intern(g) for g in normalize_genres(record.get('genre')))
+        self.keywords = _tuple(record.get('keywords'))
+        self.available = record.get('available', True)
+        self.added_on = _date(record.get('added_on'))
+        self.issued_to = record.get('issued_to')
+        self.title_l = self.title.lower()
+        self.author_l = _intern(self.author.lower())
+        self.genres_l = tuple(_intern(g.lower()) for g in self.genres)
+        extra = {k: v for k, v in record.items() if k not in self.FIELDS}
+        if record.get('added_on') and self.added_on is None:
+            # keep an unparseable date as it was written
+            extra['added_on'] = record['added_on']
+        self.extra = extra or None
+
+    def matches(self, genre_l: Optional[str] = None, author_l: Optional[str] = None,
+                available: Optional[bool] = None) -> bool:
+        # filter arguments are expected lowercased already
+        return ((available is None or self.available == available)
+                and (author_l is None or author_l in self.author_l)
+                and (genre_l is None or genre_l in self.genres_l))
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = {
+            "id": self.id,
+            "title": self.title,
+            "author": self.author,
+            "cover_url": self.cover_url,
+            "genre": list(self.genres),
+            "keywords": list(self.keywords),
+            "available": self.available,
+        }
+        if self.added_on is not None:
+            d['added_on'] = str(self.added_on)
+        if self.description is not None:
+            d['description'] = self.description
+        if self.index is not None:
+            d['index'] = list(self.index)
+        if self.issued_to is not None:
+            d['issued_to'] = self.issued_to
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+
+def books_from(records: List[Dict[str, Any]]) -> List[Book]:
+    return [Book(r) for r in records]
+
+
+# -------------------------
+# Process-wide catalog
+# -------------------------
+_catalog: List[Book] = []
+_genres: Dict[int, Tuple[str, ...]] = {}
+_catalog_version = None
+_books_version = None
+_catalog_lock = threading.Lock()
+
+
+def catalog(load: Callable[[], List[Dict[str, Any]]], version, books_version) -> List[Book]:
+    # `version` is the storage backend's catalog version; the models are
+    # rebuilt from the dicts only when it moves. Issue/return do not move it,
+    # so when only `books_version` moved the available/issued_to flags are
+    # copied onto the existing models instead
+    global _books_version
+    with _catalog_lock:
+        if version != _catalog_version:
+            _rebuild(load, version)
+        elif books_version != _books_version:
+            by_id = {b['id']: b for b in load()}
+            for m in _catalog:
+                b = by_id.get(m.id)
+                if b is not None:
+                    m.available = b.get('available', True)
+                    m.issued_to = b.get('issued_to')
+        _books_version = books_version
+        return _catalog
+
+
+def _rebuild(load: Callable[[], List[Dict[str, Any]]], version):
+    # caller holds _catalog_lock
+    global _catalog, _genres, _catalog_version
+    _catalog = books_from(load())
+    _genres = {b.id: b.genres for b in _catalog}
+    _catalog_version = version
+
+
+def catalog_genres(load: Callable[[], List[Dict[str, Any]]], version) -> Dict[int, Tuple[str, ...]]:
+    # book id -> normalized genres of the catalog above; issue/return cannot
+    # change them, so only the catalog version is checked. Treat as read-only
+    with _catalog_lock:
+        if version != _catalog_version:
+            _rebuild(load, version)
+        return _genres
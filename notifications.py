@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+import overdue
+from locks import FileLock
+from storage import LOCK_DIR_NAME, cached_load, load_json, remember, save_json
+
+# -------------------------
+# Notification feeds
+# -------------------------
+# Due-soon and overdue notes for every user are computed by a background job
+# and materialized into one JSON document, {"meta": ..., "feeds": {email:
+# [note, ...]}}, so the sidebar and the API read a user's feed with one dict
+# lookup (the document is cached per process and re-read only when another
+# process rewrote it). The job runs on a schedule in a scheduler thread (or
+# once from the CLI); after an issue/return only that user's feed is
+# recomputed, because a loan change cannot affect anyone else's notes. Day
+# rollovers and writes that bypassed the app (imports, save_issued) are picked
+# up by the next scheduled run, or earlier when a reader notices the stored
+# day or loans version is stale and pokes the scheduler.
+
+DEFAULT_INTERVAL = 300
+DEFAULT_WINDOW_DAYS = 3
+
+
+def build_feeds(loans: List[Dict[str, Any]], title_of: Callable[[int], Optional[str]], today: date,
+                fine_per_day: int, window_days: int = DEFAULT_WINDOW_DAYS) -> Dict[str, List[Dict[str, Any]]]:
+    feeds: Dict[str, List[Dict[str, Any]]] = {}
+    if not loans:
+        return feeds
+    days_left = (overdue.due_days(loans) - overdue.day_number(today)).tolist()
+    fines = overdue.fines_for(loans, today, fine_per_day).tolist()
+    for rec, left, fine in sorted(zip(loans, days_left, fines), key=lambda x: x[1]):
+        # loans due today have neither days left nor a fine yet
+        if left > window_days or left == 0:
+            continue
+        title = title_of(rec['book_id']) or f"Book #{rec['book_id']}"
+        if left > 0:
+            note = {"kind": "due_soon", "message": f"⏳ {left} days left: {title} (due {rec['due_date']})"}
+        else:
+            note = {"kind": "overdue", "message": f"⚠ Overdue: {title} — fine ₹{fine}"}
+        note.update(book_id=rec['book_id'], title=title, due_date=rec['due_date'], days_left=left, fine=fine)
+        feeds.setdefault(rec['user_email'].lower(), []).append(note)
+    return feeds
+
+
+class FeedStore:
+    def __init__(self, path: str):
+        self.path = path
+        lock_dir = os.path.join(os.path.dirname(os.path.abspath(path)), LOCK_DIR_NAME)
+        # not created by the storage backend in SQLite mode
+        os.makedirs(lock_dir, exist_ok=True)
+        self.lock = FileLock(os.path.join(lock_dir, "notifications.lock"))
+
+    def _doc(self) -> Dict[str, Any]:
+        doc = cached_load(self.path, lambda: load_json(self.path, {}))
+        return doc if isinstance(doc, dict) else {}
+
+    def meta(self) -> Dict[str, Any]:
+        return self._doc().get('meta', {})
+
+    def feed(self, email: str) -> List[Dict[str, Any]]:
+        return self._doc().get('feeds', {}).get(email.lower(), [])
+
+    def _write(self, doc: Dict[str, Any]):
+        save_json(self.path, doc)
+        remember(self.path, doc)
+
+    def replace(self, feeds: Dict[str, List[Dict[str, Any]]], meta: Dict[str, Any]):
+        with self.lock:
+            self._write({"meta": dict(meta, generated_at=time.time()), "feeds": feeds})
+
+    def update_users(self, feeds: Dict[str, List[Dict[str, Any]]], meta: Dict[str, Any]):
+        # read-modify-write under the lock so concurrent per-user updates from
+        # several processes do not drop each other
+        with self.lock:
+            doc = self._doc()
+            merged = dict(doc.get('feeds', {}))
+            for email, feed in feeds.items():
+                if feed:
+                    merged[email.lower()] = feed
+                else:
+                    merged.pop(email.lower(), None)
+            self._write({"meta": dict(doc.get('meta', {}), **meta), "feeds": merged})
+
+
+class Scheduler:
+    # runs `job` every `interval` seconds, and soon after trigger()
+    def __init__(self, job: Callable[[], Any], interval: float = DEFAULT_INTERVAL, name: str = "scheduler"):
+        self.job = job
+        self.interval = interval
+        self.name = name
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def trigger(self):
+        self._wake.set()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                with metrics.timer("library_scheduler_job_seconds", job=self.name):
+                    self.job()
+            except Exception:
+                # a failed run is retried on the next tick
+                metrics.inc("library_scheduler_failures_total", job=self.name)
+            self._wake.wait(self.interval)
+
+
+_schedulers: Dict[str, Scheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def scheduler(name: str, job: Callable[[], Any], interval: float = DEFAULT_INTERVAL) -> Scheduler:
+    # one thread per name and process; Streamlit reruns hand in a fresh `job`
+    # closure each time, the latest one is used from the next run on
+    with _schedulers_lock:
+        s = _schedulers.get(name)
+        if s is None:
+            s = _schedulers[name] = Scheduler(job, interval, name)
+        s.job = job
+        return s.start()
+
+
+metrics.describe("library_scheduler_job_seconds", "histogram", "Background job run time")
+metrics.describe("library_scheduler_failures_total", "counter", "Background job runs that raised")
@@ -0,0 +1,76 @@
+import threading
+from datetime import date
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+import numpy as np
+
+# -------------------------
+# Due dates & fines
+# -------------------------
+# Fines are computed for whole batches of loans at once: the ISO due dates are
+# parsed in a single vectorized datetime64 conversion and the day arithmetic
+# happens in NumPy. DueIndex keeps only the active loans, ordered by due date,
+# so "overdue" and "due within N days" are a binary search plus a slice and
+# cost O(log n + result) instead of a walk over the whole loan history.
+
+Day = Union[date, str]
+
+
+def day_number(d: Day) -> int:
+    return int(np.datetime64(str(d)[:10], "D").astype(np.int64))
+
+
+def due_days(records: List[Dict[str, Any]]) -> np.ndarray:
+    return np.array([r['due_date'][:10] for r in records], dtype="datetime64[D]").astype(np.int64)
+
+
+def fines_for(records: List[Dict[str, Any]], today: Day, fine_per_day: int) -> np.ndarray:
+    # returned loans are settled and carry no running fine
+    if not records:
+        return np.zeros(0, dtype=np.int64)
+    late = day_number(today) - due_days(records)
+    open_ = np.array([not r.get('returned', False) for r in records])
+    return np.where(open_, np.maximum(late, 0) * fine_per_day, 0)
+
+
+class DueIndex:
+    def __init__(self, active_loans: List[Dict[str, Any]]):
+        # ISO dates sort chronologically as strings
+        self.loans = sorted(active_loans, key=lambda r: r['due_date'])
+        self.due = due_days(self.loans) if self.loans else np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.loans)
+
+    def overdue(self, today: Day, fine_per_day: int) -> List[Tuple[Dict[str, Any], int]]:
+        # most overdue first
+        t = day_number(today)
+        k = int(np.searchsorted(self.due, t, side="left"))
+        fines = (t - self.due[:k]) * fine_per_day
+        return list(zip(self.loans[:k], fines.tolist()))
+
+    def due_within(self, days: int, today: Day) -> List[Dict[str, Any]]:
+        # not yet overdue, due today .. today + days
+        t = day_number(today)
+        lo = int(np.searchsorted(self.due, t, side="left"))
+        hi = int(np.searchsorted(self.due, t + days, side="right"))
+        return self.loans[lo:hi]
+
+
+# -------------------------
+# Process-wide index
+# -------------------------
+_index = DueIndex([])
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def due_index(load: Callable[[], List[Dict[str, Any]]], version) -> DueIndex:
+    # `version` is the storage backend's loans version; active loans are only
+    # re-read and re-sorted when it moves
+    global _index, _index_version
+    with _index_lock:
+        if version != _index_version:
+            _index = DueIndex(load())
+            _index_version = version
+        return _index
@@ -0,0 +1,438 @@
+import heapq
+import math
+import threading
+import zlib
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from search import field_text, tokenize
+from storage import normalize_genres
+
+# -------------------------
+# Content-based recommendations
+# -------------------------
+# Every book becomes one dense float32 row made of three L2-normalized,
+# feature-hashed blocks (TF-IDF text, genres, keywords) scaled so that a dot
+# product between two rows is the weighted sum of the block cosines. From
+# those rows we keep a top-K item-item similarity table; a user's
+# recommendations are a scatter-add of the table rows of the books they
+# favorited or borrowed, so answering costs O(seeds * K) regardless of the
+# catalog size. Added books are folded in incrementally (one matrix-vector
+# product against the catalog); the whole model is rebuilt only once the
+# catalog drifted by more than REBUILD_RATIO since the last build.
+
+TEXT_DIM = 512
+GENRE_DIM = 64
+KEYWORD_DIM = 128
+TEXT_WEIGHT = 0.5
+GENRE_WEIGHT = 0.35
+KEYWORD_WEIGHT = 0.15
+TOP_K = 20
+# how much each kind of interaction counts towards a user's profile
+FAVORITE_WEIGHT = 1.0
+ACTIVE_LOAN_WEIGHT = 1.0
+PAST_LOAN_WEIGHT = 0.5
+REBUILD_RATIO = 0.2
+BLOCK_ROWS = 1024
+
+TEXT_FIELDS = ("title", "author", "description", "keywords", "index")
+
+
+def _bucket(token: str, dim: int, salt: str) -> int:
+    # crc32 rather than hash(): stable across processes and restarts
+    return zlib.crc32(f"{salt}:{token}".encode("utf-8")) % dim
+
+
+def _text_tokens(book: Dict[str, Any]) -> List[str]:
+    return tokenize(" ".join(field_text(book, f) for f in TEXT_FIELDS))
+
+
+def _keywords(book: Dict[str, Any]) -> List[str]:
+    value = book.get('keywords') or []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [k.strip().lower() for k in value if k and k.strip()]
+
+
+def _fingerprint(book: Dict[str, Any], genres_of: Optional[Callable] = None) -> int:
+    # cheap enough to run over the whole catalog on every version change
+    return hash((tuple(field_text(book, f, genres_of) for f in TEXT_FIELDS + ("genre",)),
+                 str(book.get('_details'))))
+
+
+def _unit(v: np.ndarray) -> np.ndarray:
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
+
+
+class ContentRecommender:
+    def __init__(self, top_k: int = TOP_K):
+        self.top_k = top_k
+        self.dim = TEXT_DIM + GENRE_DIM + KEYWORD_DIM
+        self.ids: List[int] = []
+        self.row_of: Dict[int, int] = {}
+        self.fingerprints: Dict[int, int] = {}
+        self.X = np.zeros((0, self.dim), dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.nbr_idx = np.zeros((0, 0), dtype=np.int32)
+        self.nbr_sim = np.zeros((0, 0), dtype=np.float32)
+        self.idf: Dict[str, float] = {}
+        self.n_docs = 0
+        self.changes_since_build = 0
+        # book -> normalized genres (see search.field_text); None normalizes
+        # the raw field
+        self.genres_of: Optional[Callable] = None
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    # ---------- vectors ----------
+    def _default_idf(self) -> float:
+        return math.log((self.n_docs + 1) / 1) + 1
+
+    def vectorize(self, book: Dict[str, Any]) -> np.ndarray:
+        v = np.zeros(self.dim, dtype=np.float32)
+        text = np.zeros(TEXT_DIM, dtype=np.float32)
+        counts: Dict[str, int] = {}
+        for t in _text_tokens(book):
+            counts[t] = counts.get(t, 0) + 1
+        default_idf = self._default_idf()
+        for t, c in counts.items():
+            text[_bucket(t, TEXT_DIM, "t")] += (1 + math.log(c)) * self.idf.get(t, default_idf)
+        genres = np.zeros(GENRE_DIM, dtype=np.float32)
+        for g in (self.genres_of(book) if self.genres_of else normalize_genres(book.get('genre'))):
+            genres[_bucket(g.strip().lower(), GENRE_DIM, "g")] = 1.0
+        keywords = np.zeros(KEYWORD_DIM, dtype=np.float32)
+        for k in _keywords(book):
+            keywords[_bucket(k, KEYWORD_DIM, "k")] = 1.0
+        v[:TEXT_DIM] = _unit(text) * math.sqrt(TEXT_WEIGHT)
+        v[TEXT_DIM:TEXT_DIM + GENRE_DIM] = _unit(genres) * math.sqrt(GENRE_WEIGHT)
+        v[TEXT_DIM + GENRE_DIM:] = _unit(keywords) * math.sqrt(KEYWORD_WEIGHT)
+        return v
+
+    # ---------- building ----------
+    def build(self, books: Iterable[Dict[str, Any]], expand: Optional[Callable] = None):
+        hot = list(books)
+        books = [expand(b) for b in hot] if expand else hot
+        with self.lock:
+            df: Dict[str, int] = {}
+            for b in books:
+                for t in set(_text_tokens(b)):
+                    df[t] = df.get(t, 0) + 1
+            self.n_docs = len(books)
+            self.idf = {t: math.log((self.n_docs + 1) / (c + 1)) + 1 for t, c in df.items()}
+            self.ids = [b['id'] for b in books]
+            self.row_of = {book_id: i for i, book_id in enumerate(self.ids)}
+            self.fingerprints = {b['id']: _fingerprint(b, self.genres_of) for b in hot}
+            self.X = np.zeros((max(len(books), 1), self.dim), dtype=np.float32)
+            for i, b in enumerate(books):
+                self.X[i] = self.vectorize(b)
+            self.alive = np.zeros(self.X.shape[0], dtype=bool)
+            self.alive[:len(books)] = True
+            self._build_table()
+            self.changes_since_build = 0
+
+    def _build_table(self):
+        n = len(self.ids)
+        k = max(0, min(self.top_k, n - 1))
+        self.nbr_idx = np.zeros((self.X.shape[0], k), dtype=np.int32)
+        self.nbr_sim = np.zeros((self.X.shape[0], k), dtype=np.float32)
+        if k == 0:
+            return
+        X = self.X[:n]
+        dead = ~self.alive[:n]
+        for start in range(0, n, BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, n)
+            S = X[start:stop] @ X.T
+            S[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+            S[:, dead] = -np.inf
+            part = np.argpartition(-S, k - 1, axis=1)[:, :k]
+            vals = np.take_along_axis(S, part, axis=1)
+            order = np.argsort(-vals, axis=1)
+            self.nbr_idx[start:stop] = np.take_along_axis(part, order, axis=1)
+            self.nbr_sim[start:stop] = np.maximum(np.take_along_axis(vals, order, axis=1), 0)
+
+    def _grow(self):
+        cap = max(16, self.X.shape[0] * 2)
+        X = np.zeros((cap, self.dim), dtype=np.float32)
+        X[:self.X.shape[0]] = self.X
+        alive = np.zeros(cap, dtype=bool)
+        alive[:self.alive.shape[0]] = self.alive
+        k = self.nbr_idx.shape[1]
+        idx = np.zeros((cap, k), dtype=np.int32)
+        idx[:self.nbr_idx.shape[0]] = self.nbr_idx
+        sim = np.zeros((cap, k), dtype=np.float32)
+        sim[:self.nbr_sim.shape[0]] = self.nbr_sim
+        self.X, self.alive, self.nbr_idx, self.nbr_sim = X, alive, idx, sim
+
+    # ---------- incremental updates ----------
+    def add(self, book: Dict[str, Any], fingerprint: Optional[int] = None):
+        with self.lock:
+            book_id = book['id']
+            if book_id in self.row_of:
+                self.remove(book_id)
+            n = len(self.ids)
+            if n >= self.X.shape[0]:
+                self._grow()
+            v = self.vectorize(book)
+            self.X[n] = v
+            self.alive[n] = True
+            self.ids.append(book_id)
+            self.row_of[book_id] = n
+            self.fingerprints[book_id] = _fingerprint(book, self.genres_of) if fingerprint is None else fingerprint
+            self.changes_since_build += 1
+
+            k = self.nbr_idx.shape[1]
+            if k == 0:
+                # the table was too small to have neighbours; start it properly
+                self._build_table()
+                return
+            s = self.X[:n + 1] @ v
+            s[n] = -np.inf
+            s[:n + 1][~self.alive[:n + 1]] = -np.inf
+            # the new book's own neighbours
+            kk = min(k, n)
+            if kk:
+                part = np.argpartition(-s, kk - 1)[:kk]
+                part = part[np.argsort(-s[part])]
+                self.nbr_idx[n, :kk] = part
+                self.nbr_sim[n, :kk] = np.maximum(s[part], 0)
+            # existing books for which it beats their current K-th neighbour
+            rows = np.nonzero(s[:n] > self.nbr_sim[:n, -1])[0]
+            if rows.size:
+                self.nbr_idx[rows, -1] = n
+                self.nbr_sim[rows, -1] = s[rows]
+                order = np.argsort(-self.nbr_sim[rows], axis=1)
+                self.nbr_idx[rows] = np.take_along_axis(self.nbr_idx[rows], order, axis=1)
+                self.nbr_sim[rows] = np.take_along_axis(self.nbr_sim[rows], order, axis=1)
+
+    def remove(self, book_id: int):
+        # rows are tombstoned; stale neighbour entries are masked at query time
+        with self.lock:
+            row = self.row_of.pop(book_id, None)
+            if row is None:
+                return
+            self.alive[row] = False
+            self.fingerprints.pop(book_id, None)
+            self.changes_since_build += 1
+
+    def sync(self, books: List[Dict[str, Any]], expand: Optional[Callable] = None,
+             genres_of: Optional[Callable] = None):
+        # `expand` fills in fields a slim catalog record leaves out
+        with self.lock:
+            self.genres_of = genres_of
+            if not self.ids or self.changes_since_build > REBUILD_RATIO * max(self.n_docs, 1):
+                self.build(books, expand)
+                return
+            seen = set()
+            for b in books:
+                seen.add(b['id'])
+                fp = _fingerprint(b, genres_of)
+                if self.fingerprints.get(b['id']) != fp:
+                    self.add(expand(b) if expand else b, fp)
+            for book_id in [i for i in self.row_of if i not in seen]:
+                self.remove(book_id)
+            if self.changes_since_build > REBUILD_RATIO * max(self.n_docs, 1):
+                self.build(books, expand)
+
+    # ---------- queries ----------
+    def _top(self, scores: np.ndarray, limit: int) -> List[Tuple[int, float]]:
+        candidates = np.nonzero(scores > 0)[0]
+        if candidates.size > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self.ids[r], float(scores[r])) for r in candidates]
+
+    def recommend(self, seeds: Dict[int, float], exclude: Iterable[int] = (), limit: int = 6) -> List[Tuple[int, float]]:
+        # seeds: book id -> weight (favorites, current and past loans)
+        with self.lock:
+            n = len(self.ids)
+            rows = [self.row_of[i] for i in seeds if i in self.row_of]
+            if not rows or limit <= 0:
+                return []
+            weights = np.array([seeds[self.ids[r]] for r in rows], dtype=np.float32)
+            nbrs = self.nbr_idx[rows]
+            contrib = self.nbr_sim[rows] * weights[:, None]
+            scores = np.zeros(n, dtype=np.float32)
+            np.add.at(scores, nbrs.ravel(), contrib.ravel())
+            if np.count_nonzero(scores) < limit:
+                # sparse neighbourhoods: fall back to the full profile product
+                profile = weights @ self.X[rows]
+                scores += 0.5 * np.maximum(self.X[:n] @ profile, 0)
+            scores[~self.alive[:n]] = 0
+            scores[rows] = 0
+            for i in exclude:
+                r = self.row_of.get(i)
+                if r is not None:
+                    scores[r] = 0
+            return self._top(scores, limit)
+
+    def similar(self, book_id: int, limit: int = 6) -> List[Tuple[int, float]]:
+        with self.lock:
+            row = self.row_of.get(book_id)
+            if row is None:
+                return []
+            out = []
+            for r, s in zip(self.nbr_idx[row], self.nbr_sim[row]):
+                if s > 0 and self.alive[r]:
+                    out.append((self.ids[r], float(s)))
+                if len(out) >= limit:
+                    break
+            return out
+
+
+def user_seeds(favorites: Iterable[int], loans: Iterable[Dict[str, Any]]) -> Dict[int, float]:
+    seeds: Dict[int, float] = {}
+    for r in loans:
+        w = PAST_LOAN_WEIGHT if r.get('returned', False) else ACTIVE_LOAN_WEIGHT
+        seeds[r['book_id']] = max(seeds.get(r['book_id'], 0.0), w)
+    for book_id in favorites:
+        seeds[book_id] = seeds.get(book_id, 0.0) + FAVORITE_WEIGHT
+    return seeds
+
+
+# -------------------------
+# Co-borrowing ("patrons who borrowed this also borrowed")
+# -------------------------
+# The sparse user x book matrix is kept as one set of book ids per user; each
+# new (user, book) pair bumps the co-occurrence count against every other book
+# that user borrowed. Loan history is append-only, so counts only grow and the
+# per-book top-N lists can be maintained exactly on every bump, which makes a
+# query O(seeds * N) no matter how long the history gets. sync() consumes only
+# the records appended since the last call and rebuilds from scratch only if
+# the history was rewritten. The process-wide model reads the history once and
+# then follows a feed of new (user, book) loans (see coborrow_model()); pairs
+# it has already counted are skipped, so overlap between the two is harmless.
+
+COBORROW_TOP_N = 20
+
+
+def _loan_key(r: Dict[str, Any]):
+    return (r['user_email'].lower(), r['book_id'], r['issue_date'])
+
+
+class CoBorrowModel:
+    def __init__(self, top_n: int = COBORROW_TOP_N):
+        self.top_n = top_n
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.user_books: Dict[str, set] = {}
+        self.counts: Dict[int, Dict[int, int]] = {}
+        # book id -> [(count, other book id)], best first
+        self.top: Dict[int, List[Tuple[int, int]]] = {}
+        self.consumed = 0
+        self.last = None
+
+    def _bump(self, a: int, b: int):
+        row = self.counts.setdefault(a, {})
+        c = row.get(b, 0) + 1
+        row[b] = c
+        top = self.top.setdefault(a, [])
+        for i, (_, other) in enumerate(top):
+            if other == b:
+                top[i] = (c, b)
+                break
+        else:
+            if len(top) < self.top_n:
+                top.append((c, b))
+            elif c > top[-1][0]:
+                top[-1] = (c, b)
+            else:
+                return
+        top.sort(key=lambda x: (-x[0], x[1]))
+
+    def add_loan(self, user_email: str, book_id: int):
+        with self.lock:
+            books = self.user_books.setdefault(user_email.lower(), set())
+            if book_id in books:
+                return
+            for other in books:
+                self._bump(book_id, other)
+                self._bump(other, book_id)
+            books.add(book_id)
+
+    def sync(self, issued: List[Dict[str, Any]]):
+        with self.lock:
+            n = len(issued)
+            if n < self.consumed or (self.consumed and _loan_key(issued[self.consumed - 1]) != self.last):
+                self.reset()
+            for r in issued[self.consumed:]:
+                self.add_loan(r['user_email'], r['book_id'])
+            self.consumed = n
+            self.last = _loan_key(issued[-1]) if n else None
+
+    def also_borrowed(self, book_id: int, limit: int = 6) -> List[Tuple[int, float]]:
+        with self.lock:
+            return [(other, float(c)) for c, other in self.top.get(book_id, [])[:limit]]
+
+    def recommend(self, seeds: Dict[int, float], exclude: Iterable[int] = (), limit: int = 6) -> List[Tuple[int, float]]:
+        with self.lock:
+            scores: Dict[int, float] = {}
+            for book_id, w in seeds.items():
+                for c, other in self.top.get(book_id, ()):
+                    scores[other] = scores.get(other, 0.0) + w * c
+        skip = set(exclude) | set(seeds)
+        return heapq.nlargest(limit, ((i, s) for i, s in scores.items() if i not in skip), key=lambda x: x[1])
+
+
+def blend(content: List[Tuple[int, float]], coborrow: List[Tuple[int, float]], weight: float) -> List[Tuple[int, float]]:
+    # both lists are max-normalized first so `weight` (0..1, share of the
+    # co-borrow signal) means the same whatever the raw score scales are
+    weight = min(max(weight, 0.0), 1.0)
+    scores: Dict[int, float] = {}
+    for items, w in ((content, 1.0 - weight), (coborrow, weight)):
+        top = max((s for _, s in items), default=0.0)
+        if top <= 0 or w <= 0:
+            continue
+        for i, s in items:
+            scores[i] = scores.get(i, 0.0) + w * s / top
+    return sorted(scores.items(), key=lambda x: -x[1])
+
+
+# -------------------------
+# Process-wide models
+# -------------------------
+_model = ContentRecommender()
+_model_version = None
+_coborrow = CoBorrowModel()
+_coborrow_cursor = None
+_coborrow_version = None
+_model_lock = threading.Lock()
+
+
+def catalog_recommender(books: List[Dict[str, Any]], version, expand: Optional[Callable] = None,
+                        genres_of: Optional[Callable] = None) -> ContentRecommender:
+    global _model_version
+    with _model_lock:
+        if version != _model_version:
+            _model.sync(books, expand, genres_of)
+            _model_version = version
+        return _model
+
+
+def coborrow_model(load: Callable[[], List[Dict[str, Any]]], feed: Callable, version) -> CoBorrowModel:
+    # feed(cursor) -> ([(user email, book id), ...] issued since cursor, next
+    # cursor), or None once it cannot continue from that cursor; feed(None)
+    # gives the current position, or None while there is no feed at all.
+    # load() (the whole history) is called on first use and after the feed
+    # lost track; without a feed, whenever `version` (of the loans) moves.
+    global _coborrow_cursor, _coborrow_version
+    with _model_lock:
+        got = feed(_coborrow_cursor) if _coborrow_cursor is not None else None
+        if got is None:
+            # position first: loans issued while the history loads come in
+            # through the feed on the next call
+            start = feed(None)
+            if start is not None or version != _coborrow_version:
+                _coborrow.sync(load())
+                _coborrow_version = version
+            _coborrow_cursor = start[1] if start else None
+        else:
+            pairs, _coborrow_cursor = got
+            for user_email, book_id in pairs:
+                _coborrow.add_loan(user_email, book_id)
+        return _coborrow
@@ -0,0 +1,88 @@
+"""Catalog listings follow issue/return on every storage backend.
+
+For each backend, in a fresh data directory and process: issue a book through
+the API, then check that GET /books/{id}, GET /books?available=true and
+GET /books?available=false all show it as out; return it and check that the
+listings show it back on the shelf. The catalog models behind /books are
+cached on the catalog version, which issue/return do not move.
+
+    python scripts/catalog_listing_check.py
+    python scripts/catalog_listing_check.py --backend sqlite
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKENDS = ("json", "compact", "journal", "sqlite")
+BOOK_ID = 2
+USER = "reader@example.com"
+
+
+def _listed(client, available: bool) -> set:
+    body = client.get("/books", params={"available": str(available).lower(), "limit": 500}).json()
+    return {b['id'] for b in body['items']}
+
+
+def check(backend: str, directory: str) -> list:
+    os.chdir(directory)
+    os.environ["LIBRARY_STORAGE"] = backend
+    sys.path.insert(0, REPO)
+    from fastapi.testclient import TestClient
+    import api
+    import app
+    app.bootstrap_files()
+    app.signup_user("Reader", "0000000000", USER, "Passw0rd!", "user")
+    client = TestClient(api.api)
+    token = client.post("/login", json={"email": USER, "password": "Passw0rd!"}).json()['token']
+    auth = {"Authorization": f"Bearer {token}"}
+    problems = []
+
+    def expect(out: bool, stage: str):
+        book = client.get(f"/books/{BOOK_ID}").json()
+        if book.get('available') == out:
+            problems.append(f"{stage}: GET /books/{BOOK_ID} says available={book.get('available')}")
+        if (BOOK_ID in _listed(client, True)) == out:
+            problems.append(f"{stage}: /books?available=true {'lists' if out else 'misses'} the book")
+        if (BOOK_ID in _listed(client, False)) != out:
+            problems.append(f"{stage}: /books?available=false {'misses' if out else 'lists'} the book")
+
+    expect(False, "before issue")
+    r = client.post("/issue", json={"book_id": BOOK_ID}, headers=auth)
+    if r.status_code != 200:
+        return [f"issue failed: {r.status_code} {r.text}"]
+    expect(True, "after issue")
+    r = client.post("/return", json={"book_id": BOOK_ID}, headers=auth)
+    if r.status_code != 200:
+        return problems + [f"return failed: {r.status_code} {r.text}"]
+    expect(False, "after return")
+    return problems
+
+
+def _run(backend: str) -> list:
+    with tempfile.TemporaryDirectory() as directory:
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(1) as pool:
+            return pool.apply(check, (backend, directory))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=BACKENDS, action="append")
+    args = parser.parse_args()
+    failed = False
+    for backend in args.backend or BACKENDS:
+        problems = _run(backend)
+        for p in problems:
+            print(f"FAIL [{backend}]: {p}")
+        failed = failed or bool(problems)
+        if not problems:
+            print(f"ok [{backend}]")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
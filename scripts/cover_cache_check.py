@@ -0,0 +1,171 @@
+"""Cover cache behaviour against a local stand-in image server.
+
+Serves generated images from a loopback http.server (counting requests per
+path) and checks, in a temp cache directory, that
+  - a cover is downloaded once, however many threads ask for it at once,
+    and served from disk afterwards
+  - the directory stays under its byte budget by evicting the least recently
+    used covers
+  - a broken link returns None (the placeholder) and is not retried while it
+    is remembered as failed
+  - block=False returns at once on a miss and the cover shows up once the
+    background fetch is done
+  - the real downloader refuses loopback addresses (the stand-in server
+    itself, directly and by redirect) and non-http(s) URLs
+
+    python scripts/cover_cache_check.py
+"""
+import functools
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import covers  # noqa: E402
+
+SLOW_SECONDS = 1.0
+
+
+def _image(seed: int) -> bytes:
+    # noisy pixels so the JPEG thumbnails have a predictable, non-trivial size
+    from PIL import Image
+    img = Image.effect_noise((300, 450), 60 + seed).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+class StandIn(BaseHTTPRequestHandler):
+    images = {f"/{i}.png": _image(i) for i in range(4)}
+    hits: dict = {}
+    hits_lock = threading.Lock()
+
+    def do_GET(self):
+        with self.hits_lock:
+            self.hits[self.path] = self.hits.get(self.path, 0) + 1
+        if self.path == "/slow.png":
+            time.sleep(SLOW_SECONDS)
+            body = self.images["/0.png"]
+        elif self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/0.png")
+            self.end_headers()
+            return
+        else:
+            body = self.images.get(self.path)
+        if body is None:
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def check(base: str, directory: str) -> list:
+    problems = []
+    fetch = functools.partial(covers.fetch_url, allow_private=True)
+
+    def hits(path: str) -> int:
+        return StandIn.hits.get(path, 0)
+
+    # fetch once
+    cache = covers.CoverCache(os.path.join(directory, "once"), fetch=fetch)
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(cache.get(f"{base}/0.png"))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    cache.get(f"{base}/0.png", covers.OVERVIEW_WIDTH)
+    if hits("/0.png") != 1:
+        problems.append(f"fetch once: /0.png downloaded {hits('/0.png')} times")
+    if not all(p and os.path.exists(p) for p in paths):
+        problems.append("fetch once: not every caller got a thumbnail")
+
+    # LRU eviction: room for covers 1 and 3 (both widths each), not 2 as well
+    probe = covers.CoverCache(os.path.join(directory, "probe"), fetch=fetch)
+    size = {i: [os.path.getsize(probe.get(f"{base}/{i}.png", w)) for w in covers.SIZES] for i in (1, 2, 3)}
+    budget = sum(size[1]) + sum(size[3]) + min(size[2]) // 2
+    lru = covers.CoverCache(os.path.join(directory, "lru"), max_bytes=budget, fetch=fetch)
+    first = lru.get(f"{base}/1.png")
+    second = lru.get(f"{base}/2.png")
+    for width in covers.SIZES:
+        lru.get(f"{base}/1.png", width)  # 2.png is now the least recently used
+    third = lru.get(f"{base}/3.png")
+    if not (first and os.path.exists(first) and third and os.path.exists(third)):
+        problems.append("lru: recently used covers were evicted")
+    if second and os.path.exists(second):
+        problems.append("lru: the least recently used cover was kept")
+    if lru.total > lru.max_bytes:
+        problems.append(f"lru: {lru.total} bytes held over a {lru.max_bytes} budget")
+    before = hits("/2.png")
+    lru.get(f"{base}/2.png")
+    if hits("/2.png") != before + 1:
+        problems.append("lru: an evicted cover was not downloaded again")
+
+    # failure fallback
+    broken = covers.CoverCache(os.path.join(directory, "broken"), fetch=fetch)
+    if broken.get(f"{base}/missing.png") is not None or broken.get(f"{base}/missing.png") is not None:
+        problems.append("failure: a broken link returned a path")
+    if hits("/missing.png") != 1:
+        problems.append(f"failure: broken link tried {hits('/missing.png')} times within FAILURE_TTL")
+
+    # non-blocking miss
+    lazy = covers.CoverCache(os.path.join(directory, "lazy"), fetch=fetch)
+    started = time.perf_counter()
+    first = lazy.get(f"{base}/slow.png", block=False)
+    lazy.prefetch([f"{base}/slow.png"])
+    waited = time.perf_counter() - started
+    if first is not None or waited > SLOW_SECONDS / 2:
+        problems.append(f"background: a miss blocked for {waited:.2f}s")
+    deadline = time.time() + covers.FETCH_TIMEOUT + SLOW_SECONDS
+    while lazy.get(f"{base}/slow.png", block=False) is None and time.time() < deadline:
+        time.sleep(0.05)
+    if lazy.get(f"{base}/slow.png", block=False) is None:
+        problems.append("background: the cover never arrived")
+    if hits("/slow.png") != 1:
+        problems.append(f"background: /slow.png downloaded {hits('/slow.png')} times")
+
+    # address checks of the real downloader
+    for url in (f"{base}/0.png", f"{base}/redirect", base.replace("http://", "https://") + "/0.png",
+                "file:///etc/passwd", "ftp://127.0.0.1/x.png"):
+        try:
+            covers.fetch_url(url)
+        except ValueError:
+            continue
+        except Exception as e:
+            problems.append(f"ssrf: {url} failed with {e!r} instead of being refused")
+            continue
+        problems.append(f"ssrf: {url} was fetched")
+    if hits("/redirect") or hits("/0.png") != 1:
+        problems.append("ssrf: a refused request still reached the server")
+    return problems
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            problems = check(f"http://127.0.0.1:{server.server_address[1]}", directory)
+    finally:
+        server.shutdown()
+    for p in problems:
+        print(f"FAIL: {p}")
+    if problems:
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Concurrency stress check for issue/return.
+
+Runs many threads in several processes that issue and return a small pool of
+books through one storage backend at the same time, then checks that no book
+was issued twice, availability agrees with the open loans and every
+successful call is accounted for in the loan history.
+
+    python scripts/stress_issue_return.py --backend json --processes 4 --threads 8 --ops 200
+    python scripts/stress_issue_return.py --backend sqlite
+    python scripts/stress_issue_return.py --backend journal
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+from locks import ConflictError  # noqa: E402
+
+RETRIES = 5
+
+
+def _files(directory: str):
+    return (os.path.join(directory, "books.json"), os.path.join(directory, "users.json"),
+            os.path.join(directory, "issued.json"))
+
+
+def _backend(backend: str, directory: str) -> storage.Storage:
+    books, users, issued = _files(directory)
+    return storage.get_storage(backend, books, users, issued,
+                               journal_dir=os.path.join(directory, "journal"),
+                               db_path=os.path.join(directory, "library.db"),
+                               snapshot_every=200)
+
+
+def setup(directory: str, n_books: int, n_users: int):
+    books, users, issued = _files(directory)
+    storage.save_json(books, [{"id": i, "title": f"Book {i}", "author": "A", "genre": ["G"], "available": True}
+                              for i in range(1, n_books + 1)])
+    storage.save_json(users, [{"name": f"U{i}", "email": f"u{i}@example.com", "role": "user", "favorites": []}
+                              for i in range(n_users)])
+    storage.save_json(issued, [])
+
+
+def _retry(fn):
+    for attempt in range(RETRIES):
+        try:
+            return fn(), attempt
+        except ConflictError:
+            time.sleep(random.random() * 0.01 * (attempt + 1))
+    return ConflictError, RETRIES
+
+
+def worker(backend: str, directory: str, n_threads: int, n_ops: int, n_books: int, n_users: int, seed: int):
+    store = _backend(backend, directory)
+    totals = {"issued": 0, "returned": 0, "rejected": 0, "retries": 0, "gave_up": 0}
+    guard = threading.Lock()
+
+    def run(tid: int):
+        rnd = random.Random(seed * 1000 + tid)
+        local = dict.fromkeys(totals, 0)
+        for _ in range(n_ops):
+            email = f"u{rnd.randrange(n_users)}@example.com"
+            mine = store.active_issues(email)
+            if mine and rnd.random() < 0.5:
+                book_id = rnd.choice(mine)['book_id']
+                result, attempts = _retry(lambda: store.return_book(email, book_id, "2024-01-10"))
+                ok = result not in (None, ConflictError)
+                key = "returned"
+            else:
+                book_id = rnd.randint(1, n_books)
+                result, attempts = _retry(lambda: store.issue(email, book_id, "2024-01-01", "2024-01-15"))
+                ok = result is not ConflictError and result[0] == "ok"
+                key = "issued"
+            local["retries"] += attempts
+            if result is ConflictError:
+                local["gave_up"] += 1
+            elif ok:
+                local[key] += 1
+            else:
+                local["rejected"] += 1
+        with guard:
+            for k, v in local.items():
+                totals[k] += v
+
+    threads = [threading.Thread(target=run, args=(t,)) for t in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if backend == "journal":
+        store.journal.close()
+    return totals
+
+
+def verify(backend: str, directory: str, totals) -> list:
+    storage.invalidate()
+    store = _backend(backend, directory)
+    problems = []
+    loans = store.issued()
+    active = {}
+    for r in loans:
+        if not r['returned']:
+            if r['book_id'] in active:
+                problems.append(f"book {r['book_id']} issued twice")
+            active[r['book_id']] = r
+    for b in store.books():
+        if b['available'] == (b['id'] in active):
+            problems.append(f"book {b['id']} availability disagrees with loans")
+    if len(loans) != totals["issued"]:
+        problems.append(f"{totals['issued']} successful issues but {len(loans)} loan records")
+    returned = sum(1 for r in loans if r['returned'])
+    if returned != totals["returned"]:
+        problems.append(f"{totals['returned']} successful returns but {returned} returned loans")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["json", "sqlite", "journal"], default="json")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=100, help="operations per thread")
+    parser.add_argument("--books", type=int, default=20)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        setup(directory, args.books, args.users)
+        if args.backend == "sqlite":
+            books, users, issued = _files(directory)
+            storage.SqliteStorage(os.path.join(directory, "library.db")).migrate_from_json(books, users, issued)
+
+        ctx = multiprocessing.get_context("spawn")
+        started = time.perf_counter()
+        with ctx.Pool(args.processes) as pool:
+            parts = pool.starmap(worker, [(args.backend, directory, args.threads, args.ops,
+                                           args.books, args.users, p) for p in range(args.processes)])
+        elapsed = time.perf_counter() - started
+
+        totals = {k: sum(p[k] for p in parts) for k in parts[0]}
+        ops = args.processes * args.threads * args.ops
+        print(json.dumps({"backend": args.backend, "operations": ops, "seconds": round(elapsed, 3),
+                          "ops_per_second": round(ops / elapsed, 1), **totals}))
+        problems = verify(args.backend, directory, totals)
+        for p in problems:
+            print("FAIL:", p)
+        if problems:
+            sys.exit(1)
+        print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+import math
+import re
+import threading
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from storage import normalize_genres
+
+# -------------------------
+# Full-text catalog search
+# -------------------------
+# Tokenized inverted index over the searchable book fields, ranked with BM25F:
+# per-field term frequencies are combined with FIELD_BOOSTS before the usual
+# BM25 saturation and length normalization. Books are indexed individually, so
+# sync() only re-tokenizes the books whose searchable text actually changed.
+
+FIELD_BOOSTS = {
+    "title": 3.0,
+    "author": 2.5,
+    "genre": 2.0,
+    "keywords": 1.5,
+    "description": 1.0,
+    "index": 0.75,
+}
+K1 = 1.2
+B = 0.75
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("a an and are as at be by for from in is it of on or the to with".split())
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def field_text(book: Dict[str, Any], field: str, genres_of: Optional[Callable] = None) -> str:
+    # genres_of(book) -> the book's normalized genres (e.g. from the typed
+    # catalog); without it the raw field is normalized here
+    value = book.get(field)
+    if field == "genre":
+        value = genres_of(book) if genres_of else normalize_genres(value)
+    if isinstance(value, (list, tuple)):
+        return " ".join(str(v) for v in value)
+    return str(value) if value else ""
+
+
+def _fingerprint(book: Dict[str, Any], genres_of: Optional[Callable] = None) -> int:
+    # "_details" points at the out-of-line text in the compact catalog and
+    # moves whenever that text is rewritten
+    return hash((tuple(field_text(book, f, genres_of) for f in FIELD_BOOSTS), str(book.get('_details'))))
+
+
+class SearchIndex:
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, float]] = {}
+        self.doc_terms: Dict[int, Dict[str, float]] = {}
+        self.doc_len: Dict[int, float] = {}
+        self.fingerprints: Dict[int, int] = {}
+        self.total_len = 0.0
+        self._vocab: Optional[List[str]] = None
+        self.genres_of: Optional[Callable] = None
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def add(self, book: Dict[str, Any]):
+        with self.lock:
+            book_id = book['id']
+            if book_id in self.doc_terms:
+                self.remove(book_id)
+            weights: Dict[str, float] = {}
+            length = 0.0
+            for field, boost in FIELD_BOOSTS.items():
+                tokens = tokenize(field_text(book, field, self.genres_of))
+                length += boost * len(tokens)
+                for t in tokens:
+                    weights[t] = weights.get(t, 0.0) + boost
+            for t, w in weights.items():
+                if t not in self.postings:
+                    self.postings[t] = {}
+                    self._vocab = None
+                self.postings[t][book_id] = w
+            self.doc_terms[book_id] = weights
+            self.doc_len[book_id] = length
+            self.fingerprints[book_id] = _fingerprint(book, self.genres_of)
+            self.total_len += length
+
+    def remove(self, book_id: int):
+        with self.lock:
+            weights = self.doc_terms.pop(book_id, None)
+            if weights is None:
+                return
+            for t in weights:
+                docs = self.postings[t]
+                docs.pop(book_id, None)
+                if not docs:
+                    del self.postings[t]
+                    self._vocab = None
+            self.total_len -= self.doc_len.pop(book_id)
+            self.fingerprints.pop(book_id, None)
+
+    def sync(self, books: Iterable[Dict[str, Any]], expand: Optional[Callable] = None,
+             genres_of: Optional[Callable] = None):
+        # bring the index in line with `books`, re-tokenizing only what changed;
+        # `expand` fills in fields a slim catalog record leaves out
+        with self.lock:
+            self.genres_of = genres_of
+            seen = set()
+            for b in books:
+                seen.add(b['id'])
+                fp = _fingerprint(b, genres_of)
+                if self.fingerprints.get(b['id']) != fp:
+                    self.add(expand(b) if expand else b)
+                    self.fingerprints[b['id']] = fp
+            for book_id in [i for i in self.doc_terms if i not in seen]:
+                self.remove(book_id)
+
+    def _expand_prefix(self, prefix: str) -> List[str]:
+        if self._vocab is None:
+            self._vocab = sorted(self.postings)
+        out = []
+        i = bisect_left(self._vocab, prefix)
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix):
+            out.append(self._vocab[i])
+            i += 1
+        return out
+
+    def search(self, query: str, limit: Optional[int] = None, prefix_last: bool = False) -> List[Tuple[int, float]]:
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self.lock:
+            n = len(self.doc_terms)
+            if n == 0:
+                return []
+            avgdl = (self.total_len / n) or 1.0
+            groups = [[t] for t in terms[:-1]]
+            groups.append(self._expand_prefix(terms[-1]) if prefix_last else [terms[-1]])
+            scores: Dict[int, float] = {}
+            for group in groups:
+                for t in group:
+                    docs = self.postings.get(t)
+                    if not docs:
+                        continue
+                    df = len(docs)
+                    idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                    for book_id, tf in docs.items():
+                        norm = K1 * (1 - B + B * self.doc_len[book_id] / avgdl)
+                        scores[book_id] = scores.get(book_id, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
+        return ranked[:limit] if limit else ranked
+
+
+# -------------------------
+# Typo-tolerant typeahead
+# -------------------------
+# Suggestions over titles and authors. Every word of every entry goes into a
+# sorted vocabulary (bisect gives prefix ranges, which is what a prefix trie
+# would but with a fraction of the memory at 100k+ titles) and a trigram index
+# bucketed by word length. A query word is matched exactly/by prefix first and
+# only falls back to trigram candidates, verified with a bounded Levenshtein
+# distance, when that finds nothing. Candidate entries are driven from the most
+# selective query word, best matches first, and collection stops once `limit`
+# entries are in hand, so cost tracks the answer size rather than the catalog.
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+PREFIX_SCORE = 0.95
+MAX_PREFIX_WORDS = 200
+
+
+def max_typos(word: str) -> int:
+    return 0 if len(word) <= 3 else 1 if len(word) <= 7 else 2
+
+
+def trigrams(word: str) -> List[str]:
+    padded = f"  {word} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def bounded_edit_distance(a: str, b: str, limit: int, prefix: bool = False) -> int:
+    # Optimal-string-alignment distance (Levenshtein plus adjacent
+    # transpositions), or limit + 1 as soon as it must exceed `limit`. With
+    # prefix=True, the distance from `a` to the closest prefix of `b`.
+    if prefix:
+        b = b[:len(a) + limit]
+        if len(b) < len(a) - limit:
+            return limit + 1
+    elif abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        best = i
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            v = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if cost and prev2 is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                v = min(v, prev2[j - 2] + 1)
+            cur[j] = v
+            if v < best:
+                best = v
+        if best > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    if prefix:
+        return min(prev[max(0, len(a) - limit):])
+    return prev[-1]
+
+
+class SuggestIndex:
+    FIELDS = ("title", "author")
+
+    def __init__(self):
+        self.entries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.word_entries: Dict[str, set] = {}
+        # trigram -> word length -> words
+        self.trigram_words: Dict[str, Dict[int, set]] = {}
+        self.book_entries: Dict[int, List[Tuple[str, str]]] = {}
+        self.fingerprints: Dict[int, int] = {}
+        self._vocab: Optional[List[str]] = None
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def _fingerprint(book: Dict[str, Any]) -> int:
+        return hash(tuple(str(book.get(f) or "") for f in SuggestIndex.FIELDS))
+
+    def _add_word(self, word: str, key):
+        keys = self.word_entries.get(word)
+        if keys is None:
+            keys = self.word_entries[word] = set()
+            for tg in trigrams(word):
+                self.trigram_words.setdefault(tg, {}).setdefault(len(word), set()).add(word)
+            self._vocab = None
+        keys.add(key)
+
+    def _drop_word(self, word: str, key):
+        keys = self.word_entries.get(word)
+        if keys is None:
+            return
+        keys.discard(key)
+        if keys:
+            return
+        del self.word_entries[word]
+        for tg in trigrams(word):
+            buckets = self.trigram_words.get(tg, {})
+            words = buckets.get(len(word))
+            if words is not None:
+                words.discard(word)
+                if not words:
+                    del buckets[len(word)]
+            if not buckets:
+                self.trigram_words.pop(tg, None)
+        self._vocab = None
+
+    def add(self, book: Dict[str, Any]):
+        with self.lock:
+            book_id = book['id']
+            if book_id in self.book_entries:
+                self.remove(book_id)
+            keys = []
+            for field in self.FIELDS:
+                text = str(book.get(field) or "").strip()
+                if not text:
+                    continue
+                key = (field, text.lower())
+                entry = self.entries.get(key)
+                if entry is None:
+                    entry = self.entries[key] = {"text": text, "kind": field, "book_ids": set(),
+                                                 "words": tuple(WORD_RE.findall(key[1]))}
+                    for w in set(entry['words']):
+                        self._add_word(w, key)
+                entry['book_ids'].add(book_id)
+                keys.append(key)
+            self.book_entries[book_id] = keys
+            self.fingerprints[book_id] = self._fingerprint(book)
+
+    def remove(self, book_id: int):
+        with self.lock:
+            for key in self.book_entries.pop(book_id, []):
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                entry['book_ids'].discard(book_id)
+                if not entry['book_ids']:
+                    del self.entries[key]
+                    for w in set(entry['words']):
+                        self._drop_word(w, key)
+            self.fingerprints.pop(book_id, None)
+
+    def sync(self, books: Iterable[Dict[str, Any]]):
+        with self.lock:
+            seen = set()
+            for b in books:
+                seen.add(b['id'])
+                if self.fingerprints.get(b['id']) != self._fingerprint(b):
+                    self.add(b)
+            for book_id in [i for i in self.book_entries if i not in seen]:
+                self.remove(book_id)
+
+    def _prefix_words(self, prefix: str) -> List[str]:
+        if self._vocab is None:
+            self._vocab = sorted(self.word_entries)
+        out = []
+        i = bisect_left(self._vocab, prefix)
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix) and len(out) < MAX_PREFIX_WORDS:
+            out.append(self._vocab[i])
+            i += 1
+        return out
+
+    def _fuzzy_words(self, word: str, is_prefix: bool) -> Dict[str, float]:
+        # partially typed words get at most one typo in what has been typed
+        limit = min(max_typos(word), 1) if is_prefix else max_typos(word)
+        if limit == 0:
+            return {}
+        grams = trigrams(word)
+        if is_prefix:
+            # no trailing pad trigram: the word may continue
+            grams = grams[:-1]
+            ok_len = lambda n: n >= len(word) - limit
+        else:
+            ok_len = lambda n: abs(n - len(word)) <= limit
+        postings = []
+        for tg in set(grams):
+            buckets = self.trigram_words.get(tg, {})
+            postings.append([words for n, words in buckets.items() if ok_len(n)])
+        # A substitution, insertion or deletion destroys at most 3 trigrams,
+        # so a match shares at least `need` of them and, by pigeonhole, shows
+        # up in one of the len - need + 1 rarest lists; only those are scanned.
+        # (A transposition can destroy 4, so one right at the start of a short
+        # word may be missed; that is the price of not scanning everything.)
+        need = max(1, len(postings) - 3 * limit)
+        postings.sort(key=lambda ls: sum(len(w) for w in ls))
+        candidates = set()
+        for ls in postings[:len(postings) - need + 1]:
+            for words in ls:
+                candidates.update(words)
+        out = {}
+        for w in candidates:
+            d = bounded_edit_distance(word, w, limit, prefix=is_prefix)
+            if d <= limit:
+                out[w] = (PREFIX_SCORE if is_prefix else 1.0) * (1.0 - d / (len(word) + 1))
+        return out
+
+    def _match_word(self, word: str, is_prefix: bool) -> Dict[str, float]:
+        if is_prefix:
+            scored = {w: (1.0 if w == word else PREFIX_SCORE) for w in self._prefix_words(word)}
+        else:
+            scored = {word: 1.0} if word in self.word_entries else {}
+        if not scored:
+            scored = self._fuzzy_words(word, False)
+        if not scored and is_prefix:
+            scored = self._fuzzy_words(word, True)
+        return scored
+
+    def suggest(self, query: str, limit: int = 8) -> List[Dict[str, Any]]:
+        words = WORD_RE.findall(query.lower())
+        if not words:
+            return []
+        with self.lock:
+            matches = [self._match_word(w, i == len(words) - 1) for i, w in enumerate(words)]
+            if not all(matches):
+                return []
+            # drive candidates from the query word matching the fewest entries
+            order = sorted(range(len(words)),
+                           key=lambda i: sum(len(self.word_entries[w]) for w in matches[i]))
+            lead, rest = matches[order[0]], [matches[i] for i in order[1:]]
+
+            # gather a few more than `limit` so the final ordering has
+            # something to choose from, then stop
+            wanted = limit * 4
+            found: Dict[Tuple[str, str], float] = {}
+            for w in sorted(lead, key=lambda w: (-lead[w], len(w), w)):
+                if len(found) >= wanted:
+                    break
+                for key in self.word_entries[w]:
+                    if len(found) >= wanted:
+                        break
+                    if key in found:
+                        continue
+                    entry_words = self.entries[key]['words']
+                    total = lead[w]
+                    for scored in rest:
+                        best = max((scored.get(ew, 0.0) for ew in entry_words), default=0.0)
+                        if not best:
+                            break
+                        total += best
+                    else:
+                        found[key] = total / len(words)
+            ranked = sorted(found.items(), key=lambda kv: (-kv[1], len(kv[0][1]), kv[0]))[:limit]
+            return [{"text": self.entries[k]['text'], "kind": k[0],
+                     "book_ids": sorted(self.entries[k]['book_ids']), "score": round(s, 3)}
+                    for k, s in ranked]
+
+
+# -------------------------
+# Process-wide catalog index
+# -------------------------
+_catalog = SearchIndex()
+_suggester = SuggestIndex()
+_versions: Dict[str, Any] = {}
+_catalog_lock = threading.Lock()
+
+
+def _synced(name: str, idx, books: List[Dict[str, Any]], version, *args):
+    # `version` is the storage backend's catalog version; the (cheap) diff
+    # against the current books only runs when it moves
+    with _catalog_lock:
+        if _versions.get(name) != version:
+            idx.sync(books, *args)
+            _versions[name] = version
+        return idx
+
+
+def catalog_index(books: List[Dict[str, Any]], version, expand: Optional[Callable] = None,
+                  genres_of: Optional[Callable] = None) -> SearchIndex:
+    return _synced("search", _catalog, books, version, expand, genres_of)
+
+
+def catalog_suggester(books: List[Dict[str, Any]], version) -> SuggestIndex:
+    return _synced("suggest", _suggester, books, version)
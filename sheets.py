@@ -0,0 +1,382 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import metrics
+from locks import ConflictError, FileLock
+from storage import LOCK_DIR_NAME, load_json, normalize_genres, save_json
+
+# -------------------------
+# Google Sheets mirror
+# -------------------------
+# The catalog and the loan history are mirrored to one worksheet each for staff
+# reporting. Nothing is re-uploaded wholesale: a local state file remembers,
+# per worksheet, the row every record was written to and a digest of what was
+# written, plus the store version that was last synced. A sync run is skipped
+# outright while the version has not moved; otherwise the records are digested
+# again and only new, changed and removed rows are pushed, as contiguous ranges
+# grouped into a few batch_update requests. Requests that hit rate limits or
+# server errors are retried with exponential backoff; state is saved after
+# every successful request, so a failed run resumes where it stopped.
+#
+# Runs happen off the request path (a scheduler thread, or the CLI) and at most
+# one process syncs at a time. gspread is imported only when a real
+# spreadsheet is opened; FakeSpreadsheet stands in for it in tests and
+# benchmarks.
+
+BOOK_COLUMNS = ["id", "title", "author", "genre", "keywords", "available", "issued_to", "added_on"]
+LOAN_COLUMNS = ["loan_id", "user_email", "book_id", "issue_date", "due_date", "returned", "return_date"]
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+DEFAULT_INTERVAL = 120
+MAX_CELLS_PER_REQUEST = 20000
+MAX_RANGES_PER_REQUEST = 200
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 32.0
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+def _cell(value) -> Any:
+    if isinstance(value, (list, tuple)):
+        return "|".join(str(v) for v in value)
+    if value is None:
+        return ""
+    return value
+
+
+def book_row(book: Dict[str, Any]) -> List[Any]:
+    return [_cell(normalize_genres(book.get('genre')) if c == "genre" else book.get(c)) for c in BOOK_COLUMNS]
+
+
+def loan_row(loan: Dict[str, Any]) -> List[Any]:
+    return [_cell(loan.get(c)) for c in LOAN_COLUMNS]
+
+
+def book_key(book: Dict[str, Any]) -> str:
+    return str(book['id'])
+
+
+def loan_keys() -> Callable[[Dict[str, Any]], str]:
+    # loans from the JSON backends carry a loan_id; the others are told apart
+    # by borrower, book and issue date (numbered if that repeats)
+    seen: Dict[str, int] = {}
+
+    def key(loan: Dict[str, Any]) -> str:
+        if loan.get('loan_id') is not None:
+            return str(loan['loan_id'])
+        base = f"{loan['user_email'].lower()}|{loan['book_id']}|{loan['issue_date']}"
+        n = seen[base] = seen.get(base, 0) + 1
+        return base if n == 1 else f"{base}#{n}"
+    return key
+
+
+def _digest(values: List[Any]) -> str:
+    raw = json.dumps(values, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def column_letter(n: int) -> str:
+    # 1 -> A, 27 -> AA
+    out = ""
+    while n:
+        n, rem = divmod(n - 1, 26)
+        out = chr(65 + rem) + out
+    return out
+
+
+def retryable(exc: Exception) -> bool:
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status is not None:
+        return status in RETRY_STATUSES
+    return isinstance(exc, (ConnectionError, TimeoutError))
+
+
+def with_backoff(call: Callable[[], Any], sleep: Callable[[float], None] = time.sleep,
+                 attempts: int = MAX_ATTEMPTS) -> Any:
+    for attempt in range(attempts):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == attempts - 1 or not retryable(e):
+                raise
+            metrics.inc("library_sheets_retries_total")
+            # full jitter keeps several retrying clients from lining up
+            sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+
+
+class Source:
+    __slots__ = ("title", "columns", "version", "records", "to_row", "key")
+
+    def __init__(self, title: str, columns: List[str], version, records: Callable[[], Iterable[Dict[str, Any]]],
+                 to_row: Callable[[Dict[str, Any]], List[Any]], key: Callable[[Dict[str, Any]], str]):
+        self.title = title
+        self.columns = columns
+        self.version = str(version)
+        # only called when the version moved since the last sync
+        self.records = records
+        self.to_row = to_row
+        self.key = key
+
+
+class SheetSync:
+    def __init__(self, spreadsheet, state_file: str, sleep: Callable[[float], None] = time.sleep):
+        self.spreadsheet = spreadsheet
+        self.state_file = state_file
+        self.sleep = sleep
+        lock_dir = os.path.join(os.path.dirname(os.path.abspath(state_file)), LOCK_DIR_NAME)
+        os.makedirs(lock_dir, exist_ok=True)
+        self.lock = FileLock(os.path.join(lock_dir, "sheets.lock"))
+
+    def run(self, sources: List[Source]) -> Optional[List[Dict[str, Any]]]:
+        # per-sheet stats, or None when another process is syncing right now
+        try:
+            self.lock.acquire(timeout=0)
+        except ConflictError:
+            return None
+        try:
+            state = load_json(self.state_file, {})
+            with metrics.timer("library_sheets_sync_seconds"):
+                return [self._sync(src, state) for src in sources]
+        finally:
+            self.lock.release()
+
+    def _save(self, state: Dict[str, Any]):
+        save_json(self.state_file, state)
+
+    def _worksheet(self, title: str, rows: int, cols: int):
+        existing = {ws.title: ws for ws in with_backoff(self.spreadsheet.worksheets, self.sleep)}
+        if title in existing:
+            return existing[title]
+        return with_backoff(lambda: self.spreadsheet.add_worksheet(title=title, rows=rows, cols=cols), self.sleep)
+
+    def _plan(self, src: Source, sheet: Dict[str, Any]) -> Dict[int, Tuple[str, List[Any], Optional[str]]]:
+        # row number -> (key, values, digest); a None digest blanks the row
+        blank = [""] * len(src.columns)
+        changes: Dict[int, Tuple[str, List[Any], Optional[str]]] = {}
+        rows = sheet['rows']
+        if sheet.get('columns') != src.columns:
+            # new sheet or new layout: everything is rewritten once, rows the
+            # old layout used beyond the new end are blanked
+            stale_end = sheet.get('high_water', 1) + 1
+            rows = sheet['rows'] = {}
+            sheet['columns'] = None
+            sheet['next_row'] = 2
+            changes[1] = ("", list(src.columns), "header")
+            for r in range(2, stale_end):
+                changes[r] = ("", blank, None)
+        seen = set()
+        for rec in src.records():
+            key = src.key(rec)
+            values = src.to_row(rec)
+            digest = _digest(values)
+            seen.add(key)
+            hit = rows.get(key)
+            if hit is not None and hit[1] == digest:
+                continue
+            if hit is None:
+                row = sheet['next_row']
+                sheet['next_row'] += 1
+            else:
+                row = hit[0]
+            changes[row] = (key, values, digest)
+        for key, (row, _) in rows.items():
+            if key not in seen:
+                changes[row] = (key, blank, None)
+        return changes
+
+    def _sync(self, src: Source, state: Dict[str, Any]) -> Dict[str, Any]:
+        sheet = state.setdefault(src.title, {"rows": {}, "next_row": 2})
+        stats = {"sheet": src.title, "skipped": False, "rows_written": 0, "rows_cleared": 0,
+                 "ranges": 0, "requests": 0, "cells": 0}
+        if sheet.get('version') == src.version and sheet.get('columns') == src.columns:
+            stats['skipped'] = True
+            return stats
+        changes = self._plan(src, sheet)
+        if changes:
+            ws = self._worksheet(src.title, max(changes) + 100, len(src.columns))
+            if ws.row_count < max(changes):
+                with_backoff(lambda: ws.add_rows(max(changes) - ws.row_count), self.sleep)
+            if ws.col_count < len(src.columns):
+                with_backoff(lambda: ws.add_cols(len(src.columns) - ws.col_count), self.sleep)
+            try:
+                for batch in self._batches(changes, len(src.columns)):
+                    self._push(ws, batch, changes, len(src.columns), stats)
+                    self._commit(sheet, batch, changes, src.columns, stats)
+                    self._save(state)
+            except Exception:
+                # hand back the rows planned for records that never got written
+                metrics.inc("library_sheets_failures_total", sheet=src.title)
+                sheet['next_row'] = max((r for r, _ in sheet['rows'].values()), default=1) + 1
+                self._save(state)
+                raise
+        sheet['version'] = src.version
+        sheet['columns'] = list(src.columns)
+        self._save(state)
+        return stats
+
+    def _batches(self, changes, width: int) -> Iterable[List[Tuple[int, int]]]:
+        # contiguous runs of changed rows, grouped into size-capped requests
+        runs: List[Tuple[int, int]] = []
+        for row in sorted(changes):
+            if runs and runs[-1][1] == row - 1:
+                runs[-1] = (runs[-1][0], row)
+            else:
+                runs.append((row, row))
+        batch: List[Tuple[int, int]] = []
+        cells = 0
+        for first, last in runs:
+            # split runs that alone exceed the cell cap
+            step = max(1, MAX_CELLS_PER_REQUEST // width)
+            for start in range(first, last + 1, step):
+                end = min(last, start + step - 1)
+                size = (end - start + 1) * width
+                if batch and (cells + size > MAX_CELLS_PER_REQUEST or len(batch) >= MAX_RANGES_PER_REQUEST):
+                    yield batch
+                    batch, cells = [], 0
+                batch.append((start, end))
+                cells += size
+        if batch:
+            yield batch
+
+    def _push(self, ws, batch: List[Tuple[int, int]], changes, width: int, stats: Dict[str, Any]):
+        last_col = column_letter(width)
+        data = [{"range": f"A{first}:{last_col}{last}",
+                 "values": [changes[r][1] for r in range(first, last + 1)]} for first, last in batch]
+        with_backoff(lambda: ws.batch_update(data, value_input_option="RAW"), self.sleep)
+        cells = sum(len(d['values']) * width for d in data)
+        stats['requests'] += 1
+        stats['ranges'] += len(data)
+        stats['cells'] += cells
+        metrics.inc("library_sheets_requests_total")
+        metrics.inc("library_sheets_cells_total", cells)
+
+    def _commit(self, sheet: Dict[str, Any], batch, changes, columns: List[str], stats: Dict[str, Any]):
+        rows = sheet['rows']
+        sheet['high_water'] = max(sheet.get('high_water', 1), batch[-1][1])
+        for first, last in batch:
+            for r in range(first, last + 1):
+                key, _, digest = changes[r]
+                if r == 1:
+                    sheet['columns'] = list(columns)
+                elif digest is None:
+                    if key:
+                        rows.pop(key, None)
+                    stats['rows_cleared'] += 1
+                else:
+                    rows[key] = [r, digest]
+                    stats['rows_written'] += 1
+
+
+# -------------------------
+# Spreadsheet clients
+# -------------------------
+_spreadsheets: Dict[Tuple[str, str], Any] = {}
+_spreadsheets_lock = threading.Lock()
+
+
+def open_spreadsheet(credentials_file: str, spreadsheet_key: str):
+    # the real client, authorized once per process
+    key = (os.path.abspath(credentials_file), spreadsheet_key)
+    with _spreadsheets_lock:
+        sheet = _spreadsheets.get(key)
+        if sheet is None:
+            import gspread
+            client = gspread.service_account(filename=credentials_file, scopes=SCOPES)
+            sheet = _spreadsheets[key] = client.open_by_key(spreadsheet_key)
+        return sheet
+
+
+class FakeAPIError(Exception):
+    # shaped like gspread.exceptions.APIError as far as retryable() looks
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.response = SimpleNamespace(status_code=status)
+
+
+_RANGE_RE = re.compile(r"^([A-Z]+)(\d+):([A-Z]+)(\d+)$")
+
+
+def _column_number(letters: str) -> int:
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet: "FakeSpreadsheet", title: str, rows: int, cols: int):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self.cells: Dict[Tuple[int, int], Any] = {}
+
+    def add_rows(self, n: int):
+        self.spreadsheet._call("add_rows")
+        self.row_count += n
+
+    def add_cols(self, n: int):
+        self.spreadsheet._call("add_cols")
+        self.col_count += n
+
+    def batch_update(self, data: List[Dict[str, Any]], value_input_option: str = "RAW"):
+        self.spreadsheet._call("batch_update", cells=sum(len(d['values']) * len(d['values'][0]) for d in data))
+        for d in data:
+            c1, r1, c2, r2 = _RANGE_RE.match(d['range']).groups()
+            r1, r2, c1, c2 = int(r1), int(r2), _column_number(c1), _column_number(c2)
+            if r2 > self.row_count or c2 > self.col_count:
+                raise FakeAPIError(400)
+            for r, values in zip(range(r1, r2 + 1), d['values']):
+                for c, v in zip(range(c1, c2 + 1), values):
+                    self.cells[(r, c)] = v
+
+    def get_all_values(self) -> List[List[Any]]:
+        if not self.cells:
+            return []
+        height = max(r for r, _ in self.cells)
+        width = max(c for _, c in self.cells)
+        rows = [[self.cells.get((r, c), "") for c in range(1, width + 1)] for r in range(1, height + 1)]
+        while rows and all(v == "" for v in rows[-1]):
+            rows.pop()
+        return rows
+
+
+class FakeSpreadsheet:
+    # in-memory stand-in for a gspread Spreadsheet; counts calls and can be
+    # told to fail the next few of them
+    def __init__(self):
+        self.sheets: Dict[str, FakeWorksheet] = {}
+        self.calls: Dict[str, int] = {}
+        self.cells_written = 0
+        self.failures: List[int] = []
+
+    def fail_next(self, *statuses: int):
+        self.failures.extend(statuses)
+
+    def _call(self, name: str, cells: int = 0):
+        if self.failures:
+            raise FakeAPIError(self.failures.pop(0))
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.cells_written += cells
+
+    def worksheets(self) -> List[FakeWorksheet]:
+        self._call("worksheets")
+        return list(self.sheets.values())
+
+    def add_worksheet(self, title: str, rows: int, cols: int) -> FakeWorksheet:
+        self._call("add_worksheet")
+        ws = self.sheets[title] = FakeWorksheet(self, title, rows, cols)
+        return ws
+
+
+metrics.describe("library_sheets_sync_seconds", "histogram", "Google Sheets sync run time")
+metrics.describe("library_sheets_requests_total", "counter", "Sheets batch_update requests sent")
+metrics.describe("library_sheets_cells_total", "counter", "Cells written to Sheets")
+metrics.describe("library_sheets_retries_total", "counter", "Sheets calls retried after a transient error")
+metrics.describe("library_sheets_failures_total", "counter", "Sheets syncs that gave up")
@@ -0,0 +1,1384 @@
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import journal
+import metrics
+from locks import DEFAULT_TIMEOUT, ConflictError, FileLock
+
+# -------------------------
+# Safe JSON helpers
+# -------------------------
+def backup_corrupt_file(path: str):
+    try:
+        ts = int(time.time())
+        bak = f"{path}.corrupt.{ts}"
+        shutil.copy(path, bak)
+    except Exception:
+        pass
+
+def save_json(path: str, data: Any):
+    # write-then-rename so readers in other processes never see a half-written
+    # file, and every save gets a fresh inode for the cache signature
+    name = os.path.basename(path)
+    metrics.inc("library_json_saves_total", file=name)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with metrics.timer("library_json_save_seconds", file=name):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            size = f.tell()
+        os.replace(tmp, path)
+    metrics.set_gauge("library_file_bytes", size, file=name)
+
+def load_json(path: str, default):
+    name = os.path.basename(path)
+    metrics.inc("library_json_loads_total", file=name)
+    with metrics.timer("library_json_load_seconds", file=name):
+        data = _read_json(path, default)
+    if metrics.ENABLED and os.path.exists(path):
+        metrics.set_gauge("library_file_bytes", os.path.getsize(path), file=name)
+    return data
+
+def _read_json(path: str, default):
+    if not os.path.exists(path):
+        save_json(path, default)
+        return default
+    try:
+        if os.path.getsize(path) == 0:
+            save_json(path, default)
+            return default
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        backup_corrupt_file(path)
+        save_json(path, default)
+        return default
+    except Exception:
+        return default
+
+# -------------------------
+# In-process data cache
+# -------------------------
+# Parsed JSON documents are kept in memory per file path and only re-read when
+# the file's (inode, mtime, size) signature changes, i.e. another process wrote it.
+# Writes made by this process go through remember() so the cache never has to
+# re-parse what it just serialized. Streamlit re-executes app.py on every
+# rerun, so this state lives in an imported module to survive across reruns.
+
+_lock = threading.RLock()
+_entries: Dict[str, "_Entry"] = {}
+
+
+class _Entry:
+    __slots__ = ("signature", "data", "version", "indexes")
+
+    def __init__(self, signature, data, version):
+        self.signature = signature
+        self.data = data
+        self.version = version
+        self.indexes = {}
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _store(path: str, data: Any) -> _Entry:
+    old = _entries.get(path)
+    entry = _Entry(file_signature(path), data, (old.version + 1) if old else 1)
+    _entries[path] = entry
+    return entry
+
+
+def _current(path: str, loader: Callable[[], Any]) -> _Entry:
+    sig = file_signature(path)
+    with _lock:
+        entry = _entries.get(path)
+        if entry is not None and sig is not None and entry.signature == sig:
+            metrics.inc("library_cache_hits_total", file=os.path.basename(path))
+            return entry
+        metrics.inc("library_cache_misses_total", file=os.path.basename(path))
+        return _store(path, loader())
+
+
+def cached_load(path: str, loader: Callable[[], Any]) -> Any:
+    return _current(path, loader).data
+
+
+_ensured = set()
+
+
+def ensure_files(defaults: Dict[str, Any]):
+    # creates missing data files from their defaults (and sets corrupt ones
+    # aside) the first time this process asks for each path; the parse goes
+    # into the cache the JSON backends read from, so it is not wasted either
+    for path, default in defaults.items():
+        key = os.path.abspath(path)
+        with _lock:
+            if key in _ensured:
+                continue
+            cached_load(path, lambda: load_json(path, default))
+            _ensured.add(key)
+
+
+def remember(path: str, data: Any):
+    # called right after this process wrote `data` to `path`
+    with _lock:
+        _store(path, data)
+
+
+def invalidate(path: Optional[str] = None):
+    with _lock:
+        if path is None:
+            _entries.clear()
+        else:
+            _entries.pop(path, None)
+
+
+def index(path: str, name: str, loader: Callable[[], Any], build: Callable[[Any], Any]) -> Any:
+    # Derived lookup tables are memoized per data version and dropped
+    # automatically whenever the underlying document changes.
+    entry = _current(path, loader)
+    with _lock:
+        idx = entry.indexes.get(name)
+        if idx is None:
+            idx = build(entry.data)
+            entry.indexes[name] = idx
+        return idx
+
+
+def _books_by_id(books):
+    return {b['id']: b for b in books}
+
+def _max_book_id(books):
+    return max((b['id'] for b in books), default=0)
+
+def _assign_ids(new_books, first_id: int) -> List[int]:
+    ids = list(range(first_id, first_id + len(new_books)))
+    for book, book_id in zip(new_books, ids):
+        book['id'] = book_id
+    return ids
+
+def _users_by_email(users):
+    return {u['email'].lower(): u for u in users}
+
+def _active_by_user(issued):
+    idx = {}
+    for r in issued:
+        if not r.get('returned', False):
+            idx.setdefault(r['user_email'].lower(), []).append(r)
+    return idx
+
+def _active_loans(issued):
+    return [r for r in issued if not r.get('returned', False)]
+
+def _loans_by_user(issued):
+    idx = {}
+    for r in issued:
+        idx.setdefault(r['user_email'].lower(), []).append(r)
+    return idx
+
+def _active_by_key(issued):
+    return {(r['user_email'].lower(), r['book_id']): r for r in issued if not r.get('returned', False)}
+
+def _max_loan_id(issued):
+    return max((r.get(LOAN_ID, 0) for r in issued), default=0)
+
+def archive_filter(loans, since: Optional[str] = None, until: Optional[str] = None,
+                   user_email: Optional[str] = None, book_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    # since/until are inclusive issue months ("YYYY-MM"; full dates are cut down)
+    since = since[:7] if since else None
+    until = until[:7] if until else None
+    user_email = user_email.lower() if user_email else None
+    return [r for r in loans
+            if (since is None or r['issue_date'][:7] >= since)
+            and (until is None or r['issue_date'][:7] <= until)
+            and (user_email is None or r['user_email'].lower() == user_email)
+            and (book_id is None or r['book_id'] == book_id)]
+
+def normalize_genres(value) -> List[str]:
+    # books_data.json stores a single genre string, newer records store a list
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+# -------------------------
+# Storage interface
+# -------------------------
+# app.py's get_*/save_* helpers delegate to one of these backends. Besides the
+# whole-document reads/writes every backend answers keyed lookups and performs
+# issue/return as a single transaction:
+#   issue()       -> ("ok" | "not_found" | "unavailable", book or None)
+#   return_book() -> copy of the loan record as it was before returning, or None
+#   add_books()   -> appends new books, assigning ids from the store's counter
+#   archived_loans() -> returned loans, filtered by issue month / user / book
+#   issue_many() / return_many() -> a desk batch of (user, book) pairs, all
+#                    validated against one snapshot and applied with one write
+#                    per store; per-item (status, record) results
+# catalog_version() changes whenever the set of books or their text may have
+# changed, so derived structures (search indexes etc.) know when to resync.
+# books_version() also changes on every availability change and is the same in
+# every process sharing the data, so it can back HTTP ETags. loans_version()
+# is the same thing for the loan records.
+class Storage:
+    def books(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save_books(self, data: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def add_books(self, new_books: List[Dict[str, Any]]) -> List[int]:
+        raise NotImplementedError
+
+    def users(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save_users(self, data: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def issued(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save_issued(self, data: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def catalog_version(self):
+        raise NotImplementedError
+
+    def books_version(self) -> str:
+        raise NotImplementedError
+
+    def loans_version(self) -> str:
+        raise NotImplementedError
+
+    def get_book(self, book_id: int) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def with_details(self, book: Dict[str, Any]) -> Dict[str, Any]:
+        # books()/get_book() may leave out heavy fields (see CompactStorage);
+        # this returns the full record for detail views and text indexing
+        return book
+
+    def get_user(self, email: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save_user(self, user: Dict[str, Any]):
+        raise NotImplementedError
+
+    def active_issues(self, user_email: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def user_loans(self, user_email: str) -> List[Dict[str, Any]]:
+        # full borrowing history, returned loans included
+        raise NotImplementedError
+
+    def active_loans(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def archived_loans(self, since: Optional[str] = None, until: Optional[str] = None,
+                       user_email: Optional[str] = None, book_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def archive_months(self) -> List[str]:
+        raise NotImplementedError
+
+    def issue(self, user_email: str, book_id: int, issue_date: str, due_date: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        raise NotImplementedError
+
+    def return_book(self, user_email: str, book_id: int, return_date: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def issue_many(self, items: List[Tuple[str, int]], issue_date: str, due_date: str,
+                   all_or_nothing: bool = False) -> List[Tuple[str, Optional[Dict[str, Any]]]]:
+        raise NotImplementedError
+
+    def return_many(self, items: List[Tuple[str, int]], return_date: str,
+                    all_or_nothing: bool = False) -> List[Tuple[str, Optional[Dict[str, Any]]]]:
+        raise NotImplementedError
+
+
+# -------------------------
+# Batch circulation
+# -------------------------
+# Statuses per item: "ok", "not_found", "unavailable" (issue only) and
+# "aborted" (valid, but not applied because another item of an all-or-nothing
+# batch failed). A book asked for twice in one batch goes to the first item.
+def plan_issues(items: List[Tuple[str, int]], get_book: Callable[[int], Optional[Dict[str, Any]]]):
+    taken = set()
+    results = []
+    for _, book_id in items:
+        book = get_book(book_id)
+        if not book:
+            results.append(("not_found", None))
+        elif not book.get('available', True) or book_id in taken:
+            results.append(("unavailable", book))
+        else:
+            taken.add(book_id)
+            results.append(("ok", book))
+    return results
+
+
+def plan_returns(items: List[Tuple[str, int]], find_active: Callable[[str, int], Optional[Dict[str, Any]]]):
+    seen = set()
+    results = []
+    for user_email, book_id in items:
+        key = (user_email.lower(), book_id)
+        rec = None if key in seen else find_active(*key)
+        if rec is None:
+            results.append(("not_found", None))
+        else:
+            seen.add(key)
+            results.append(("ok", rec))
+    return results
+
+
+def settle_batch(results, all_or_nothing: bool):
+    if all_or_nothing and any(status != "ok" for status, _ in results):
+        return [("aborted" if status == "ok" else status, rec) for status, rec in results]
+    return results
+
+
+# -------------------------
+# Loan archive
+# -------------------------
+# The JSON backend keeps only open loans in the issued file, so everything a
+# page or a checkout touches is bounded by what is on loan right now. A loan
+# is archived when it is returned: appended (fsync'd) as a JSON line to the
+# partition for its issue month, loans-YYYY-MM.jsonl. The full history is
+# assembled only for the callers that want it (issued(), exports, co-borrow
+# counts). Loans carry a LOAN_ID assigned at issue so that history keeps a
+# stable, append-only order however loans move between the two places.
+LOAN_ID = "loan_id"
+ARCHIVE_PREFIX = "loans-"
+
+
+def default_archive_dir(issued_file: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(issued_file)), "loan_archive")
+
+
+def _read_jsonl(path: str) -> List[Dict[str, Any]]:
+    metrics.inc("library_json_loads_total", file="loan_archive")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+class LoanArchive:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, month: str) -> str:
+        return os.path.join(self.directory, f"{ARCHIVE_PREFIX}{month}.jsonl")
+
+    def months(self) -> List[str]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(n[len(ARCHIVE_PREFIX):-len(".jsonl")] for n in names
+                      if n.startswith(ARCHIVE_PREFIX) and n.endswith(".jsonl"))
+
+    def signature(self) -> tuple:
+        return tuple((m, file_signature(self.path(m))) for m in self.months())
+
+    def read(self, month: str) -> List[Dict[str, Any]]:
+        path = self.path(month)
+        return cached_load(path, lambda: _read_jsonl(path))
+
+    def append(self, records: List[Dict[str, Any]]):
+        # caller holds the store lock
+        os.makedirs(self.directory, exist_ok=True)
+        by_month: Dict[str, List[Dict[str, Any]]] = {}
+        for r in records:
+            by_month.setdefault(r['issue_date'][:7], []).append(r)
+        for month, recs in by_month.items():
+            path = self.path(month)
+            data = self.read(month)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in recs))
+                f.flush()
+                os.fsync(f.fileno())
+            data.extend(recs)
+            remember(path, data)
+
+    def rewrite(self, records: List[Dict[str, Any]]):
+        # replaces the whole archive (save_issued with a full history)
+        os.makedirs(self.directory, exist_ok=True)
+        by_month: Dict[str, List[Dict[str, Any]]] = {}
+        for r in records:
+            by_month.setdefault(r['issue_date'][:7], []).append(r)
+        for month in self.months():
+            if month not in by_month:
+                os.remove(self.path(month))
+                invalidate(self.path(month))
+        for month, recs in by_month.items():
+            path = self.path(month)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in recs))
+            os.replace(tmp, path)
+            remember(path, recs)
+
+    def max_id(self) -> int:
+        # ids grow with issue time, so the newest partition holds the highest
+        # archived id
+        months = self.months()
+        return _max_loan_id(self.read(months[-1])) if months else 0
+
+    def query(self, since: Optional[str] = None, until: Optional[str] = None,
+              user_email: Optional[str] = None, book_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        out = []
+        for month in self.months():
+            if (since and month < since[:7]) or (until and month > until[:7]):
+                continue
+            out.extend(archive_filter(self.read(month), user_email=user_email, book_id=book_id))
+        return out
+
+
+def read_loan_history(issued_file: str, archive_dir: Optional[str]) -> List[Dict[str, Any]]:
+    # open + archived loans in issue order, for seeding other backends
+    issued = load_json(issued_file, [])
+    archive = LoanArchive(archive_dir) if archive_dir else None
+    if not archive or not archive.months():
+        return issued
+    archived = [r for m in archive.months() for r in archive.read(m)]
+    return sorted(archived + issued, key=lambda r: r.get(LOAN_ID, 0))
+
+
+LOCK_DIR_NAME = ".library_locks"
+
+
+class JsonStorage(Storage):
+    # Writers take file locks so several Streamlit sessions and API worker
+    # processes can share the files. Every issue/return rewrites whole files,
+    # so they are serialized on the one store lock around the re-read +
+    # rewrite, across books and processes alike; use the SQLite backend for
+    # circulation that runs in parallel.
+    # The issued file holds open loans only; returned ones go to the archive.
+    def __init__(self, books_file: str, users_file: str, issued_file: str, archive_dir: Optional[str] = None):
+        self.books_file = books_file
+        self.users_file = users_file
+        self.issued_file = issued_file
+        lock_dir = os.path.join(os.path.dirname(os.path.abspath(books_file)), LOCK_DIR_NAME)
+        os.makedirs(lock_dir, exist_ok=True)
+        self.store_lock = FileLock(os.path.join(lock_dir, "store.lock"))
+        self.users_lock = FileLock(os.path.join(lock_dir, "users.lock"))
+        # catalog counter plus the books-file signature it was last valid for
+        self.catalog_stamp_file = os.path.join(lock_dir, os.path.basename(books_file) + ".catalog")
+        self.archive = LoanArchive(archive_dir or default_archive_dir(issued_file))
+        self._history = (None, [], {})
+        self._partition_loans()
+
+    def _partition_loans(self):
+        # one-time move of returned loans out of an issued file that still holds
+        # the full history (and ids for loans written before there were any);
+        # also drops open copies of loans a crashed return already archived
+        issued = self._load(self.issued_file)
+        months = {r['issue_date'][:7] for r in issued}
+        archived = {r.get(LOAN_ID) for m in months for r in self.archive.read(m)}
+        if all(LOAN_ID in r and not r.get('returned', False) and r[LOAN_ID] not in archived for r in issued):
+            return
+        with self.store_lock:
+            self._write_loans([r for r in self._load(self.issued_file)
+                               if LOAN_ID not in r or r[LOAN_ID] not in archived])
+
+    def _write_loans(self, data, rewrite_archive: bool = False):
+        # caller holds the store lock
+        next_id = max(_max_loan_id(data), self.archive.max_id()) + 1
+        for r in sorted((r for r in data if LOAN_ID not in r), key=lambda r: r['issue_date']):
+            r[LOAN_ID] = next_id
+            next_id += 1
+        returned = [r for r in data if r.get('returned', False)]
+        if rewrite_archive:
+            self.archive.rewrite(returned)
+        elif returned:
+            self.archive.append(returned)
+        self._save(self.issued_file, [r for r in data if not r.get('returned', False)])
+
+    def _load(self, path: str):
+        return cached_load(path, lambda: load_json(path, []))
+
+    def _save(self, path: str, data):
+        save_json(path, data)
+        remember(path, data)
+
+    def _index(self, path: str, name: str, build):
+        return index(path, name, lambda: load_json(path, []), build)
+
+    def books(self):
+        return self._load(self.books_file)
+
+    def save_books(self, data):
+        with self.store_lock:
+            self._save_books(data, catalog_changed=True)
+
+    def _save_books(self, data, catalog_changed: bool):
+        # caller holds the store lock. Availability-only saves (issue/return)
+        # keep the catalog counter, unless the file changed under us since
+        # the last stamped save (hand edits, a crash before the stamp)
+        stamp = self._catalog_stamp()
+        sig = file_signature(self.books_file)
+        same = not catalog_changed and stamp.get('sig') == (list(sig) if sig else None)
+        self._save(self.books_file, data)
+        stamp = {"counter": stamp.get('counter', 0) + (0 if same else 1),
+                 "sig": list(file_signature(self.books_file))}
+        save_json(self.catalog_stamp_file, stamp)
+        remember(self.catalog_stamp_file, stamp)
+
+    def _catalog_stamp(self) -> Dict[str, Any]:
+        def read():
+            try:
+                with open(self.catalog_stamp_file, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (FileNotFoundError, ValueError):
+                return {}
+        return cached_load(self.catalog_stamp_file, read)
+
+    def add_books(self, new_books):
+        with self.store_lock:
+            books = self.books()
+            ids = _assign_ids(new_books, self._index(self.books_file, "max_id", _max_book_id) + 1)
+            books.extend(new_books)
+            self._save_books(books, catalog_changed=True)
+            return ids
+
+    def users(self):
+        return self._load(self.users_file)
+
+    def save_users(self, data):
+        with self.users_lock:
+            self._save(self.users_file, data)
+
+    def _active(self):
+        return self._load(self.issued_file)
+
+    def _loan_history(self):
+        # (version, history in issue order, history by user), rebuilt lazily
+        key = (file_signature(self.issued_file), self.archive.signature())
+        history = self._history
+        if history[0] != key:
+            loans = sorted([r for m in self.archive.months() for r in self.archive.read(m)] + self._active(),
+                           key=lambda r: r.get(LOAN_ID, 0))
+            history = self._history = (key, loans, _loans_by_user(loans))
+        return history
+
+    def issued(self):
+        return self._loan_history()[1]
+
+    def save_issued(self, data):
+        with self.store_lock:
+            self._write_loans(data, rewrite_archive=True)
+
+    def catalog_version(self):
+        # moves when books are added, edited or deleted, not on issue/return
+        stamp = self._catalog_stamp()
+        sig = file_signature(self.books_file)
+        if sig and stamp.get('sig') == list(sig):
+            return f"c{stamp['counter']}"
+        return f"f{self.books_version()}"
+
+    def books_version(self):
+        sig = file_signature(self.books_file)
+        return "-".join(str(x) for x in sig) if sig else "0"
+
+    def loans_version(self):
+        sig = file_signature(self.issued_file)
+        return "-".join(str(x) for x in sig) if sig else "0"
+
+    def get_book(self, book_id):
+        return self._index(self.books_file, "by_id", _books_by_id).get(book_id)
+
+    def get_user(self, email):
+        return self._index(self.users_file, "by_email", _users_by_email).get(email.strip().lower())
+
+    def save_user(self, user):
+        with self.users_lock:
+            users = self.users()
+            existing = self.get_user(user['email'])
+            if existing is None:
+                users.append(user)
+            elif existing is not user:
+                users[users.index(existing)] = user
+            self.save_users(users)
+
+    def active_issues(self, user_email):
+        return list(self._index(self.issued_file, "active_by_user", _active_by_user).get(user_email.lower(), []))
+
+    def user_loans(self, user_email):
+        return list(self._loan_history()[2].get(user_email.lower(), []))
+
+    def active_loans(self):
+        return list(self._index(self.issued_file, "active", _active_loans))
+
+    def archived_loans(self, since=None, until=None, user_email=None, book_id=None):
+        return self.archive.query(since, until, user_email, book_id)
+
+    def archive_months(self):
+        return self.archive.months()
+
+    def issue(self, user_email, book_id, issue_date, due_date):
+        with self.store_lock:
+            # re-read under the lock: the cache reloads if another process wrote
+            books = self.books()
+            issued = self._active()
+            book = self.get_book(book_id)
+            if not book:
+                return "not_found", None
+            if not book.get('available', True):
+                return "unavailable", book
+
+            # set availability + who holds it (optional)
+            book['available'] = False
+            book['issued_to'] = user_email
+            self._save_books(books, catalog_changed=False)
+            next_id = max(self._index(self.issued_file, "max_loan_id", _max_loan_id), self.archive.max_id()) + 1
+            issued.append({
+                "user_email": user_email,
+                "book_id": book_id,
+                "issue_date": issue_date,
+                "due_date": due_date,
+                "returned": False,
+                "return_date": None,
+                LOAN_ID: next_id
+            })
+            self._save(self.issued_file, issued)
+            return "ok", book
+
+    def return_book(self, user_email, book_id, return_date):
+        with self.store_lock:
+            books = self.books()
+            issued = self._active()
+            rec = self._index(self.issued_file, "active_by_key", _active_by_key).get((user_email.lower(), book_id))
+            if not rec:
+                return None
+            before = dict(rec)
+            # archive first: a crash in between leaves the loan in both places,
+            # never in neither (_partition_loans drops the open copy on start)
+            self.archive.append([dict(rec, returned=True, return_date=return_date)])
+            self._save(self.issued_file, [r for r in issued if r is not rec])
+            book = self.get_book(book_id)
+            if book:
+                book['available'] = True
+                book.pop('issued_to', None)
+            self._save_books(books, catalog_changed=False)
+            return before
+
+    def issue_many(self, items, issue_date, due_date, all_or_nothing=False):
+        with self.store_lock:
+            books = self.books()
+            issued = self._active()
+            results = settle_batch(plan_issues(items, self.get_book), all_or_nothing)
+            todo = [(email, book) for (email, _), (status, book) in zip(items, results) if status == "ok"]
+            if not todo:
+                return results
+            next_id = max(self._index(self.issued_file, "max_loan_id", _max_loan_id), self.archive.max_id()) + 1
+            for email, book in todo:
+                book['available'] = False
+                book['issued_to'] = email
+                issued.append({
+                    "user_email": email,
+                    "book_id": book['id'],
+                    "issue_date": issue_date,
+                    "due_date": due_date,
+                    "returned": False,
+                    "return_date": None,
+                    LOAN_ID: next_id
+                })
+                next_id += 1
+            self._save_books(books, catalog_changed=False)
+            self._save(self.issued_file, issued)
+            return results
+
+    def return_many(self, items, return_date, all_or_nothing=False):
+        with self.store_lock:
+            books = self.books()
+            issued = self._active()
+            by_key = self._index(self.issued_file, "active_by_key", _active_by_key)
+            results = settle_batch(plan_returns(items, lambda *key: by_key.get(key)), all_or_nothing)
+            done = [rec for status, rec in results if status == "ok"]
+            if not done:
+                return results
+            # same order as return_book: archive, open loans, then books
+            self.archive.append([dict(rec, returned=True, return_date=return_date) for rec in done])
+            gone = {id(rec) for rec in done}
+            self._save(self.issued_file, [r for r in issued if id(r) not in gone])
+            for rec in done:
+                book = self.get_book(rec['book_id'])
+                if book:
+                    book['available'] = True
+                    book.pop('issued_to', None)
+            self._save_books(books, catalog_changed=False)
+            return [(status, dict(rec) if status == "ok" else rec) for status, rec in results]
+
+
+class JournalStorage(JsonStorage):
+    # books + loans live in journal.Journal; users stay in their JSON file.
+    # Reads go through _read() so they see what other processes appended
+    def __init__(self, books_file: str, users_file: str, issued_file: str, directory: str,
+                 snapshot_every: int = journal.DEFAULT_SNAPSHOT_EVERY, archive_dir: Optional[str] = None):
+        super().__init__(books_file, users_file, issued_file, archive_dir)
+        seed = lambda: {"books": load_json(books_file, []),
+                        "issued": read_loan_history(issued_file, self.archive.directory)}
+        self.journal = journal.get_journal(directory, seed, snapshot_every)
+        self.lock = self.journal.lock
+
+    def _read(self) -> journal.Journal:
+        self.journal.refresh()
+        return self.journal
+
+    def books(self):
+        return self._read().books
+
+    def save_books(self, data):
+        self.journal.append({"op": "books", "books": data})
+
+    def add_books(self, new_books):
+        with self.lock:
+            ids = _assign_ids(new_books, self.journal.max_id + 1)
+            self.journal.append({"op": "add_books", "books": new_books})
+            return ids
+
+    def _partition_loans(self):
+        # loans live in the journal, which keeps its own per-user indexes
+        pass
+
+    def issued(self):
+        return self._read().issued
+
+    def save_issued(self, data):
+        self.journal.append({"op": "issued", "issued": data})
+
+    def archived_loans(self, since=None, until=None, user_email=None, book_id=None):
+        returned = [r for r in self._read().issued if r.get('returned', False)]
+        return archive_filter(returned, since, until, user_email, book_id)
+
+    def archive_months(self):
+        return sorted({r['issue_date'][:7] for r in self._read().issued if r.get('returned', False)})
+
+    def catalog_version(self):
+        return self._read().catalog_version
+
+    def books_version(self):
+        return str(self._read().seq)
+
+    def loans_version(self):
+        return str(self._read().seq)
+
+    def get_book(self, book_id):
+        return self._read().get_book(book_id)
+
+    def active_issues(self, user_email):
+        return self._read().active_for_user(user_email)
+
+    def user_loans(self, user_email):
+        return self._read().loans_for_user(user_email)
+
+    def active_loans(self):
+        return self._read().active_loans()
+
+    def issue(self, user_email, book_id, issue_date, due_date):
+        with self.lock:
+            book = self.journal.get_book(book_id)
+            if not book:
+                return "not_found", None
+            if not book.get('available', True):
+                return "unavailable", book
+            self.journal.append({
+                "op": "issue",
+                "user_email": user_email,
+                "book_id": book_id,
+                "issue_date": issue_date,
+                "due_date": due_date
+            })
+            return "ok", book
+
+    def return_book(self, user_email, book_id, return_date):
+        with self.lock:
+            rec = next((r for r in self.journal.active_for_user(user_email) if r['book_id'] == book_id), None)
+            if not rec:
+                return None
+            before = dict(rec)
+            self.journal.append({
+                "op": "return",
+                "user_email": user_email,
+                "book_id": book_id,
+                "return_date": return_date
+            })
+            return before
+
+    def _find_active(self, user_email, book_id):
+        return next((r for r in self.journal.active_for_user(user_email) if r['book_id'] == book_id), None)
+
+    def issue_many(self, items, issue_date, due_date, all_or_nothing=False):
+        with self.lock:
+            results = settle_batch(plan_issues(items, self.journal.get_book), all_or_nothing)
+            ops = [{"op": "issue", "user_email": email, "book_id": book_id, "issue_date": issue_date,
+                    "due_date": due_date}
+                   for (email, book_id), (status, _) in zip(items, results) if status == "ok"]
+            if ops:
+                # one fsync'd record: the batch replays whole or not at all
+                self.journal.append({"op": "batch", "ops": ops})
+            return results
+
+    def return_many(self, items, return_date, all_or_nothing=False):
+        with self.lock:
+            results = settle_batch(plan_returns(items, self._find_active), all_or_nothing)
+            results = [(status, dict(rec) if status == "ok" else rec) for status, rec in results]
+            ops = [{"op": "return", "user_email": email, "book_id": book_id, "return_date": return_date}
+                   for (email, book_id), (status, _) in zip(items, results) if status == "ok"]
+            if ops:
+                self.journal.append({"op": "batch", "ops": ops})
+            return results
+
+# -------------------------
+# Compact catalog
+# -------------------------
+# The hot catalog file keeps only what lists, search and circulation need, as
+# compact JSON with one record per line. Descriptions and chapter indexes are
+# appended as JSON lines to a details file and located through the
+# [offset, length] in each hot record's DETAILS_REF. They are read through an
+# mmap only when a detail view (or the text indexer) asks for them. Rewriting
+# a book's details appends a new line; convert_to_compact() writes a fresh
+# details file without the dead ones.
+HEAVY_FIELDS = ("description", "index")
+DETAILS_REF = "_details"
+SUMMARY_CHARS = 160
+
+
+def save_compact_json(path: str, data: List[Dict[str, Any]]):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        f.write(",\n".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) for r in data))
+        f.write("\n]\n")
+    os.replace(tmp, path)
+
+
+def _summary(description: str) -> str:
+    description = description or ""
+    return description if len(description) <= SUMMARY_CHARS else description[:SUMMARY_CHARS].rstrip() + "…"
+
+
+class DetailsFile:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mm = None
+        self._sig = None
+
+    def append(self, records: List[Dict[str, Any]]) -> List[List[int]]:
+        refs = []
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            for rec in records:
+                line = json.dumps(rec, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                f.write(line + b"\n")
+                refs.append([offset, len(line)])
+                offset += len(line) + 1
+            f.flush()
+            os.fsync(f.fileno())
+        return refs
+
+    def _remap(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._sig = file_signature(self.path)
+        if self._sig and self._sig[2] > 0:
+            with open(self.path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, ref) -> Dict[str, Any]:
+        offset, length = ref
+        with self._lock:
+            # remap when the file grew past the mapping or was replaced
+            sig = file_signature(self.path)
+            if self._mm is None or sig != self._sig:
+                self._remap()
+            if self._mm is None or offset + length > len(self._mm):
+                return {}
+            return json.loads(self._mm[offset:offset + length])
+
+
+class CompactStorage(JsonStorage):
+    def __init__(self, hot_file: str, details_file: str, users_file: str, issued_file: str,
+                 archive_dir: Optional[str] = None):
+        super().__init__(hot_file, users_file, issued_file, archive_dir)
+        self.details = DetailsFile(details_file)
+
+    def _save(self, path: str, data):
+        if path != self.books_file:
+            return super()._save(path, data)
+        # records that carry heavy fields (new or edited books) move them out
+        fresh = [b for b in data if any(f in b for f in HEAVY_FIELDS)]
+        if fresh:
+            for b in fresh:
+                if 'description' in b:
+                    b['summary'] = _summary(b['description'])
+            refs = self.details.append([{f: b.pop(f) for f in HEAVY_FIELDS if f in b} for b in fresh])
+            for b, ref in zip(fresh, refs):
+                b[DETAILS_REF] = ref
+        save_compact_json(path, data)
+        remember(path, data)
+
+    def with_details(self, book):
+        ref = book.get(DETAILS_REF)
+        if not ref:
+            return book
+        full = {k: v for k, v in book.items() if k not in (DETAILS_REF, 'summary')}
+        full.update(self.details.read(ref))
+        return full
+
+
+def convert_to_compact(books_file: str, hot_file: str, details_file: str) -> int:
+    # also used to compact an existing details file: pass the hot file as books_file
+    books = load_json(books_file, [])
+    old = DetailsFile(details_file) if os.path.exists(details_file) else None
+    tmp = f"{details_file}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    out = DetailsFile(tmp)
+    heavy = []
+    for b in books:
+        rec = dict(old.read(b[DETAILS_REF])) if old and b.get(DETAILS_REF) else {}
+        rec.update({f: b.pop(f) for f in HEAVY_FIELDS if f in b})
+        b.pop(DETAILS_REF, None)
+        b['summary'] = b.get('summary') or _summary(rec.get('description', ''))
+        heavy.append(rec)
+    for b, ref in zip(books, out.append(heavy)):
+        b[DETAILS_REF] = ref
+    os.replace(tmp, details_file)
+    save_compact_json(hot_file, books)
+    return len(books)
+
+# -------------------------
+# SQLite backend
+# -------------------------
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL DEFAULT '',
+    author TEXT NOT NULL DEFAULT '',
+    available INTEGER NOT NULL DEFAULT 1,
+    issued_to TEXT,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('catalog_version', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('books_version', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('loans_version', 0);
+CREATE TABLE IF NOT EXISTS book_genres (
+    book_id INTEGER NOT NULL,
+    genre TEXT NOT NULL,
+    PRIMARY KEY (book_id, genre)
+);
+CREATE INDEX IF NOT EXISTS idx_book_genres_genre ON book_genres(genre);
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS loans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_email TEXT NOT NULL,
+    book_id INTEGER NOT NULL,
+    issue_date TEXT NOT NULL,
+    due_date TEXT NOT NULL,
+    returned INTEGER NOT NULL DEFAULT 0,
+    return_date TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_loans_user_returned ON loans(user_email, returned);
+CREATE INDEX IF NOT EXISTS idx_loans_book_returned ON loans(book_id, returned);
+CREATE INDEX IF NOT EXISTS idx_loans_active_due ON loans(due_date) WHERE returned = 0;
+CREATE INDEX IF NOT EXISTS idx_loans_archive ON loans(issue_date) WHERE returned = 1;
+"""
+
+_LOAN_COLUMNS = "user_email, book_id, issue_date, due_date, returned, return_date"
+
+
+def _loan_row(row) -> Dict[str, Any]:
+    return {
+        "user_email": row[0],
+        "book_id": row[1],
+        "issue_date": row[2],
+        "due_date": row[3],
+        "returned": bool(row[4]),
+        "return_date": row[5]
+    }
+
+
+def _book_row(doc: str, available: int, issued_to: Optional[str]) -> Dict[str, Any]:
+    # the indexed columns are authoritative for circulation state
+    book = json.loads(doc)
+    book['available'] = bool(available)
+    if issued_to:
+        book['issued_to'] = issued_to
+    else:
+        book.pop('issued_to', None)
+    return book
+
+
+def _book_params(b: Dict[str, Any]):
+    doc = dict(b)
+    doc['genre'] = normalize_genres(doc.get('genre'))
+    doc.pop('issued_to', None)
+    return (b['id'], b.get('title', ''), b.get('author', ''), 1 if b.get('available', True) else 0,
+            b.get('issued_to'), json.dumps(doc, ensure_ascii=False))
+
+
+class SqliteStorage(Storage):
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._writes = 0
+        self._conn().executescript(SQLITE_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=DEFAULT_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.cache = {}
+        return conn
+
+    @contextmanager
+    def _tx(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so concurrent
+        # issue/return calls from other threads or processes serialize here
+        conn = self._conn()
+        metrics.inc("library_sqlite_tx_total")
+        with metrics.timer("library_sqlite_tx_seconds"):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                # busy timeout expired while another writer held the database
+                raise ConflictError(str(e)) from e
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        self._writes += 1
+
+    def _cached(self, name: str, load: Callable[[sqlite3.Connection], Any]):
+        # whole-table reads are cached per thread until this process writes or
+        # another connection commits (PRAGMA data_version changes)
+        conn = self._conn()
+        key = (conn.execute("PRAGMA data_version").fetchone()[0], self._writes)
+        hit = self._local.cache.get(name)
+        if hit is not None and hit[0] == key:
+            return hit[1]
+        data = load(conn)
+        self._local.cache[name] = (key, data)
+        return data
+
+    # ---------- books ----------
+    def books(self):
+        return self._cached("books", lambda conn: [
+            _book_row(*r) for r in conn.execute("SELECT doc, available, issued_to FROM books ORDER BY rowid")])
+
+    def save_books(self, data):
+        with self._tx() as conn:
+            self._write_books(conn, data, replace=True)
+
+    def add_books(self, new_books):
+        with self._tx() as conn:
+            first = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM books").fetchone()[0]
+            ids = _assign_ids(new_books, first)
+            self._write_books(conn, new_books, replace=False)
+            return ids
+
+    def _write_books(self, conn, data, replace: bool):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key IN ('catalog_version', 'books_version')")
+        if replace:
+            keep = {b['id'] for b in data}
+            gone = [(r[0],) for r in conn.execute("SELECT id FROM books") if r[0] not in keep]
+            conn.executemany("DELETE FROM books WHERE id=?", gone)
+            conn.executemany("DELETE FROM book_genres WHERE book_id=?", gone)
+        conn.executemany(
+            "INSERT INTO books (id, title, author, available, issued_to, doc) VALUES (?,?,?,?,?,?) "
+            "ON CONFLICT(id) DO UPDATE SET title=excluded.title, author=excluded.author, "
+            "available=excluded.available, issued_to=excluded.issued_to, doc=excluded.doc",
+            [_book_params(b) for b in data])
+        conn.executemany("DELETE FROM book_genres WHERE book_id=?", [(b['id'],) for b in data])
+        conn.executemany("INSERT OR IGNORE INTO book_genres (book_id, genre) VALUES (?,?)",
+                         [(b['id'], g) for b in data for g in normalize_genres(b.get('genre'))])
+
+    def catalog_version(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key='catalog_version'").fetchone()[0]
+
+    def books_version(self):
+        return str(self._conn().execute("SELECT value FROM meta WHERE key='books_version'").fetchone()[0])
+
+    def _bump_books_version(self, conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key='books_version'")
+
+    def loans_version(self):
+        return str(self._conn().execute("SELECT value FROM meta WHERE key='loans_version'").fetchone()[0])
+
+    def _bump_loans_version(self, conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key='loans_version'")
+
+    def get_book(self, book_id):
+        row = self._conn().execute("SELECT doc, available, issued_to FROM books WHERE id=?", (book_id,)).fetchone()
+        return _book_row(*row) if row else None
+
+    # ---------- users ----------
+    def users(self):
+        return self._cached("users", lambda conn: [
+            json.loads(r[0]) for r in conn.execute("SELECT doc FROM users ORDER BY rowid")])
+
+    def save_users(self, data):
+        with self._tx() as conn:
+            keep = {u['email'].lower() for u in data}
+            conn.executemany("DELETE FROM users WHERE email=?",
+                             [(r[0],) for r in conn.execute("SELECT email FROM users") if r[0] not in keep])
+            self._write_users(conn, data)
+
+    def _write_users(self, conn, data):
+        conn.executemany(
+            "INSERT INTO users (email, doc) VALUES (?,?) ON CONFLICT(email) DO UPDATE SET doc=excluded.doc",
+            [(u['email'].lower(), json.dumps(u, ensure_ascii=False)) for u in data])
+
+    def get_user(self, email):
+        row = self._conn().execute("SELECT doc FROM users WHERE email=?", (email.strip().lower(),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_user(self, user):
+        with self._tx() as conn:
+            self._write_users(conn, [user])
+
+    # ---------- loans ----------
+    def issued(self):
+        return self._cached("issued", lambda conn: [
+            _loan_row(r) for r in conn.execute(f"SELECT {_LOAN_COLUMNS} FROM loans ORDER BY id")])
+
+    def save_issued(self, data):
+        with self._tx() as conn:
+            conn.execute("DELETE FROM loans")
+            self._write_loans(conn, data)
+
+    def _write_loans(self, conn, data):
+        self._bump_loans_version(conn)
+        conn.executemany(
+            f"INSERT INTO loans ({_LOAN_COLUMNS}) VALUES (?,?,?,?,?,?)",
+            [(r['user_email'].lower(), r['book_id'], r['issue_date'], r['due_date'],
+              1 if r.get('returned', False) else 0, r.get('return_date')) for r in data])
+
+    def active_issues(self, user_email):
+        rows = self._conn().execute(
+            f"SELECT {_LOAN_COLUMNS} FROM loans WHERE user_email=? AND returned=0 ORDER BY id",
+            (user_email.lower(),))
+        return [_loan_row(r) for r in rows]
+
+    def user_loans(self, user_email):
+        rows = self._conn().execute(
+            f"SELECT {_LOAN_COLUMNS} FROM loans WHERE user_email=? ORDER BY id", (user_email.lower(),))
+        return [_loan_row(r) for r in rows]
+
+    def active_loans(self):
+        rows = self._conn().execute(
+            f"SELECT {_LOAN_COLUMNS} FROM loans WHERE returned=0 ORDER BY due_date")
+        return [_loan_row(r) for r in rows]
+
+    def archived_loans(self, since=None, until=None, user_email=None, book_id=None):
+        # issue months are compared as text, like archive_filter()
+        sql, params = f"SELECT {_LOAN_COLUMNS} FROM loans WHERE returned=1", []
+        if since:
+            sql += " AND substr(issue_date, 1, 7) >= ?"
+            params.append(since[:7])
+        if until:
+            sql += " AND substr(issue_date, 1, 7) <= ?"
+            params.append(until[:7])
+        if user_email:
+            sql += " AND user_email=?"
+            params.append(user_email.lower())
+        if book_id is not None:
+            sql += " AND book_id=?"
+            params.append(book_id)
+        return [_loan_row(r) for r in self._conn().execute(sql + " ORDER BY id", params)]
+
+    def archive_months(self):
+        rows = self._conn().execute(
+            "SELECT DISTINCT substr(issue_date, 1, 7) FROM loans WHERE returned=1 ORDER BY 1")
+        return [r[0] for r in rows]
+
+    def issue(self, user_email, book_id, issue_date, due_date):
+        with self._tx() as conn:
+            row = conn.execute("SELECT doc, available, issued_to FROM books WHERE id=?", (book_id,)).fetchone()
+            if not row:
+                return "not_found", None
+            book = _book_row(*row)
+            if not book['available']:
+                return "unavailable", book
+            # compare-and-swap on the availability flag
+            cur = conn.execute("UPDATE books SET available=0, issued_to=? WHERE id=? AND available=1",
+                               (user_email, book_id))
+            if cur.rowcount != 1:
+                return "unavailable", book
+            self._bump_books_version(conn)
+            self._bump_loans_version(conn)
+            conn.execute(f"INSERT INTO loans ({_LOAN_COLUMNS}) VALUES (?,?,?,?,0,NULL)",
+                         (user_email, book_id, issue_date, due_date))
+            book['available'] = False
+            book['issued_to'] = user_email
+            return "ok", book
+
+    def return_book(self, user_email, book_id, return_date):
+        with self._tx() as conn:
+            row = conn.execute(
+                f"SELECT id, {_LOAN_COLUMNS} FROM loans WHERE user_email=? AND book_id=? AND returned=0 "
+                "ORDER BY id LIMIT 1", (user_email.lower(), book_id)).fetchone()
+            if not row:
+                return None
+            cur = conn.execute("UPDATE loans SET returned=1, return_date=? WHERE id=? AND returned=0",
+                               (return_date, row[0]))
+            if cur.rowcount != 1:
+                return None
+            conn.execute("UPDATE books SET available=1, issued_to=NULL WHERE id=?", (book_id,))
+            self._bump_books_version(conn)
+            self._bump_loans_version(conn)
+            return _loan_row(row[1:])
+
+    def issue_many(self, items, issue_date, due_date, all_or_nothing=False):
+        with self._tx() as conn:
+            ids = sorted({b for _, b in items})
+            marks = ",".join("?" * len(ids))
+            rows = conn.execute(f"SELECT id, doc, available, issued_to FROM books WHERE id IN ({marks})",
+                                ids).fetchall()
+            found = {r[0]: _book_row(*r[1:]) for r in rows}
+            results = settle_batch(plan_issues(items, found.get), all_or_nothing)
+            todo = [(email, book) for (email, _), (status, book) in zip(items, results) if status == "ok"]
+            if not todo:
+                return results
+            conn.executemany("UPDATE books SET available=0, issued_to=? WHERE id=?",
+                             [(email, book['id']) for email, book in todo])
+            conn.executemany(f"INSERT INTO loans ({_LOAN_COLUMNS}) VALUES (?,?,?,?,0,NULL)",
+                             [(email, book['id'], issue_date, due_date) for email, book in todo])
+            self._bump_books_version(conn)
+            self._bump_loans_version(conn)
+            for email, book in todo:
+                book['available'] = False
+                book['issued_to'] = email
+            return results
+
+    def return_many(self, items, return_date, all_or_nothing=False):
+        with self._tx() as conn:
+            loan_ids = {}
+
+            def find_active(user_email, book_id):
+                row = conn.execute(
+                    f"SELECT id, {_LOAN_COLUMNS} FROM loans WHERE user_email=? AND book_id=? AND returned=0 "
+                    "ORDER BY id LIMIT 1", (user_email, book_id)).fetchone()
+                if not row:
+                    return None
+                rec = _loan_row(row[1:])
+                loan_ids[id(rec)] = row[0]
+                return rec
+
+            results = settle_batch(plan_returns(items, find_active), all_or_nothing)
+            done = [rec for status, rec in results if status == "ok"]
+            if not done:
+                return results
+            conn.executemany("UPDATE loans SET returned=1, return_date=? WHERE id=?",
+                             [(return_date, loan_ids[id(rec)]) for rec in done])
+            conn.executemany("UPDATE books SET available=1, issued_to=NULL WHERE id=?",
+                             [(rec['book_id'],) for rec in done])
+            self._bump_books_version(conn)
+            self._bump_loans_version(conn)
+            return results
+
+    def migrate_from_json(self, books_file: str, users_file: str, issued_file: str,
+                          archive_dir: Optional[str] = None):
+        books = load_json(books_file, [])
+        users = load_json(users_file, [])
+        issued = read_loan_history(issued_file, archive_dir)
+        with self._tx() as conn:
+            self._write_books(conn, books, replace=True)
+            conn.execute("DELETE FROM users")
+            self._write_users(conn, users)
+            conn.execute("DELETE FROM loans")
+            self._write_loans(conn, issued)
+        return len(books), len(users), len(issued)
+
+# -------------------------
+# Backend selection
+# -------------------------
+_backends: Dict[tuple, Storage] = {}
+
+
+def get_storage(mode: str, books_file: str, users_file: str, issued_file: str,
+                journal_dir: str = "library_journal", db_path: str = "library.db",
+                snapshot_every: int = journal.DEFAULT_SNAPSHOT_EVERY,
+                compact_books_file: str = "books_hot.json", details_file: str = "books_details.jsonl",
+                archive_dir: Optional[str] = None) -> Storage:
+    archive_dir = archive_dir or default_archive_dir(issued_file)
+    key = (mode, books_file, users_file, issued_file, journal_dir, db_path, compact_books_file, details_file,
+           archive_dir)
+    with _lock:
+        backend = _backends.get(key)
+        if backend is not None:
+            return backend
+        if mode == "json":
+            backend = JsonStorage(books_file, users_file, issued_file, archive_dir)
+        elif mode == "journal":
+            backend = JournalStorage(books_file, users_file, issued_file, journal_dir, snapshot_every, archive_dir)
+        elif mode == "compact":
+            if not os.path.exists(compact_books_file):
+                # one-shot conversion from the pretty-printed catalog on first use
+                convert_to_compact(books_file, compact_books_file, details_file)
+            backend = CompactStorage(compact_books_file, details_file, users_file, issued_file, archive_dir)
+        elif mode == "sqlite":
+            fresh = not os.path.exists(db_path)
+            backend = SqliteStorage(db_path)
+            if fresh:
+                # one-shot migration from the JSON files on first use
+                backend.migrate_from_json(books_file, users_file, issued_file, archive_dir)
+        else:
+            raise ValueError(f"Unknown storage mode: {mode}")
+        _backends[key] = backend
+        return backend
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Migrate the JSON data files into a SQLite database, or convert the catalog "
+                    "to the compact hot/details format.")
+    parser.add_argument("--to", choices=["sqlite", "compact"], default="sqlite")
+    parser.add_argument("--books", default="books_data.json")
+    parser.add_argument("--users", default="users.json")
+    parser.add_argument("--issued", default="issued_books.json")
+    parser.add_argument("--db", default="library.db")
+    parser.add_argument("--archive", help="loan archive directory (default: loan_archive next to --issued)")
+    parser.add_argument("--hot", default="books_hot.json")
+    parser.add_argument("--details", default="books_details.jsonl")
+    args = parser.parse_args()
+    if args.to == "compact":
+        n_books = convert_to_compact(args.books, args.hot, args.details)
+        print(f"Converted {n_books} books into {args.hot} + {args.details}")
+    else:
+        n_books, n_users, n_loans = SqliteStorage(args.db).migrate_from_json(
+            args.books, args.users, args.issued,
+            args.archive or default_archive_dir(args.issued))
+        print(f"Migrated {n_books} books, {n_users} users and {n_loans} loans into {args.db}")